@@ -0,0 +1,181 @@
+"""
+The background_writer module contains a writer that saves the artifacts of a MAST-ML run (pickled models, csv files
+and stats) on a background thread, so fitting the next split overlaps with writing the results of the last one. Only
+file writes belong on it: matplotlib is not thread safe, so plots are drawn by the main thread or the plot pool
+"""
+
+import io
+import os
+import queue
+import logging
+import threading
+
+from sklearn.externals import joblib
+
+from mastml import utils
+
+log = logging.getLogger('mastml')
+
+def check_queue_size(write_queue_size):
+    """
+    Method to check the write_queue_size parameter parsed from the input configuration file
+
+    Args:
+
+        write_queue_size: (int or str), maximum number of artifacts waiting to be written. 0 turns background writing
+        off
+
+    Returns:
+
+        (int), the validated queue size
+
+    """
+    try:
+        write_queue_size = int(write_queue_size)
+    except ValueError:
+        raise utils.InvalidConfParameters(f"[GeneralSetup] write_queue_size must be an integer, "
+                                          f"not '{write_queue_size}'")
+    if write_queue_size < 0:
+        raise utils.InvalidConfParameters(f"[GeneralSetup] write_queue_size must be a non-negative integer, "
+                                          f"not {write_queue_size}")
+    return write_queue_size
+
+class BackgroundWriter(object):
+    """
+    Class that runs I/O tasks in submission order on a single background thread. The queue of pending tasks is bounded,
+    so a compute loop that produces results faster than they can be written waits for the writer (backpressure)
+    instead of holding every unwritten result in memory.
+
+    Args:
+
+        max_pending: (int), maximum number of tasks waiting to be written. 0 means tasks are run right away, in the
+        calling thread
+
+    Methods:
+
+        submit: hands a task to the writer, blocking while the queue is full
+
+            Args:
+
+                function: (callable), the task to run
+
+                args, kwargs: arguments of function. They should not be modified by the caller afterwards
+
+            Returns:
+
+                None
+
+        dump_model: pickles a fitted model into memory right away and hands the file write to the writer, so the
+        caller can refit the same model instance on the next split
+
+            Args:
+
+                model: (scikit-learn model object), the fitted model
+
+                path: (str), path of the .pkl file to write
+
+            Returns:
+
+                None
+
+        flush: waits until every submitted task has been written (a barrier), raising the first error a task hit
+
+            Args:
+
+                None
+
+            Returns:
+
+                None
+
+        close: flushes and stops the background thread
+
+            Args:
+
+                None
+
+            Returns:
+
+                None
+
+    """
+
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self._queue = None
+        self._thread = None
+        self._pid = os.getpid()
+        self._error = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        self._raise_error()
+        if not self._is_async():
+            function(*args, **kwargs)
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._start()
+        self._queue.put((function, args, kwargs))
+
+    def dump_model(self, model, path):
+        buffer = io.BytesIO()
+        joblib.dump(model, buffer)
+        self.submit(_write_bytes, path, buffer.getvalue())
+
+    def flush(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._thread is not None and self._pid == os.getpid():
+            # Don't hide the original error behind one from the writer
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _is_async(self):
+        # Threads don't survive a fork, so workers of the 'processes' backend write their own results right away
+        return self.max_pending > 0 and self._pid == os.getpid()
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._thread = threading.Thread(target=self._run, name='mastml-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    function, args, kwargs = task
+                    function(*args, **kwargs)
+            except Exception as e:
+                log.error(f'Background write failed: {str(e)}')
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
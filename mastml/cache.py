@@ -0,0 +1,157 @@
+"""
+The cache module contains a small persistent key-value store, used to keep generated features and downloaded data
+between MAST-ML runs
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger('mastml')
+
+# SQLite limits the number of parameters in a single statement
+_CHUNK_SIZE = 500
+
+def open_cache(path, namespace='', max_size_mb=None, ttl=None):
+    """
+    Method to open the DiskCache at path, or get no cache when no path is given
+
+    Args:
+
+        path: (str or None), path of the SQLite file. None, or the 'None' or blank value a conf file gives for a missing
+        path, means no cache
+
+        namespace, max_size_mb, ttl: passed on to DiskCache
+
+    Returns:
+
+        (DiskCache or None), the cache, or None when there is no path
+
+    """
+    if path is None or path in ('None', ''):
+        return None
+    return DiskCache(path, namespace=namespace, max_size_mb=max_size_mb, ttl=ttl)
+
+class DiskCache(object):
+    """
+    Class for a persistent key-value cache stored in a single SQLite file. Values can be any picklable object. When the
+    stored values grow past max_size_mb, the least recently used entries are evicted.
+
+    Args:
+
+        path: (str), path of the SQLite file, which is created if it doesn't exist
+
+        namespace: (str), string prefixed to every key, e.g. a hash of the data the values were computed from. Entries
+        from other namespaces are never returned, and are evicted first as they are no longer used
+
+        max_size_mb: (float), maximum total size of the stored values in MB, or None for no limit
+
+        ttl: (float), number of seconds after which an entry expires, or None for entries that never expire
+
+    Methods:
+
+        get_many: look up several keys at once
+
+            Args:
+
+                keys: (list), list of str keys
+
+            Returns:
+
+                (dict), dict of key to value for the keys found in the cache
+
+        put_many: store several values at once, then evict entries to stay within max_size_mb
+
+            Args:
+
+                items: (dict), dict of str key to value
+
+            Returns:
+
+                None
+
+    """
+    def __init__(self, path, namespace='', max_size_mb=None, ttl=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.namespace = namespace
+        self.max_size_mb = max_size_mb
+        self.ttl = ttl
+        dirname = os.path.dirname(self.path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, nbytes INTEGER, '
+                         'created REAL, last_access REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+
+    @contextmanager
+    def _connect(self):
+        # A new connection per operation keeps the cache usable from several threads
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _full_key(self, key):
+        return self.namespace + ':' + key
+
+    def get_many(self, keys):
+        full_keys = {self._full_key(key): key for key in keys}
+        now = time.time()
+        found = dict()
+        with self._connect() as conn:
+            if self.ttl is not None:
+                # Other namespaces sharing the file may have a different ttl, so only expire entries of this one
+                prefix = self._full_key('')
+                conn.execute('DELETE FROM cache WHERE created < ? AND substr(key, 1, ?) = ?',
+                             (now - self.ttl, len(prefix), prefix))
+            full_key_list = list(full_keys)
+            for start in range(0, len(full_key_list), _CHUNK_SIZE):
+                chunk = full_key_list[start:start+_CHUNK_SIZE]
+                marks = ','.join('?' * len(chunk))
+                rows = conn.execute(f'SELECT key, value FROM cache WHERE key IN ({marks})', chunk).fetchall()
+                for full_key, value in rows:
+                    found[full_keys[full_key]] = pickle.loads(value)
+                conn.execute(f'UPDATE cache SET last_access = ? WHERE key IN ({marks})', [now] + chunk)
+        log.debug(f'{len(found)}/{len(full_keys)} cache hits in {self.path}')
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = list()
+        for key, value in items.items():
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((self._full_key(key), sqlite3.Binary(blob), len(blob), now, now))
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)', rows)
+            self._evict(conn)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def _evict(self, conn):
+        if self.max_size_mb is None:
+            return
+        max_bytes = self.max_size_mb * 1e6
+        total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM cache').fetchone()[0]
+        if total <= max_bytes:
+            return
+        # Walk from the least recently used entry until enough has been freed
+        evicted = list()
+        for key, nbytes in conn.execute('SELECT key, nbytes FROM cache ORDER BY last_access ASC').fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append(key)
+            total -= nbytes
+        for start in range(0, len(evicted), _CHUNK_SIZE):
+            chunk = evicted[start:start+_CHUNK_SIZE]
+            conn.execute(f'DELETE FROM cache WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+        log.debug(f'Evicted {len(evicted)} entries from {self.path}')
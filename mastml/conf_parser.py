@@ -5,8 +5,9 @@ The conf_parser module is used for handling, parsing, and checking MAST-ML input
 from sklearn.metrics import make_scorer
 from configobj import ConfigObj
 import logging
+from collections import OrderedDict
 
-from mastml import metrics, utils
+from mastml import metrics, utils, parallel, data_loader, result_store, background_writer, render
 from mastml.legos.model_finder import check_models_mixed
 from mastml.legos import feature_selectors, model_finder
 
@@ -89,7 +90,9 @@ def parse_conf_file(filepath):
 
     def check_general_setup_settings_are_valid():
         all_settings =  ['input_features', 'target_feature', 'metrics',
-                         'randomizer', 'validation_columns', 'not_input_features', 'grouping_feature']
+                         'randomizer', 'validation_columns', 'not_input_features', 'grouping_feature',
+                         'n_jobs', 'backend', 'parallel_over', 'memory_budget', 'chunksize', 'float_dtype',
+                         'result_format', 'write_queue_size']
         for name in GS:
             if name not in all_settings:
                 raise utils.InvalidConfParameters(
@@ -138,6 +141,33 @@ def parse_conf_file(filepath):
             GS['randomizer'] = False
     set_randomizer_setting()
 
+    def set_parallel_settings():
+        GS['n_jobs'], GS['backend'] = parallel.check_backend(GS.get('n_jobs', 1),
+                                                             GS.get('backend', 'processes'))
+        GS['parallel_over'], GS['memory_budget'] = parallel.check_parallel_level(GS.get('parallel_over', 'splits'),
+                                                                                 GS.get('memory_budget', None))
+    set_parallel_settings()
+
+    def set_loading_settings():
+        GS['chunksize'] = GS.get('chunksize', None)
+        if GS['chunksize'] is not None:
+            try:
+                GS['chunksize'] = int(GS['chunksize'])
+            except ValueError:
+                raise utils.InvalidConfParameters(f"[GeneralSetup] chunksize must be an integer, "
+                                                  f"not '{GS['chunksize']}'")
+            if GS['chunksize'] < 1:
+                raise utils.InvalidConfParameters(f"[GeneralSetup] chunksize must be a positive number of rows, "
+                                                  f"not {GS['chunksize']}")
+        GS['float_dtype'] = GS.get('float_dtype', None)
+        if GS['float_dtype'] is not None and GS['float_dtype'] not in data_loader.FLOAT_DTYPES:
+            raise utils.InvalidConfParameters(f"[GeneralSetup] float_dtype must be one of {data_loader.FLOAT_DTYPES}, "
+                                              f"not '{GS['float_dtype']}'")
+    set_loading_settings()
+
+    GS['result_format'] = result_store.check_result_format(GS.get('result_format', 'csv'))
+    GS['write_queue_size'] = background_writer.check_queue_size(GS.get('write_queue_size', 16))
+
 
     def set_default_features():
         for name in ['input_features', 'target_feature']:
@@ -194,14 +224,22 @@ def parse_conf_file(filepath):
     make_long_name_short_name_pairs()
 
     def check_and_boolify_plot_settings():
-        default_false = ['feature_vs_target', 'error_plots', 'average_error_plots']
+        default_false = ['feature_vs_target', 'error_plots', 'average_error_plots', 'defer_rendering']
         default_true = ['target_histogram', 'train_test_plots', 'predicted_vs_true',
                          'predicted_vs_true_bars', 'best_worst_per_point']
         all_settings = default_false + default_true
         if 'PlotSettings' not in conf:
             conf['PlotSettings'] = dict()
         PS = conf['PlotSettings']
+        # The number of processes drawing the plots and the notebook mode are the only settings that aren't booleans
+        PS['n_jobs'], _ = parallel.check_backend(PS.get('n_jobs', 1), 'processes', section='PlotSettings')
+        PS['notebooks'] = PS.get('notebooks', 'inline')
+        if PS['notebooks'] not in render.NOTEBOOK_MODES:
+            raise utils.InvalidConfParameters(f"[PlotSettings] notebooks '{PS['notebooks']}' is unknown. "
+                                              f"Valid choices: {render.NOTEBOOK_MODES}")
         for name, value in PS.items():
+            if name in ['n_jobs', 'notebooks']:
+                continue
             if name not in all_settings:
                 raise utils.InvalidConfParameters(f"[PlotSettings] parameter '{name}' is unknown")
             try:
@@ -235,6 +273,36 @@ def parse_conf_file(filepath):
 
     return conf
 
+# Parameters of the conf file subsections whose values name columns of the data file
+COLUMN_PARAMETERS = ['grouping_column', 'composition_feature', 'features']
+
+def get_extra_columns(conf):
+    """
+    Method to list the columns of the data file that a parsed configuration file uses besides the input, target,
+    grouping and not_input features, e.g. the validation columns or the composition column of a feature generator.
+    The columnar data loader only keeps the columns it is told about, so it needs these too
+
+    Args:
+        conf: (dict), dictionary returned by parse_conf_file
+
+    Returns:
+        columns: (list), list of column names
+
+    """
+    columns = list()
+    validation_columns = conf['GeneralSetup'].get('validation_columns', list())
+    if isinstance(validation_columns, str):
+        validation_columns = [validation_columns]
+    columns.extend(validation_columns)
+    for section in ['DataSplits', 'FeatureGeneration', 'Clustering', 'FeatureNormalization', 'FeatureSelection']:
+        for _, kwargs in conf[section].values():
+            for parameter in COLUMN_PARAMETERS:
+                value = kwargs.get(parameter, list())
+                if isinstance(value, str):
+                    value = [value]
+                columns.extend(column for column in value if isinstance(column, str))
+    return list(OrderedDict.fromkeys(columns))
+
 def fix_types(maybe_list):
     """
     Method that returns true datatype of values passed as string or list of strings, parsed from configuration file
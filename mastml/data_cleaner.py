@@ -26,7 +26,9 @@ def remove(df, axis):
     """
     df_nan = df[pd.isnull(df)]
     nan_indices = df_nan.index
-    df = df.dropna(axis=axis, how='any')
+    # dropna always copies, so only call it when there is something to drop, keeping any buffers df shares with others
+    if pd.isnull(df).values.any():
+        df = df.dropna(axis=axis, how='any')
     return df, nan_indices
 
 def imputation(df, strategy, cols_to_leave_out=None):
@@ -2,12 +2,23 @@
 The data_loader module is used for importing data from user-specified csv or xlsx file to MAST-ML
 """
 
-import pandas as pd
 import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
 from mastml import utils
 log = logging.getLogger('mastml')
 
-def load_data(file_path, input_features=None, target_feature=None, grouping_feature = None, feature_blacklist=list()):
+# Valid choices for the [GeneralSetup] float_dtype parameter
+FLOAT_DTYPES = ['float64', 'float32']
+
+# Number of rows parsed at a time by the columnar loader when no chunksize is given
+DEFAULT_CHUNKSIZE = 100000
+
+def load_data(file_path, input_features=None, target_feature=None, grouping_feature = None, feature_blacklist=list(),
+              extra_features=list(), chunksize=None, float_dtype=None):
     """
     Method that accepts the filepath of an input data file and returns a full dataframe and parsed X and y dataframes
 
@@ -21,6 +32,17 @@ def load_data(file_path, input_features=None, target_feature=None, grouping_feat
 
         grouping_feature: (str), column names used to group data in user-defined grouping scheme
 
+        feature_blacklist: (list), column names that are kept out of X, e.g. the not_input_features
+
+        extra_features: (list), other column names that are needed later on (e.g. the validation columns, or the
+        grouping_column of a data splitter), see conf_parser.get_extra_columns. Only used by the columnar loader, and
+        ignored when the data file doesn't have them
+
+        chunksize: (int), if given, use the columnar loader, parsing this many rows at a time
+
+        float_dtype: (str), if given, use the columnar loader and store the input features with this dtype, one of
+        'float64' or 'float32'
+
     Returns:
         df: (dataframe), full dataframe of the input X data (y data is removed)
 
@@ -34,33 +56,17 @@ def load_data(file_path, input_features=None, target_feature=None, grouping_feat
 
     """
 
+    if chunksize is not None or float_dtype is not None:
+        return _load_data_columnar(file_path, input_features, target_feature, grouping_feature, feature_blacklist,
+                                   extra_features, chunksize or DEFAULT_CHUNKSIZE, float_dtype or 'float64')
+
     # Load data
     try:
         df = pd.read_csv(file_path)
     except:
         df = pd.read_excel(file_path)
 
-    # Assign default values to input_features and target_feature;
-    if input_features is None and target_feature is None: # input is first n-1 and target is just n
-        input_features = list(df.columns[:-1])
-        target_feature = df.columns[-1]
-    elif input_features is None: # input is all the features except the target feature
-        input_features = [col for col in df.columns if col != target_feature]
-    elif target_feature is None: # target is the last non-input feature
-        for col in df.columns[::-1]:
-            if col not in input_features:
-                target_feature = col
-                break
-
-    # Collect required features:
-    if type(input_features) is str:
-        input_features = [input_features]
-    required_features = input_features + [target_feature]
-
-    # Ensure they are all present:
-    for feature in required_features:
-        if feature not in df.columns:
-            raise Exception(f"Data file does not have column '{feature}'")
+    input_features, target_feature = _resolve_features(df.columns, input_features, target_feature)
 
     X, y = df[input_features], df[target_feature]
 
@@ -97,3 +103,108 @@ def load_data(file_path, input_features=None, target_feature=None, grouping_feat
                                   '"not_input_features" fields. Please correct your input file and re-run MAST-ML')
 
     return df, X, X_noinput, X_grouped, y
+
+def _resolve_features(columns, input_features, target_feature):
+    # Assign default values to input_features and target_feature;
+    if input_features is None and target_feature is None: # input is first n-1 and target is just n
+        input_features = list(columns[:-1])
+        target_feature = columns[-1]
+    elif input_features is None: # input is all the features except the target feature
+        input_features = [col for col in columns if col != target_feature]
+    elif target_feature is None: # target is the last non-input feature
+        for col in columns[::-1]:
+            if col not in input_features:
+                target_feature = col
+                break
+
+    # Collect required features:
+    if type(input_features) is str:
+        input_features = [input_features]
+    required_features = input_features + [target_feature]
+
+    # Ensure they are all present:
+    for feature in required_features:
+        if feature not in columns:
+            raise Exception(f"Data file does not have column '{feature}'")
+
+    return input_features, target_feature
+
+def _load_data_columnar(file_path, input_features, target_feature, grouping_feature, feature_blacklist, extra_features,
+                        chunksize, float_dtype):
+    """
+    Same as load_data, but streams the data file in chunks of rows and only keeps the columns the conf file names. The
+    input features are parsed straight into a single preallocated float_dtype array, which X and df both use without
+    copying it
+    """
+    if float_dtype not in FLOAT_DTYPES:
+        raise utils.InvalidConfParameters(f"[GeneralSetup] float_dtype must be one of {FLOAT_DTYPES}, not '{float_dtype}'")
+
+    # Only the header is read here, the rows are streamed below
+    try:
+        columns = list(pd.read_csv(file_path, nrows=0).columns)
+        excel_df = None
+    except:
+        excel_df = pd.read_excel(file_path)
+        columns = list(excel_df.columns)
+
+    read_all_columns = input_features is None
+    input_features, target_feature = _resolve_features(columns, input_features, target_feature)
+
+    log.info('blacklisted features, either from "not_input_features" or a "grouping_column":' +
+                 str(feature_blacklist))
+    blacklist = list(OrderedDict.fromkeys(feature_blacklist))
+    for feature in blacklist + ([grouping_feature] if grouping_feature else []):
+        if feature not in columns:
+            raise utils.MissingColumnError(f"Data file does not have column '{feature}'")
+    x_features = [feature for feature in input_features if feature not in blacklist]
+    if read_all_columns:
+        kept_features = columns
+    else:
+        kept_features = input_features + [target_feature] + blacklist + [grouping_feature] + list(extra_features)
+    other_features = [feature for feature in OrderedDict.fromkeys(kept_features)
+                      if feature in columns and feature not in x_features and feature != target_feature]
+    usecols = set(x_features + other_features + [target_feature])
+
+    if excel_df is None:
+        # A first pass over a single column counts the rows, so the feature array can be allocated up front
+        n_rows = sum(len(chunk) for chunk in pd.read_csv(file_path, usecols=[target_feature], chunksize=chunksize))
+        dtype = {feature: float_dtype for feature in x_features}
+        chunks = pd.read_csv(file_path, usecols=lambda column: column in usecols, dtype=dtype, chunksize=chunksize)
+    else:
+        n_rows = excel_df.shape[0]
+        chunks = [excel_df]
+
+    feature_values = np.empty((n_rows, len(x_features)), dtype=float_dtype)
+    other_chunks = list()
+    y_chunks = list()
+    start = 0
+    try:
+        for chunk in chunks:
+            feature_values[start:start+chunk.shape[0]] = chunk[x_features].values
+            other_chunks.append(chunk[other_features])
+            y_chunks.append(chunk[target_feature])
+            start += chunk.shape[0]
+    except ValueError as e:
+        log.error(f'original python error: {str(e)}')
+        raise utils.InvalidValue('MAST-ML has detected that one of your feature vectors contains a string, and cannot be '
+                                 'used in model fitting. Please add any features that contain strings to the '
+                                 '"not_input_features" field of the input file')
+    del excel_df
+
+    index = pd.RangeIndex(n_rows)
+    X = pd.DataFrame(feature_values, columns=x_features, index=index, copy=False)
+    y = pd.concat(y_chunks)
+    y.index = index
+    other = pd.concat(other_chunks)
+    other.index = index
+    # copy=False lets df hold the same feature array as X
+    df = pd.concat([X, other], axis=1, copy=False)
+
+    X_noinput = other[blacklist]
+    if grouping_feature:
+        X_grouped = pd.DataFrame(other[grouping_feature])
+    else:
+        X_grouped = None
+
+    log.info(f'Loaded {n_rows} rows and {len(x_features)} input features as {float_dtype}')
+    return df, X, X_noinput, X_grouped, y
@@ -2,9 +2,17 @@
 Module for generating an HTML file, called index.html, which contains an overview of the key data and plots from a
 MAST-ML run. Images of cross-validation parity plots, data histograms, data statistics, and links to the relevant files
 are all provided.
+
+The driver, the background writer and the plot methods add every file they write, and each finished combo, to a small
+manifest (report_manifest.jsonl) as the run goes on, and the pages are built from it rather than by crawling the output
+directory. Every combo gets its own pages in the report folder, with its splits split across pages and images loaded
+lazily, and a row is appended to index.html as each combo finishes, so a run can be browsed before it is done.
 """
 
 import os
+import json
+import threading
+from collections import defaultdict
 from os.path import join, relpath # because it's used so much
 from time import gmtime, strftime
 import logging
@@ -13,9 +21,216 @@ from dominate.tags import *
 
 log = logging.getLogger('mastml')
 
+MANIFEST_FILENAME = 'report_manifest.jsonl'
+
+# Folder of the output directory holding the combo pages
+REPORT_DIRNAME = 'report'
+
+# Number of splits shown on each page of a combo
+SPLITS_PER_PAGE = 20
+
+# Data files that are linked from index.html when they are in the top folder of the output directory
+CSV_WHITELIST = ['clusters.csv', 'generated_features.csv', 'generated_features_no_constant_columns.csv', 'grouped.csv',
+                 'input_data_statistics.csv', 'normalized.csv', 'selected.csv']
+
+# Files plots write besides their image, as suffixes of the image path without its .png extension
+_PLOT_SUFFIXES = ['', '.png', '.csv', '_best.csv', '_worst.csv', '.png.ipynb', '.png.args.pkl', '.ipynb', '.args.pkl']
+
+# Files plots write under a fixed name to the folder of their image
+_PLOT_SIBLINGS = ['residuals.csv', 'residual_statistics.csv', 'input_data_statistics.csv']
+
+_manifest_lock = threading.Lock()
+
+# Output directory of the run whose written files are added to the manifest, see record_artifacts
+_report_outdir = None
+
+# The files added by this process, as sets of file names by folder (relative to the output directory), so the pages of a
+# combo are made without reading the manifest back
+_artifacts = defaultdict(set)
+
+def start_report(outdir):
+    """
+    Method used at the start of a run to record the files it writes, and to start the index.html file that a row is
+    appended to as each combo finishes
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+    Returns:
+
+        None
+
+    """
+    record_artifacts(outdir)
+    with document(title='MASTML') as doc:
+        h1('MAterial Science Tools - Machine Learning')
+        h4(strftime("%Y-%m-%d %H:%M:%S", gmtime()))
+        p('The run is still going. The files and plots of the whole run are shown once it is done.')
+        h1('Combos (finished so far)')
+    # Browsers show a page without its closing tags, so the rows can be appended to the end of it
+    page = doc.render()
+    _write_text(join(outdir, 'index.html'), page[:page.rindex('</body>')])
+
+def record_artifacts(outdir):
+    """
+    Method used to start (or stop) adding the files written by this process to the manifest of a run
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written, or None
+        to stop recording
+
+    Returns:
+
+        None
+
+    """
+    global _report_outdir
+    _report_outdir = outdir
+    _artifacts.clear()
+
+def get_report_outdir():
+    """
+    Method used to get the output directory whose manifest this process adds files to, so it can be given to the
+    processes that draw plots
+
+    Args:
+
+        None
+
+    Returns:
+
+        (str), the output directory, or None when files are not recorded
+
+    """
+    return _report_outdir
+
+def add_artifact(path):
+    """
+    Method used to add a written file (a plot, csv or pickled model) to the manifest, so the pages of its combo link it.
+    Does nothing when files are not recorded
+
+    Args:
+
+        path: (str), path of the file
+
+    Returns:
+
+        None
+
+    """
+    if _report_outdir is None:
+        return
+    path = relpath(os.path.abspath(path), os.path.abspath(_report_outdir))
+    folder, name = os.path.split(path)
+    _artifacts[folder].add(name)
+    _append_to_manifest(_report_outdir, {'kind': 'artifact', 'path': path})
+
+def add_plot(function_name, arguments, output):
+    """
+    Method used to add the files written by a plot method (its image, csv files and notebook) to the manifest
+
+    Args:
+
+        function_name: (str), name of the plot method
+
+        arguments: (dict), the arguments of the plot call, which has a "savepath" or "outdir" argument
+
+        output: (object), what the plot method returned. Methods with an "outdir" return the names of their images
+
+    Returns:
+
+        None
+
+    """
+    if _report_outdir is None:
+        return
+    if 'savepath' in arguments:
+        candidates = [arguments['savepath']]
+    else:
+        # The notebook of these methods is named after the method
+        candidates = [join(arguments['outdir'], name) for name in list(output or []) +
+                      [function_name + '.ipynb', function_name + '.args.pkl']]
+    paths = list()
+    for candidate in candidates:
+        stem = candidate[:-len('.png')] if candidate.endswith('.png') else candidate
+        paths.extend(stem + suffix for suffix in _PLOT_SUFFIXES)
+        paths.extend(join(os.path.dirname(candidate), name) for name in _PLOT_SIBLINGS)
+    for path in sorted(set(paths)):
+        if os.path.isfile(path):
+            add_artifact(path)
+
+def add_file(outdir, path):
+    """
+    Method used to add a data file (e.g. a normalized.csv or selected.csv) to the links of the index.html file
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+        path: (str), path of the file
+
+    Returns:
+
+        None
+
+    """
+    _append_to_manifest(outdir, {'kind': 'file', 'path': relpath(path, outdir)})
+
+def add_combo(outdir, combo_dir, n_splits):
+    """
+    Method used to add a finished combo to the report. Writes the pages of the combo from the files this process has
+    added, and appends the combo to index.html
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+        combo_dir: (str), path of the combo, e.g. results/StandardScaler/SelectKBest/LinearRegression/KFold
+
+        n_splits: (int), number of split_ folders of the combo
+
+    Returns:
+
+        None
+
+    """
+    entry = {'kind': 'combo', 'path': relpath(combo_dir, outdir), 'n_splits': n_splits}
+    # make_html remakes the pages if files were added afterwards (or by other processes), e.g. by the plot pool
+    entry['n_files'] = _count_combo_files(entry, _artifacts)
+    _append_to_manifest(outdir, entry)
+    make_combo_pages(outdir, entry, _artifacts)
+    row = _combo_row(entry)
+    with _manifest_lock:
+        with open(join(outdir, 'index.html'), 'a') as f:
+            f.write(row.render() + '\n')
+
+def read_manifest(outdir):
+    """
+    Method used to read the manifest of a run. Runs made before there was a manifest get one from a walk of the output
+    directory
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+    Returns:
+
+        (list), list of the manifest entries, dicts with a 'kind' ('file', 'artifact' or 'combo') and a 'path' relative
+        to outdir
+
+    """
+    manifest_path = join(outdir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return _walk_for_manifest(outdir)
+    with open(manifest_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
 def make_html(outdir):
     """
-    Method used to create the main index.html file
+    Method used to create the main index.html file, and the pages of the combos that files were added to after their
+    pages were made
 
     Args:
 
@@ -25,6 +240,49 @@ def make_html(outdir):
 
         None
 
+    """
+    manifest = read_manifest(outdir)
+    files = manifest_files(manifest)
+    for entry in manifest:
+        if entry['kind'] == 'combo' and entry.get('n_files') != _count_combo_files(entry, files):
+            make_combo_pages(outdir, entry, files)
+    make_index(outdir, manifest)
+
+def manifest_files(manifest):
+    """
+    Method used to collect the files of the manifest entries of a run
+
+    Args:
+
+        manifest: (list), the manifest entries of the run, see read_manifest
+
+    Returns:
+
+        (dict), sets of file names by folder, relative to the output directory
+
+    """
+    files = defaultdict(set)
+    for entry in manifest:
+        if entry['kind'] == 'artifact':
+            folder, name = os.path.split(entry['path'])
+            files[folder].add(name)
+    return files
+
+def make_index(outdir, manifest):
+    """
+    Method used to create the main index.html file, which links the data files, shows the plots of the whole run and
+    links the pages of each combo
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+        manifest: (list), the manifest entries of the run, see read_manifest
+
+    Returns:
+
+        None
+
     """
 
     with document(title='MASTML') as doc:
@@ -36,64 +294,134 @@ def make_html(outdir):
         #if errors_present:
         #    p('You have errors! check ', make_link(error_log))
 
-        combos = list()
-        link_sections = list()
-        #favorites = dict()
-
-        for root, dirs, files in os.walk(outdir):
-            # find a folder that contains split_ folder.
-            # For example, results/StandardScaler/SelectKBest/LinearRegression/KFold
-            for d in dirs:
-                if d.startswith('split_0'):
-                    combos.append(root)
-
-            # extract links to important csvs and conf
-            for f in files:
-                csv_whitelist = [
-                    'clusters.csv', 'generated_features.csv',
-                    'generated_features_no_constant_columns.csv', 'grouped.csv',
-                    'input_data_statistics.csv', 'normalized.csv', 'selected.csv', ]
-                ext = os.path.splitext(f)[1]
-                if f in csv_whitelist or ext in ['.conf', '.log']:
-                    link_sections.append(join(root, f))
-                    #simple_section(join(root, f), outdir)
+        top_files = sorted(manifest_files(manifest)[''])
+        link_sections = [f for f in top_files if f in CSV_WHITELIST or os.path.splitext(f)[1] in ['.conf', '.log']]
+        link_sections += [entry['path'] for entry in manifest if entry['kind'] == 'file']
 
         h1('Files')
         for path in link_sections:
-            simple_section(path, outdir)
+            simple_section(join(outdir, path), outdir)
 
         h1('Plots')
 
         # show all the images
-        for f in os.listdir(outdir):
+        for f in top_files:
             if f.endswith('.png'):
                 make_image(f, f)
 
-        for combo in combos:
-            # come up with a good section title
-            path = os.path.normpath(relpath(combo, outdir))
-            paths = path.split(os.sep)
-            title = " - ".join(paths)
-            h2(title)
+        combos = [entry for entry in manifest if entry['kind'] == 'combo']
+        h1(f'Combos ({len(combos)} finished)')
+        for entry in combos:
+            _combo_row(entry)
+
+    _write_page(join(outdir, 'index.html'), doc)
+    log.info('wrote ' + join(outdir, 'index.html'))
+
+def make_combo_pages(outdir, entry, files):
+    """
+    Method used to create the pages of a combo, which show the plots of the combo and of SPLITS_PER_PAGE of its
+    splits each
+
+    Args:
+
+        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+
+        entry: (dict), the manifest entry of the combo
+
+        files: (dict), sets of file names by folder relative to outdir, see manifest_files
+
+    Returns:
+
+        None
+
+    """
+    combo = join(outdir, entry['path'])
+    report_dir = join(outdir, REPORT_DIRNAME)
+    os.makedirs(report_dir, exist_ok=True)
+    title = " - ".join(os.path.normpath(entry['path']).split(os.sep))
+    page_paths = _combo_page_paths(entry)
+    combo_files = sorted(files.get(os.path.normpath(entry['path']), ()))
+
+    for page_num, page_path in enumerate(page_paths):
+        with document(title=title) as doc:
+            h1(title)
+            make_link_text('index', relpath(join(outdir, 'index.html'), report_dir))
+            for other_num, other_path in enumerate(page_paths):
+                if other_num != page_num:
+                    make_link_text(str(other_num+1), os.path.basename(other_path))
+            br()
 
             # find the best worst overlay
-            for fname in os.listdir(combo):
+            for fname in combo_files:
                 if fname.endswith('.png'):
                     h3(os.path.splitext(fname)[0]) # probably best_worst overlay
-                    make_image(relpath(join(combo, fname), outdir), fname)
+                    make_image(relpath(join(combo, fname), report_dir), fname)
                     br()
 
-            # find the split_0 split_1 etc bs stuff
-            for fname in os.listdir(combo):
-                if fname.startswith('split_'):
-                    show_combo(join(combo, fname), outdir)
-
-    with open(join(outdir, 'index.html'), 'w') as f:
-        f.write(doc.render())
-
-    log.info('wrote ' + join(outdir, 'index.html'))
-
-def show_combo(combo_dir, outdir):
+            # the split_0 split_1 etc of this page
+            first_split = page_num*SPLITS_PER_PAGE
+            for split_num in range(first_split, min(first_split+SPLITS_PER_PAGE, entry['n_splits'])):
+                split_files = files.get(join(os.path.normpath(entry['path']), f'split_{split_num}'))
+                if split_files:
+                    show_combo(join(combo, f'split_{split_num}'), report_dir, split_files)
+
+        _write_page(join(outdir, page_path), doc)
+
+def _combo_row(entry):
+    # The line of a combo in index.html
+    title = " - ".join(os.path.normpath(entry['path']).split(os.sep))
+    page_paths = _combo_page_paths(entry)
+    with div() as row:
+        a(b(title), href=page_paths[0])
+        span(f"  {entry['n_splits']} splits")
+        if len(page_paths) > 1:
+            for page_num, page_path in enumerate(page_paths):
+                make_link_text(str(page_num+1), page_path)
+    return row
+
+def _count_combo_files(entry, files):
+    path = os.path.normpath(entry['path'])
+    return len(files.get(path, ())) + sum(len(files.get(join(path, f'split_{split_num}'), ()))
+                                          for split_num in range(entry['n_splits']))
+
+def _combo_page_paths(entry):
+    name = '__'.join(os.path.normpath(entry['path']).split(os.sep))
+    n_pages = max(1, -(-entry['n_splits'] // SPLITS_PER_PAGE))
+    return [join(REPORT_DIRNAME, name + ('' if page_num == 0 else f'_{page_num+1}') + '.html')
+            for page_num in range(n_pages)]
+
+def _append_to_manifest(outdir, entry):
+    # One write per line, so lines from threads and forked workers don't interleave
+    with _manifest_lock:
+        with open(join(outdir, MANIFEST_FILENAME), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+def _write_page(path, doc):
+    _write_text(path, doc.render())
+
+def _write_text(path, text):
+    # Written to a temporary file first, so a page that is being browsed is never half written
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+def _walk_for_manifest(outdir):
+    manifest = list()
+    for root, dirs, files in os.walk(outdir):
+        # find a folder that contains split_ folder.
+        # For example, results/StandardScaler/SelectKBest/LinearRegression/KFold
+        n_splits = len([d for d in dirs if d.startswith('split_')])
+        if 'split_0' in dirs:
+            manifest.append({'kind': 'combo', 'path': relpath(root, outdir), 'n_splits': n_splits})
+        for f in files:
+            manifest.append({'kind': 'artifact', 'path': relpath(join(root, f), outdir)})
+            # links to important csvs below the top folder
+            if root != outdir and (f in CSV_WHITELIST or os.path.splitext(f)[1] in ['.conf', '.log']):
+                manifest.append({'kind': 'file', 'path': relpath(join(root, f), outdir)})
+    return manifest
+
+def show_combo(combo_dir, outdir, filenames):
     """
     Method used to collect combinations of data analysis (e.g. parity plots of train and test data in a CV split) and
     required file paths and display them in the output index.html file.
@@ -102,7 +430,9 @@ def show_combo(combo_dir, outdir):
 
         combo_dir: (str), path containing the relevant data to combine as output in the index.html file
 
-        outdir: (str), user-specified output path which designates where all results of MAST-ML run are written
+        outdir: (str), folder of the page being made, which the image and file paths are made relative to
+
+        filenames: (iterable), names of the files in combo_dir, from the manifest
 
     Returns:
 
@@ -114,7 +444,7 @@ def show_combo(combo_dir, outdir):
     links = list()
     train_images = list()
     test_images = list()
-    for f in os.listdir(combo_dir):
+    for f in sorted(filenames):
         if is_train_image(f):
             train_images.append(join(combo_dir, f))
         elif is_test_image(f):
@@ -176,7 +506,24 @@ def make_link(href):
     """
 
     " Make a link where text is filename of href "
-    return a(os.path.basename(href), href=href, style='padding-left: 15px;')
+    return make_link_text(os.path.basename(href), href)
+
+def make_link_text(text, href):
+    """
+    Method used to generate a link with the given text
+
+    Args:
+
+        text: (str), text of the link
+
+        href: (str), filename to generate link for
+
+    Returns:
+
+        (dominate.tags html_tag object), hyperlink to filename
+
+    """
+    return a(text, href=href, style='padding-left: 15px;')
 
 def make_image(src, title=None):
     """
@@ -199,7 +546,7 @@ def make_image(src, title=None):
     if title:
         d += h4(title)
         #d += p(a(title))
-    d += img(src=src, height='200')
+    d += img(src=src, height='200', loading='lazy')
 
 def is_train_image(path):
     """
@@ -6,13 +6,18 @@ For more information and a list of scikit-learn splitter classes, see:
  http://scikit-learn.org/stable/modules/classes.html#module-sklearn.model_selection
 """
 
+from collections import OrderedDict
+
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.neighbors import NearestNeighbors
+from scipy.sparse.csgraph import connected_components
 import sklearn.model_selection as ms
 from matminer.featurizers.composition import ElementFraction
 from pymatgen import Composition
 
+from mastml.cache import open_cache
+
 class SplittersUnion(BaseEstimator, TransformerMixin):
     """
     Class to take the union of two separate splitting routines, so that many splitting routines can be performed at once
@@ -133,6 +138,49 @@ class JustEachGroup(BaseEstimator, TransformerMixin):
 #    " Train the model without each element, then test on the rows with that element "
 #    pass
 
+# Element fraction vectors of the compositions this process used most recently, so splitting the same data again in
+# one run skips the featurization. Only the last _ELEMENT_FRACTIONS_CACHE_SIZE compositions are kept; the vectors are
+# kept between runs by the DiskCache of the splitter's cache_path
+_ELEMENT_FRACTIONS_CACHE_SIZE = 100000
+_element_fractions_cache = OrderedDict()
+
+def element_fractions(compositions, cache_path=None):
+    """
+    Method to compute the element fraction vectors of a list of compositions, reusing the vectors computed before
+
+    Args:
+        compositions: (list), list of composition strings
+        cache_path: (str), optional path of a cache file that keeps the vectors between runs. None means no cache
+
+    Returns:
+        (numpy array), array with the element fraction vector of each composition as a row
+    """
+    compositions = [str(composition) for composition in compositions]
+    vectors = dict()
+    for composition in OrderedDict.fromkeys(compositions):
+        if composition in _element_fractions_cache:
+            _element_fractions_cache.move_to_end(composition)
+            vectors[composition] = _element_fractions_cache[composition]
+    missing = [composition for composition in OrderedDict.fromkeys(compositions) if composition not in vectors]
+    if missing:
+        frac_computer = ElementFraction()
+        # The length of the vectors depends on the elements matminer knows
+        cache = open_cache(cache_path, namespace=f'element_fractions_{len(frac_computer.feature_labels())}')
+        if cache is not None:
+            vectors.update(cache.get_many(missing))
+            missing = [composition for composition in missing if composition not in vectors]
+        if missing:
+            fracs = frac_computer.featurize_many(list(map(Composition, missing)), pbar=False)
+            new_vectors = dict(zip(missing, np.asarray(fracs, dtype=float)))
+            if cache is not None:
+                cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+        for composition in OrderedDict.fromkeys(compositions):
+            _element_fractions_cache[composition] = vectors[composition]
+        while len(_element_fractions_cache) > _ELEMENT_FRACTIONS_CACHE_SIZE:
+            _element_fractions_cache.popitem(last=False)
+    return np.array([vectors[composition] for composition in compositions])
+
 class LeaveCloseCompositionsOut(ms.BaseCrossValidator):
     """Leave-P-out where you exclude materials with compositions close to those the test set
 
@@ -143,46 +191,104 @@ class LeaveCloseCompositionsOut(ms.BaseCrossValidator):
     Consequently, this splitter requires a list of compositions as the input to `split` rather
     than the features.
 
+    The neighbors of all entries are found with one radius query, and each training set is the
+    complement of the neighbors of its test entries.
+
     Args:
         dist_threshold (float): Entries must be farther than this distance to be included in the
             training set
         nn_kwargs (dict): Keyword arguments for the scikit-learn NearestNeighbor class used
             to find nearest points
+        cache_path (str): Optional path of a file that keeps the element fraction vectors of
+            the compositions between runs. None means no cache
     """
 
-    def __init__(self, dist_threshold=0.1, nn_kwargs=None):
+    def __init__(self, dist_threshold=0.1, nn_kwargs=None, cache_path=None):
         super(LeaveCloseCompositionsOut, self).__init__()
         if nn_kwargs is None:
             nn_kwargs = {}
         self.dist_threshold = dist_threshold
         self.nn_kwargs = nn_kwargs
+        self.cache_path = cache_path
 
     def split(self, X, y=None, groups=None):
 
-        # Generate the composition vectors
-        frac_computer = ElementFraction()
-        elem_fracs = frac_computer.featurize_many(list(map(Composition, X)), pbar=False)
+        # Generate the composition vectors and the test sets
+        elem_fracs, test_sets = self._grouping(X)
 
-        # Generate the nearest-neighbor lookup tool
+        # Get all the entries within the threshold distance of each entry at once
         neigh = NearestNeighbors(**self.nn_kwargs)
         neigh.fit(elem_fracs)
+        too_close = neigh.radius_neighbors(elem_fracs, self.dist_threshold, return_distance=False)
+
+        for test_inds in test_sets:
+            yield self._train_set(too_close, test_inds, len(X)), test_inds
+
+    def _grouping(self, X):
+        # get_n_splits and split are called on the same compositions one after the other, so the element fraction
+        # vectors and test sets of the last compositions (and parameters) are kept
+        parameters = sorted((name, value) for name, value in vars(self).items() if not name.startswith('_'))
+        key = (tuple(str(composition) for composition in X), repr(parameters))
+        last = getattr(self, '_last_grouping', None)
+        if last is None or last[0] != key:
+            elem_fracs = element_fractions(X, self.cache_path)
+            last = (key, elem_fracs, self._test_sets(elem_fracs))
+            self._last_grouping = last
+        return last[1], last[2]
+
+    def _test_sets(self, elem_fracs):
+        # Each entry is its own test set
+        return [[i] for i in range(elem_fracs.shape[0])]
+
+    @staticmethod
+    def _train_set(too_close, test_inds, n_entries):
+        # The training set is "not these points", as the smallest index type that fits, since the splits of large
+        # datasets are kept in memory together
+        train_mask = np.ones(n_entries, dtype=bool)
+        for i in test_inds:
+            train_mask[too_close[i]] = False
+        index_type = np.int32 if n_entries < np.iinfo(np.int32).max else np.intp
+        return np.flatnonzero(train_mask).astype(index_type, copy=False)
 
-        # Generate a list of all entries
-        all_inds = np.arange(0, len(X), 1)
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return len(X)
 
-        # Loop through each entry in X
-        for i, x in enumerate(elem_fracs):
+class LeaveCloseCompositionGroupsOut(LeaveCloseCompositionsOut):
+    """Like LeaveCloseCompositionsOut, but entries with near-identical compositions are tested together
 
-            # Get all the entries within the threshold distance of the test point
-            too_close, = neigh.radius_neighbors([x], self.dist_threshold, return_distance=False)
+    Entries are merged into one group when they are linked by a chain of entries closer than
+    group_threshold to each other, so a dataset with many measurements of the same composition
+    gets one split per composition rather than one per entry. Entries closer than dist_threshold
+    to any entry of the test group are excluded from the training set.
 
-            # Get the training set as "not these points"
-            train_inds = np.setdiff1d(all_inds, too_close)
+    Args:
+        dist_threshold (float): Entries must be farther than this distance from every test entry
+            to be included in the training set
+        group_threshold (float): Entries at this distance or less are in the same group. The
+            default of 0 only groups identical compositions
+        nn_kwargs (dict): Keyword arguments for the scikit-learn NearestNeighbor class used
+            to find nearest points
+        cache_path (str): Optional path of a file that keeps the element fraction vectors of
+            the compositions between runs. None means no cache
+    """
 
-            yield train_inds, [i]
+    def __init__(self, dist_threshold=0.1, group_threshold=0, nn_kwargs=None, cache_path=None):
+        super(LeaveCloseCompositionGroupsOut, self).__init__(dist_threshold=dist_threshold, nn_kwargs=nn_kwargs,
+                                                             cache_path=cache_path)
+        self.group_threshold = group_threshold
+
+    def _test_sets(self, elem_fracs):
+        neigh = NearestNeighbors(**self.nn_kwargs)
+        neigh.fit(elem_fracs)
+        graph = neigh.radius_neighbors_graph(elem_fracs, self.group_threshold, mode='connectivity')
+        _, labels = connected_components(graph, directed=False)
+        members = np.argsort(labels, kind='mergesort')
+        groups = np.split(members, np.cumsum(np.bincount(labels))[:-1])
+        # Groups in the order of their first entry
+        return sorted((group.tolist() for group in groups), key=lambda group: group[0])
 
     def get_n_splits(self, X=None, y=None, groups=None):
-        return len(X)
+        return len(self._grouping(X)[1])
 
 class LeaveOutPercent(BaseEstimator, TransformerMixin):
     """
@@ -249,6 +355,7 @@ name_to_constructor = {
     'NoSplit': NoSplit,
     'JustEachGroup': JustEachGroup,
     'LeaveCloseCompositionsOut': LeaveCloseCompositionsOut,
+    'LeaveCloseCompositionGroupsOut': LeaveCloseCompositionGroupsOut,
     'LeaveOutPercent': LeaveOutPercent,
     #'WithoutElement': WithoutElement,
 }
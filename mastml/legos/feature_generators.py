@@ -2,10 +2,13 @@
 This module contains a collection of classes for generating input features to fit machine learning models to.
 """
 
-import multiprocessing
 import os
 import logging
 import re
+import time
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
@@ -22,7 +25,8 @@ from pymatgen.ext.matproj import MPRester
 # locate path to directory containing AtomicNumber.table, AtomicRadii.table AtomicVolume.table, etc
 # (needs to do it the hard way becuase python -m sets cwd to wherever python is ran from)
 import mastml
-from mastml import utils
+from mastml import utils, parallel
+from mastml.cache import open_cache
 log = logging.getLogger('mastml')
 MAGPIE_DATA_PATH = os.path.join(mastml.__path__[0], '../magpie/')
 
@@ -94,6 +98,9 @@ class ContainsElement(BaseEstimator, TransformerMixin):
 
         all_elments: (bool), whether to generate new features for all elements present from all compositions in the dataset.
 
+        fractional: (bool), whether to generate the atomic fraction of the element in each composition instead of 1 or 0.
+        With all_elements, the new columns are named fraction_<element> instead of has_<element>
+
     Methods:
 
         fit: pass through, needed to maintain scikit-learn class structure
@@ -114,49 +121,51 @@ class ContainsElement(BaseEstimator, TransformerMixin):
 
     """
 
-    def __init__(self, composition_feature, element, new_name, all_elements=False):
+    def __init__(self, composition_feature, element, new_name, all_elements=False, fractional=False):
         self.composition_feature = composition_feature
         self.element = element
         self.new_column_name = new_name #f'has_{self.element}'
         self.all_elements = all_elements
+        self.fractional = fractional
 
     def fit(self, df, y=None):
         return self
 
     def transform(self, df, y=None):
         compositions = df[self.composition_feature]
+        # Each distinct composition is parsed once, and its row of the element matrix is broadcast back to the rows
+        uniques, inverse = unique_compositions(compositions)
+        el_amt_dicts = [parse_composition(comp).get_el_amt_dict() for comp in uniques]
+
         if self.all_elements == False:
-            has_element = compositions.apply(self._contains_element)
-            df_trans = has_element.to_frame(name=self.new_column_name)
+            elements = [str(self.element)]
+            columns = [self.new_column_name]
         elif self.all_elements == True:
-            df_trans = self._contains_all_elements(compositions=compositions)
-        return df_trans
+            # Elements in order of first appearance in the data
+            elements = list(OrderedDict.fromkeys(element for el_amt_dict in el_amt_dicts for element in el_amt_dict))
+            prefix = 'fraction_' if self.fractional else 'has_'
+            columns = [prefix+element for element in elements]
+
+        element_matrix = self._get_element_matrix(el_amt_dicts, elements)
+        return pd.DataFrame(element_matrix[inverse], columns=columns, index=compositions.index)
 
-    def _contains_element(self, comp):
+    def _get_element_matrix(self, el_amt_dicts, elements):
         """
-        Returns 1 if comp contains that element, and 0 if not.
-        Uses ints because sklearn and numpy like number classes better than bools. Could even be
-        something crazy like "contains {element}" and "does not contain {element}" if you really
-        wanted.
+        Returns an array of shape (n_compositions, n_elements) with the atomic fraction of each element in each
+        composition if fractional, and otherwise 1 if the composition contains the element and 0 if not.
+        Uses ints because sklearn and numpy like number classes better than bools.
         """
-        comp = pymatgen.Composition(comp)
-        count = comp[self.element]
-        return int(count != 0)
-
-    def _contains_all_elements(self, compositions):
-        elements = list()
-        df_trans = pd.DataFrame()
-        for comp in compositions.values:
-            comp = pymatgen.Composition(comp)
-            for element in comp.elements:
-                if element not in elements:
-                    elements.append(element)
-        for element in elements:
-            self.element = element
-            self.new_column_name = "has_"+str(self.element)
-            has_element = compositions.apply(self._contains_element)
-            df_trans[self.new_column_name] = has_element
-        return df_trans
+        element_columns = {element: j for j, element in enumerate(elements)}
+        element_matrix = np.zeros((len(el_amt_dicts), len(elements)))
+        for i, el_amt_dict in enumerate(el_amt_dicts):
+            atoms_per_formula_unit = sum(el_amt_dict.values())
+            for element, amount in el_amt_dict.items():
+                j = element_columns.get(element)
+                if j is not None and amount != 0:
+                    element_matrix[i, j] = amount/atoms_per_formula_unit if self.fractional else 1
+        if not self.fractional:
+            element_matrix = element_matrix.astype(int)
+        return element_matrix
 
 class Magpie(BaseEstimator, TransformerMixin):
     """
@@ -166,6 +175,12 @@ class Magpie(BaseEstimator, TransformerMixin):
 
         composition_feature: (str), string denoting a chemical composition to generate elemental features from
 
+        cache_path: (str), optional path of a SQLite file used to keep generated features between runs. Only
+        compositions that aren't in the cache are computed
+
+        cache_size_mb: (float), maximum size of the feature cache in MB. The least recently used compositions are
+        evicted first
+
     Methods:
 
         fit: pass through, copies input columns as pre-generated features
@@ -186,15 +201,19 @@ class Magpie(BaseEstimator, TransformerMixin):
 
     """
 
-    def __init__(self, composition_feature):
+    def __init__(self, composition_feature, cache_path=None, cache_size_mb=1000):
         self.composition_feature = composition_feature
+        self.cache_path = cache_path
+        self.cache_size_mb = cache_size_mb
 
     def fit(self, df, y=None):
         self.original_features = df.columns
         return self
 
     def transform(self, df):
-        mfg = MagpieFeatureGeneration(df, self.composition_feature)
+        cache = open_cache(self.cache_path, namespace='magpie_'+magpie_table_hash(MAGPIE_DATA_PATH),
+                           max_size_mb=self.cache_size_mb)
+        mfg = MagpieFeatureGeneration(df, self.composition_feature, cache=cache)
         df = mfg.generate_magpie_features()
         df = df.drop(self.original_features, axis=1)
         # delete missing values, generation makes a lot of garbage.
@@ -213,6 +232,18 @@ class MaterialsProject(BaseEstimator, TransformerMixin):
 
         mapi_key: (str), string denoting your Materials Project API key
 
+        cache_path: (str), optional path of a SQLite file used to keep Materials Project responses between runs, so
+        compositions that were already retrieved need no network calls
+
+        cache_size_mb: (float), maximum size of the response cache in MB. The least recently used compositions are
+        evicted first
+
+        n_jobs: (int), maximum number of requests sent to Materials Project at the same time
+
+        max_retries: (int), number of times a failed request is retried, with exponential backoff, before giving up
+
+        endpoint: (str), optional URL of the Materials Project REST API, e.g. of a local stub server for offline tests
+
     Methods:
 
         fit: pass through, copies input columns as pre-generated features
@@ -234,9 +265,15 @@ class MaterialsProject(BaseEstimator, TransformerMixin):
     """
 
 
-    def __init__(self, composition_feature, api_key):
+    def __init__(self, composition_feature, api_key, cache_path=None, cache_size_mb=1000, n_jobs=8, max_retries=3,
+                 endpoint=None):
         self.composition_feature = composition_feature
         self.api_key = api_key
+        self.cache_path = cache_path
+        self.cache_size_mb = cache_size_mb
+        self.n_jobs = n_jobs
+        self.max_retries = max_retries
+        self.endpoint = endpoint
 
     def fit(self, df, y=None):
         self.original_features = df.columns
@@ -244,7 +281,10 @@ class MaterialsProject(BaseEstimator, TransformerMixin):
 
     def transform(self, df):
         # make materials project api call (uses internet)
-        mpg = MaterialsProjectFeatureGeneration(df.copy(), self.api_key, self.composition_feature)
+        cache = open_cache(self.cache_path, namespace='materials_project', max_size_mb=self.cache_size_mb)
+        mpg = MaterialsProjectFeatureGeneration(df.copy(), self.api_key, self.composition_feature, cache=cache,
+                                                n_jobs=self.n_jobs, max_retries=self.max_retries,
+                                                endpoint=self.endpoint)
         df = mpg.generate_materialsproject_features()
 
         df = df.drop(self.original_features, axis=1)
@@ -423,6 +463,17 @@ class Citrine(BaseEstimator, TransformerMixin):
 
         api_key: (str), string denoting your Citrine API key
 
+        cache_path: (str), optional path of a SQLite file used to keep Citrination search results between runs
+
+        cache_size_mb: (float), maximum size of the search cache in MB. The least recently used compositions are
+        evicted first
+
+        cache_ttl: (float), number of hours after which cached search results expire and are queried again
+
+        n_jobs: (int), maximum number of queries sent to Citrination at the same time
+
+        max_retries: (int), number of times a failed query is retried, with exponential backoff, before giving up
+
     Methods:
 
         fit: pass through, copies input columns as pre-generated features
@@ -444,9 +495,15 @@ class Citrine(BaseEstimator, TransformerMixin):
 
 
 
-    def __init__(self, composition_feature, api_key):
+    def __init__(self, composition_feature, api_key, cache_path=None, cache_size_mb=1000, cache_ttl=168, n_jobs=4,
+                 max_retries=3):
         self.composition_feature = composition_feature
         self.api_key = api_key
+        self.cache_path = cache_path
+        self.cache_size_mb = cache_size_mb
+        self.cache_ttl = cache_ttl
+        self.n_jobs = n_jobs
+        self.max_retries = max_retries
 
     def fit(self, df, y=None):
         self.original_features = df.columns
@@ -454,7 +511,10 @@ class Citrine(BaseEstimator, TransformerMixin):
 
     def transform(self, df):
         # make citrine api call (uses internet)
-        cfg = CitrineFeatureGeneration(df.copy(), self.api_key, self.composition_feature)
+        cache = open_cache(self.cache_path, namespace='citrine', max_size_mb=self.cache_size_mb,
+                           ttl=self.cache_ttl*3600)
+        cfg = CitrineFeatureGeneration(df.copy(), self.api_key, self.composition_feature, cache=cache,
+                                       n_jobs=self.n_jobs, max_retries=self.max_retries)
         df = cfg.generate_citrine_features()
 
         df = df.drop(self.original_features, axis=1)
@@ -543,6 +603,199 @@ def clean_dataframe(df):
         log.warning(f'Dropping {lost_count}/{before_count} generated columns due to missing values')
     return df
 
+@lru_cache(maxsize=100000)
+def parse_composition(composition):
+    """
+    Method to parse a composition string into a pymatgen Composition. Results are cached, so each distinct string is
+    only parsed once per process, no matter how many rows or feature generators use it
+
+    Args:
+
+        composition: (str), a chemical composition, e.g. 'Al2O3'
+
+    Returns:
+
+        (pymatgen Composition), the parsed composition. Treat it as read-only, as it is shared between callers
+
+    """
+    return Composition(composition)
+
+def unique_compositions(compositions):
+    """
+    Method to intern a column of compositions, so that feature generators only need to featurize each distinct
+    composition once and can broadcast the results back to every row
+
+    Args:
+
+        compositions: (iterable), the composition of each row, in dataframe order
+
+    Returns:
+
+        uniques: (list), the distinct compositions, in order of first appearance
+
+        inverse: (numpy array), integer array with, for each row, the position of its composition in uniques, so that
+        uniques[inverse[i]] is the composition of row i
+
+    """
+    positions = OrderedDict()
+    inverse = np.array([positions.setdefault(composition, len(positions)) for composition in compositions], dtype=int)
+    return list(positions), inverse
+
+def call_with_retries(function, max_retries=3, backoff=1.0):
+    """
+    Method to call a function that may fail for transient reasons, e.g. a request to an online database, retrying
+    with exponential backoff
+
+    Args:
+
+        function: (callable), function taking no arguments
+
+        max_retries: (int), number of times to retry after the first failed call
+
+        backoff: (float), seconds to wait before the first retry. The wait doubles after every retry
+
+    Returns:
+
+        the return value of function. The exception of the last attempt is raised if every attempt fails
+
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            wait = backoff * 2**attempt
+            log.warning(f'Attempt {attempt+1}/{max_retries+1} failed with "{e}", retrying in {wait} seconds')
+            time.sleep(wait)
+
+# Parsed magpie tables, keyed by data path, so the .table files are only read once per process
+_magpie_tables = dict()
+
+# Name and layout version of the compiled magpie bundle. Bump the version whenever compile_magpie_bundle changes.
+MAGPIE_BUNDLE_NAME = 'magpie_tables.npz'
+MAGPIE_BUNDLE_VERSION = 1
+
+def load_magpie_table(data_path=MAGPIE_DATA_PATH):
+    """
+    Method to load the magpie elemental property values as a dense array. The compiled bundle made by
+    compile_magpie_bundle is used when it is up to date, otherwise the .table files are parsed. The result is cached, so
+    this only happens once per process.
+
+    Args:
+
+        data_path: (str), path to the directory containing the magpie .table files
+
+    Returns:
+
+        feature_names: (list), names of the magpie features, i.e. the .table file names
+
+        table: (numpy array), array of shape (n_atomic_numbers + 1, n_features), where row Z holds the feature values of
+        the element with atomic number Z. Missing values and row 0 are NaN
+
+    """
+    data_path = os.path.abspath(data_path)
+    if data_path in _magpie_tables:
+        return _magpie_tables[data_path]
+
+    bundle = _load_magpie_bundle(data_path)
+    if bundle is None:
+        feature_names, table = _parse_magpie_tables(data_path)
+    else:
+        feature_names, table = bundle
+
+    _magpie_tables[data_path] = feature_names, table
+    return feature_names, table
+
+def compile_magpie_bundle(data_path=MAGPIE_DATA_PATH):
+    """
+    Method to parse the magpie .table files and save them as a single binary bundle next to them, so later runs don't
+    need to read and parse every table
+
+    Args:
+
+        data_path: (str), path to the directory containing the magpie .table files
+
+    Returns:
+
+        bundle_path: (str), path of the saved bundle
+
+    """
+    data_path = os.path.abspath(data_path)
+    feature_names, table = _parse_magpie_tables(data_path)
+    bundle_path = os.path.join(data_path, MAGPIE_BUNDLE_NAME)
+    np.savez(bundle_path, version=MAGPIE_BUNDLE_VERSION, fingerprint=_magpie_tables_fingerprint(data_path),
+             feature_names=np.array(feature_names), table=table)
+    log.info(f'Saved compiled magpie tables to {bundle_path}')
+    return bundle_path
+
+def _load_magpie_bundle(data_path):
+    bundle_path = os.path.join(data_path, MAGPIE_BUNDLE_NAME)
+    if not os.path.exists(bundle_path):
+        return None
+    with np.load(bundle_path) as bundle:
+        # Stale if the bundle layout changed or any table was added, removed or edited since it was compiled
+        if (int(bundle['version']) != MAGPIE_BUNDLE_VERSION
+                or str(bundle['fingerprint']) != _magpie_tables_fingerprint(data_path)):
+            log.warning(f'{bundle_path} is out of date, reading the magpie .table files instead. '
+                        f'Run mastml.legos.feature_generators.compile_magpie_bundle() to update it.')
+            return None
+        return bundle['feature_names'].tolist(), bundle['table']
+
+def _magpie_tables_fingerprint(data_path):
+    # The raw bytes of every table, so any edit is caught, even one that keeps the size of a file. Hashing them is
+    # still much cheaper than parsing them
+    digest = hashlib.sha1()
+    for name in sorted(f for f in os.listdir(data_path) if f.endswith('.table')):
+        digest.update(name.encode() + b'\0')
+        with open(os.path.join(data_path, name), 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _parse_magpie_tables(data_path):
+    # OxidationStates lists several values per element, so it isn't a scalar feature
+    feature_names = sorted(f[:-len('.table')] for f in os.listdir(data_path)
+                           if f.endswith('.table') and f != 'OxidationStates.table')
+    columns = list()
+    for feature_name in feature_names:
+        with open(os.path.join(data_path, feature_name + '.table')) as f:
+            column = list()
+            for line in f.readlines():
+                if "Missing" in line or "NA" in line:
+                    column.append(np.nan)
+                    continue
+                try:
+                    column.append(float(line.strip()))
+                except ValueError:
+                    column.append(np.nan)
+        columns.append(column)
+
+    # Line Z of each table belongs to atomic number Z, so leave row 0 empty
+    table = np.full((max(len(column) for column in columns) + 1, len(feature_names)), np.nan)
+    for j, column in enumerate(columns):
+        table[1:len(column)+1, j] = column
+    return feature_names, table
+
+def magpie_table_hash(data_path=MAGPIE_DATA_PATH):
+    """
+    Method to fingerprint the contents of the magpie tables, so features generated from other versions of the tables
+    are never reused
+
+    Args:
+
+        data_path: (str), path to the directory containing the magpie .table files
+
+    Returns:
+
+        (str), hex digest of the feature names and values
+
+    """
+    feature_names, table = load_magpie_table(data_path)
+    digest = hashlib.sha1('\n'.join(feature_names).encode())
+    digest.update(np.ascontiguousarray(table).tobytes())
+    return digest.hexdigest()
+
 class MagpieFeatureGeneration(object):
     """
     Class to generate new features using Magpie data and dataframe containing material compositions
@@ -553,6 +806,8 @@ class MagpieFeatureGeneration(object):
 
         composition_feature: (str), string denoting a chemical composition to generate elemental features from
 
+        cache: (mastml.cache.DiskCache), optional cache of previously generated features, keyed by composition
+
     Methods:
 
         generate_magpie_features : generates magpie feature set based on compositions in dataframe
@@ -566,633 +821,192 @@ class MagpieFeatureGeneration(object):
                 dataframe: (dataframe) : dataframe containing magpie feature set
     """
 
-    def __init__(self, dataframe, composition_feature):
+    def __init__(self, dataframe, composition_feature, cache=None):
         self.dataframe = dataframe
         self.composition_feature = composition_feature
+        self.cache = cache
 
     def generate_magpie_features(self):
         # Replace empty composition fields with empty string instead of NaN
         self.dataframe = self.dataframe.fillna('')
 
         compositions_raw = self.dataframe[self.composition_feature].tolist()
+        if len(compositions_raw) < 1:
+            raise utils.MissingColumnError('Error! No material compositions column found in your input data file. To use this feature generation routine, you must supply a material composition for each data point')
+
         # Check first entry of comps to find [] for delimiting different sublattices
-        has_sublattices = False
-        if '[' in compositions_raw[0]:
-            if ']' in compositions_raw[0]:
-                has_sublattices = True
-                log.info('MAGPIE feature generation found brackets in material compositions denoting specific sublattices!')
-                # Parse raw composition strings with brackets to denote compositions of different sublattices
-                site_dict_list = list()
-                for comp in compositions_raw:
-                    sites = re.findall(r"\[([A-Za-z0-9_.]+)\]", comp)
-                    site_dict = dict()
-                    for i, site in enumerate(sites):
-                        comp_by_site = Composition(site).as_dict()
-                        site_dict['Site'+str(i+1)] = comp_by_site
-                    site_dict_list.append(site_dict)
-
-        compositions = list()
-        if has_sublattices == True:
-            # Parse out brackets from compositions
-            for comp in compositions_raw:
-                comp_split = comp.split('[')
-                comp_str = ''
-                for s in comp_split:
-                    comp_str += s
-                comp_split = comp_str.split(']')
-                comp_str = ''
-                for s in comp_split:
-                    comp_str += s
-                compositions.append(comp_str)
+        has_sublattices = '[' in compositions_raw[0] and ']' in compositions_raw[0]
+        if has_sublattices:
+            log.info('MAGPIE feature generation found brackets in material compositions denoting specific sublattices!')
+
+        # Add the column of combined material compositions into the dataframe
+        self.dataframe[self.composition_feature] = [comp.replace('[', '').replace(']', '') for comp in compositions_raw]
+
+        # Featurize each distinct composition once, then broadcast the features back to the rows
+        uniques, inverse = unique_compositions(compositions_raw)
+        log.info(f'Generating magpie features for {len(uniques)} unique compositions')
+        feature_names, table = load_magpie_table(MAGPIE_DATA_PATH)
+        if self.cache is None:
+            magpie_arrays = self._get_magpie_arrays(uniques, has_sublattices, table)
         else:
-            compositions = compositions_raw
+            magpie_arrays = self._get_cached_magpie_arrays(uniques, has_sublattices, table)
+        magpie_arrays = {name: array[inverse] for name, array in magpie_arrays.items()}
 
-        if len(compositions) < 1:
-            raise utils.MissingColumnError('Error! No material compositions column found in your input data file. To use this feature generation routine, you must supply a material composition for each data point')
+        # Merge magpie feature dataframes with originally supplied dataframe
+        return pd.concat([self.dataframe] + self._magpie_arrays_to_dataframes(magpie_arrays, feature_names), axis=1)
 
-        # Add the column of combined material compositions into the dataframe
-        self.dataframe[self.composition_feature] = compositions
-
-        # Assign each magpiedata feature set to appropriate composition name
-        magpiedata_dict_composition_average = {}
-        magpiedata_dict_arithmetic_average = {}
-        magpiedata_dict_max = {}
-        magpiedata_dict_min = {}
-        magpiedata_dict_difference = {}
-
-        magpiedata_dict_atomic_bysite = {}
-
-        magpiedata_dict_composition_average_site1 = {}
-        magpiedata_dict_arithmetic_average_site1 = {}
-        magpiedata_dict_max_site1 = {}
-        magpiedata_dict_min_site1 = {}
-        magpiedata_dict_difference_site1 = {}
-
-        magpiedata_dict_composition_average_site2 = {}
-        magpiedata_dict_arithmetic_average_site2 = {}
-        magpiedata_dict_max_site2 = {}
-        magpiedata_dict_min_site2 = {}
-        magpiedata_dict_difference_site2 = {}
-
-        magpiedata_dict_composition_average_site3 = {}
-        magpiedata_dict_arithmetic_average_site3 = {}
-        magpiedata_dict_max_site3 = {}
-        magpiedata_dict_min_site3 = {}
-        magpiedata_dict_difference_site3 = {}
-
-        for i, composition in enumerate(compositions):
-            if has_sublattices:
-                magpiedata_collected = self._get_computed_magpie_features(composition=composition, data_path=MAGPIE_DATA_PATH, site_dict=site_dict_list[i])
-            else:
-                magpiedata_collected = self._get_computed_magpie_features(composition=composition,data_path=MAGPIE_DATA_PATH, site_dict=None)
-            magpiedata_atomic_notparsed = self._get_atomic_magpie_features(composition=composition, data_path=MAGPIE_DATA_PATH)
-
-            if has_sublattices:
-                number_sites = len(site_dict_list[i].keys())
-                if number_sites == 1:
-                    magpiedata_composition_average = magpiedata_collected[0]
-                    magpiedata_arithmetic_average = magpiedata_collected[1]
-                    magpiedata_max = magpiedata_collected[2]
-                    magpiedata_min = magpiedata_collected[3]
-                    magpiedata_difference = magpiedata_collected[4]
-                    magpiedata_composition_average_site1 = magpiedata_collected[5]
-                    magpiedata_arithmetic_average_site1 = magpiedata_collected[6]
-                    magpiedata_max_site1 = magpiedata_collected[7]
-                    magpiedata_min_site1 = magpiedata_collected[8]
-                    magpiedata_difference_site1 = magpiedata_collected[9]
-
-                    magpiedata_dict_composition_average[composition] = magpiedata_composition_average
-                    magpiedata_dict_arithmetic_average[composition] = magpiedata_arithmetic_average
-                    magpiedata_dict_max[composition] = magpiedata_max
-                    magpiedata_dict_min[composition] = magpiedata_min
-                    magpiedata_dict_difference[composition] = magpiedata_difference
-
-                    magpiedata_dict_composition_average_site1[composition] = magpiedata_composition_average_site1
-                    magpiedata_dict_arithmetic_average_site1[composition] = magpiedata_arithmetic_average_site1
-                    magpiedata_dict_max_site1[composition] = magpiedata_max_site1
-                    magpiedata_dict_min_site1[composition] = magpiedata_min_site1
-                    magpiedata_dict_difference_site1[composition] = magpiedata_difference_site1
-
-                elif number_sites == 2:
-                    magpiedata_composition_average = magpiedata_collected[0]
-                    magpiedata_arithmetic_average = magpiedata_collected[1]
-                    magpiedata_max = magpiedata_collected[2]
-                    magpiedata_min = magpiedata_collected[3]
-                    magpiedata_difference = magpiedata_collected[4]
-                    magpiedata_composition_average_site1 = magpiedata_collected[5]
-                    magpiedata_arithmetic_average_site1 = magpiedata_collected[6]
-                    magpiedata_max_site1 = magpiedata_collected[7]
-                    magpiedata_min_site1 = magpiedata_collected[8]
-                    magpiedata_difference_site1 = magpiedata_collected[9]
-                    magpiedata_composition_average_site2 = magpiedata_collected[10]
-                    magpiedata_arithmetic_average_site2 = magpiedata_collected[11]
-                    magpiedata_max_site2 = magpiedata_collected[12]
-                    magpiedata_min_site2 = magpiedata_collected[13]
-                    magpiedata_difference_site2 = magpiedata_collected[14]
-
-                    magpiedata_dict_composition_average[composition] = magpiedata_composition_average
-                    magpiedata_dict_arithmetic_average[composition] = magpiedata_arithmetic_average
-                    magpiedata_dict_max[composition] = magpiedata_max
-                    magpiedata_dict_min[composition] = magpiedata_min
-                    magpiedata_dict_difference[composition] = magpiedata_difference
-
-                    magpiedata_dict_composition_average_site1[composition] = magpiedata_composition_average_site1
-                    magpiedata_dict_arithmetic_average_site1[composition] = magpiedata_arithmetic_average_site1
-                    magpiedata_dict_max_site1[composition] = magpiedata_max_site1
-                    magpiedata_dict_min_site1[composition] = magpiedata_min_site1
-                    magpiedata_dict_difference_site1[composition] = magpiedata_difference_site1
-
-                    magpiedata_dict_composition_average_site2[composition] = magpiedata_composition_average_site2
-                    magpiedata_dict_arithmetic_average_site2[composition] = magpiedata_arithmetic_average_site2
-                    magpiedata_dict_max_site2[composition] = magpiedata_max_site2
-                    magpiedata_dict_min_site2[composition] = magpiedata_min_site2
-                    magpiedata_dict_difference_site2[composition] = magpiedata_difference_site2
-
-                elif number_sites == 3:
-                    magpiedata_composition_average = magpiedata_collected[0]
-                    magpiedata_arithmetic_average = magpiedata_collected[1]
-                    magpiedata_max = magpiedata_collected[2]
-                    magpiedata_min = magpiedata_collected[3]
-                    magpiedata_difference = magpiedata_collected[4]
-                    magpiedata_composition_average_site1 = magpiedata_collected[5]
-                    magpiedata_arithmetic_average_site1 = magpiedata_collected[6]
-                    magpiedata_max_site1 = magpiedata_collected[7]
-                    magpiedata_min_site1 = magpiedata_collected[8]
-                    magpiedata_difference_site1 = magpiedata_collected[9]
-                    magpiedata_composition_average_site2 = magpiedata_collected[10]
-                    magpiedata_arithmetic_average_site2 = magpiedata_collected[11]
-                    magpiedata_max_site2 = magpiedata_collected[12]
-                    magpiedata_min_site2 = magpiedata_collected[13]
-                    magpiedata_difference_site2 = magpiedata_collected[14]
-                    magpiedata_composition_average_site3 = magpiedata_collected[15]
-                    magpiedata_arithmetic_average_site3 = magpiedata_collected[16]
-                    magpiedata_max_site3 = magpiedata_collected[17]
-                    magpiedata_min_site3 = magpiedata_collected[18]
-                    magpiedata_difference_site3 = magpiedata_collected[19]
-
-                    magpiedata_dict_composition_average[composition] = magpiedata_composition_average
-                    magpiedata_dict_arithmetic_average[composition] = magpiedata_arithmetic_average
-                    magpiedata_dict_max[composition] = magpiedata_max
-                    magpiedata_dict_min[composition] = magpiedata_min
-                    magpiedata_dict_difference[composition] = magpiedata_difference
-
-                    magpiedata_dict_composition_average_site1[composition] = magpiedata_composition_average_site1
-                    magpiedata_dict_arithmetic_average_site1[composition] = magpiedata_arithmetic_average_site1
-                    magpiedata_dict_max_site1[composition] = magpiedata_max_site1
-                    magpiedata_dict_min_site1[composition] = magpiedata_min_site1
-                    magpiedata_dict_difference_site1[composition] = magpiedata_difference_site1
-
-                    magpiedata_dict_composition_average_site2[composition] = magpiedata_composition_average_site2
-                    magpiedata_dict_arithmetic_average_site2[composition] = magpiedata_arithmetic_average_site2
-                    magpiedata_dict_max_site2[composition] = magpiedata_max_site2
-                    magpiedata_dict_min_site2[composition] = magpiedata_min_site2
-                    magpiedata_dict_difference_site2[composition] = magpiedata_difference_site2
-
-                    magpiedata_dict_composition_average_site3[composition] = magpiedata_composition_average_site3
-                    magpiedata_dict_arithmetic_average_site3[composition] = magpiedata_arithmetic_average_site3
-                    magpiedata_dict_max_site3[composition] = magpiedata_max_site3
-                    magpiedata_dict_min_site3[composition] = magpiedata_min_site3
-                    magpiedata_dict_difference_site3[composition] = magpiedata_difference_site3
-            else:
-                magpiedata_composition_average = magpiedata_collected[0]
-                magpiedata_arithmetic_average = magpiedata_collected[1]
-                magpiedata_max = magpiedata_collected[2]
-                magpiedata_min = magpiedata_collected[3]
-                magpiedata_difference = magpiedata_collected[4]
-
-                magpiedata_dict_composition_average[composition] = magpiedata_composition_average
-                magpiedata_dict_arithmetic_average[composition] = magpiedata_arithmetic_average
-                magpiedata_dict_max[composition] = magpiedata_max
-                magpiedata_dict_min[composition] = magpiedata_min
-                magpiedata_dict_difference[composition] = magpiedata_difference
-
-            count = 1
-            magpiedata_atomic_bysite = {}
-            # Also include magpie features of individual elements in the material
-            for entry in magpiedata_atomic_notparsed:
-                for magpiefeature, featurevalue in magpiedata_atomic_notparsed[entry].items():
-                    magpiedata_atomic_bysite["Element"+str(count)+"_"+str(magpiefeature)] = featurevalue
-                count += 1
-
-            magpiedata_dict_atomic_bysite[composition] = magpiedata_atomic_bysite
+    def _get_magpie_arrays(self, compositions_raw, has_sublattices, table):
+        """
+        Computes the magpie features of all compositions at once
+
+        Returns:
 
+            (dict), dict with 'statistics' of shape (n_compositions, 5, n_features), 'elements' of shape
+            (n_compositions, max_elements, n_features), 'n_elements' of shape (n_compositions,) and, for compositions with
+            sublattices, 'sites' of shape (n_compositions, max_sites, 5, n_features) and 'n_sites'
+        """
         if has_sublattices:
-            if number_sites == 1:
-                magpiedata_dict_list = [magpiedata_dict_composition_average, magpiedata_dict_arithmetic_average,
-                                    magpiedata_dict_max, magpiedata_dict_min, magpiedata_dict_difference, magpiedata_dict_atomic_bysite,
-                                        magpiedata_dict_composition_average_site1, magpiedata_dict_arithmetic_average_site1,
-                                        magpiedata_dict_max_site1, magpiedata_dict_min_site1, magpiedata_dict_difference_site1]
-            elif number_sites == 2:
-                magpiedata_dict_list = [magpiedata_dict_composition_average, magpiedata_dict_arithmetic_average,
-                                    magpiedata_dict_max, magpiedata_dict_min, magpiedata_dict_difference, magpiedata_dict_atomic_bysite,
-                                        magpiedata_dict_composition_average_site1, magpiedata_dict_arithmetic_average_site1,
-                                        magpiedata_dict_max_site1, magpiedata_dict_min_site1, magpiedata_dict_difference_site1,
-                                        magpiedata_dict_composition_average_site2, magpiedata_dict_arithmetic_average_site2,
-                                        magpiedata_dict_max_site2, magpiedata_dict_min_site2, magpiedata_dict_difference_site2]
-            elif number_sites == 3:
-                magpiedata_dict_list = [magpiedata_dict_composition_average, magpiedata_dict_arithmetic_average,
-                                    magpiedata_dict_max, magpiedata_dict_min, magpiedata_dict_difference, magpiedata_dict_atomic_bysite,
-                                        magpiedata_dict_composition_average_site1, magpiedata_dict_arithmetic_average_site1,
-                                        magpiedata_dict_max_site1, magpiedata_dict_min_site1, magpiedata_dict_difference_site1,
-                                        magpiedata_dict_composition_average_site2, magpiedata_dict_arithmetic_average_site2,
-                                        magpiedata_dict_max_site2, magpiedata_dict_min_site2, magpiedata_dict_difference_site2,
-                                        magpiedata_dict_composition_average_site3, magpiedata_dict_arithmetic_average_site3,
-                                        magpiedata_dict_max_site3, magpiedata_dict_min_site3, magpiedata_dict_difference_site3]
-        else:
-            magpiedata_dict_list = [magpiedata_dict_composition_average, magpiedata_dict_arithmetic_average,
-                                magpiedata_dict_max, magpiedata_dict_min, magpiedata_dict_difference, magpiedata_dict_atomic_bysite]
+            # Parse raw composition strings with brackets to denote compositions of different sublattices
+            site_dict_list = list()
+            for comp in compositions_raw:
+                sites = re.findall(r"\[([A-Za-z0-9_.]+)\]", comp)
+                site_dict_list.append([parse_composition(site).get_el_amt_dict() for site in sites])
+        compositions = [comp.replace('[', '').replace(']', '') for comp in compositions_raw]
 
-        dataframe = self.dataframe
+        el_amt_dicts = [parse_composition(composition).get_el_amt_dict() for composition in compositions]
+        element_values, element_weights = self._get_element_values(el_amt_dicts, table)
+        magpie_arrays = {'statistics': self._get_computed_magpie_features(element_values, element_weights),
+                         'elements': element_values,
+                         'n_elements': np.array([len(el_amt_dict) for el_amt_dict in el_amt_dicts], dtype=int)}
 
-        for magpiedata_dict in magpiedata_dict_list:
-            dataframe_magpie = pd.DataFrame.from_dict(data=magpiedata_dict, orient='index')
-            # Need to reorder compositions in new dataframe to match input dataframe
-            dataframe_magpie = dataframe_magpie.reindex(self.dataframe[self.composition_feature].tolist())
-            # Need to make compositions the first column, instead of the row names
-            dataframe_magpie.index.name = self.composition_feature
-            dataframe_magpie.reset_index(inplace=True)
-            # Merge magpie feature dataframe with originally supplied dataframe
-            dataframe = DataframeUtilities().merge_dataframe_columns(dataframe1=dataframe, dataframe2=dataframe_magpie)
+        if has_sublattices:
+            number_sites = max(len(site_dicts) for site_dicts in site_dict_list)
+            site_statistics = list()
+            for site in range(number_sites):
+                site_el_amt_dicts = [site_dicts[site] if site < len(site_dicts) else dict()
+                                     for site_dicts in site_dict_list]
+                site_values, site_weights = self._get_element_values(site_el_amt_dicts, table)
+                site_statistics.append(self._get_computed_magpie_features(site_values, site_weights))
+            magpie_arrays['sites'] = np.stack(site_statistics, axis=1) if site_statistics else \
+                np.empty((len(compositions), 0, 5, table.shape[1]))
+            magpie_arrays['n_sites'] = np.array([len(site_dicts) for site_dicts in site_dict_list], dtype=int)
+        return magpie_arrays
+
+    def _get_cached_magpie_arrays(self, compositions_raw, has_sublattices, table):
+        """
+        Same as _get_magpie_arrays, but only computes the compositions that aren't in the feature cache yet
+        """
+        # Whitespace never changes a composition, so leave it out of the key
+        keys = [''.join(comp.split()) for comp in compositions_raw]
+        # Entries written before every entry had its sites are computed again
+        cached = {key: entry for key, entry in self.cache.get_many(set(keys)).items() if 'sites' in entry}
+        missing_keys = list(OrderedDict.fromkeys(key for key in keys if key not in cached))
+        log.info(f'Found {len(set(keys))-len(missing_keys)}/{len(set(keys))} compositions in the magpie feature cache')
+
+        if missing_keys:
+            # The sites are always computed (none for compositions without brackets), so an entry can be used by
+            # datasets with and without sublattices alike
+            computed = self._get_magpie_arrays(missing_keys, True, table)
+            new_entries = dict()
+            for i, key in enumerate(missing_keys):
+                # Store each composition without the padding that depends on the rest of the dataset
+                new_entries[key] = {'statistics': computed['statistics'][i],
+                                    'elements': computed['elements'][i, :computed['n_elements'][i]],
+                                    'sites': computed['sites'][i, :computed['n_sites'][i]]}
+            self.cache.put_many(new_entries)
+            cached.update(new_entries)
+
+        entries = [cached[key] for key in keys]
+        n_features = table.shape[1]
+        n_elements = np.array([entry['elements'].shape[0] for entry in entries], dtype=int)
+        element_values = np.full((len(entries), max(n_elements.max(), 1), n_features), np.nan)
+        for i, entry in enumerate(entries):
+            element_values[i, :n_elements[i]] = entry['elements']
+        magpie_arrays = {'statistics': np.stack([entry['statistics'] for entry in entries]),
+                         'elements': element_values,
+                         'n_elements': n_elements}
 
-        return dataframe
+        if has_sublattices:
+            n_sites = np.array([entry['sites'].shape[0] for entry in entries], dtype=int)
+            site_statistics = np.full((len(entries), max(n_sites.max(), 1), 5, n_features), np.nan)
+            for i, entry in enumerate(entries):
+                site_statistics[i, :n_sites[i]] = entry['sites']
+            magpie_arrays['sites'] = site_statistics
+            magpie_arrays['n_sites'] = n_sites
+        return magpie_arrays
+
+    def _magpie_arrays_to_dataframes(self, magpie_arrays, feature_names):
+        statistic_names = ['composition_average', 'arithmetic_average', 'max_value', 'min_value', 'difference']
+        index = self.dataframe.index
+
+        magpie_dataframes = list()
+        for s, name in enumerate(statistic_names):
+            columns = [feature_name+"_"+name for feature_name in feature_names]
+            magpie_dataframes.append(pd.DataFrame(magpie_arrays['statistics'][:, s], columns=columns, index=index))
+
+        # Also include magpie features of individual elements in the material
+        element_values = magpie_arrays['elements']
+        columns = ["Element"+str(count+1)+"_"+str(feature_name)
+                   for count in range(element_values.shape[1]) for feature_name in feature_names]
+        magpie_dataframes.append(pd.DataFrame(element_values.reshape(element_values.shape[0], -1),
+                                              columns=columns, index=index))
+
+        if 'sites' in magpie_arrays:
+            for site in range(magpie_arrays['sites'].shape[1]):
+                for s, name in enumerate(statistic_names):
+                    columns = [feature_name+"_Site"+str(site+1)+"_"+name for feature_name in feature_names]
+                    magpie_dataframes.append(pd.DataFrame(magpie_arrays['sites'][:, site, s],
+                                                          columns=columns, index=index))
+        return magpie_dataframes
+
+    def _get_element_values(self, el_amt_dicts, table):
+        """
+        Gathers the magpie values of the elements of each composition into one padded array
 
-    def _get_computed_magpie_features(self, composition, data_path, site_dict=None):
-        magpiedata_composition_average = {}
-        magpiedata_arithmetic_average = {}
-        magpiedata_max = {}
-        magpiedata_min = {}
-        magpiedata_difference = {}
-        magpiedata_atomic = self._get_atomic_magpie_features(composition=composition, data_path=data_path)
-        composition = Composition(composition)
-        element_list, atoms_per_formula_unit = self._get_element_list(composition=composition)
-
-        # Make per-site dicts if site_dict_list specified
-        if site_dict:
-            number_sites = len(site_dict.keys())
-            for site, comp_dict in site_dict.items():
-                if site == "Site1":
-                    num_site1_elements = int(len(site_dict[site].keys()))
-                    site1_total = 0
-                    for el, amt in comp_dict.items():
-                        site1_total += amt
-                if site == "Site2":
-                    num_site2_elements = int(len(site_dict[site].keys()))
-                    site2_total = 0
-                    for el, amt in comp_dict.items():
-                        site2_total += amt
-                if site == "Site3":
-                    num_site3_elements = int(len(site_dict[site].keys()))
-                    site3_total = 0
-                    for el, amt in comp_dict.items():
-                        site3_total += amt
-            if number_sites == 1:
-                magpiedata_composition_average_site1 = {}
-                magpiedata_arithmetic_average_site1 = {}
-                magpiedata_max_site1 = {}
-                magpiedata_min_site1 = {}
-                magpiedata_difference_site1 = {}
-            elif number_sites == 2:
-                magpiedata_composition_average_site1 = {}
-                magpiedata_arithmetic_average_site1 = {}
-                magpiedata_max_site1 = {}
-                magpiedata_min_site1 = {}
-                magpiedata_difference_site1 = {}
-                magpiedata_composition_average_site2 = {}
-                magpiedata_arithmetic_average_site2 = {}
-                magpiedata_max_site2 = {}
-                magpiedata_min_site2 = {}
-                magpiedata_difference_site2 = {}
-            elif number_sites == 3:
-                magpiedata_composition_average_site1 = {}
-                magpiedata_arithmetic_average_site1 = {}
-                magpiedata_max_site1 = {}
-                magpiedata_min_site1 = {}
-                magpiedata_difference_site1 = {}
-                magpiedata_composition_average_site2 = {}
-                magpiedata_arithmetic_average_site2 = {}
-                magpiedata_max_site2 = {}
-                magpiedata_min_site2 = {}
-                magpiedata_difference_site2 = {}
-                magpiedata_composition_average_site3 = {}
-                magpiedata_arithmetic_average_site3 = {}
-                magpiedata_max_site3 = {}
-                magpiedata_min_site3 = {}
-                magpiedata_difference_site3 = {}
-            else:
-                log.error('MASTML currently only supports up to 3 sublattices to generate site-specific MAGPIE features. '
-                          'Please reduce number of sublattices an re-run MASTML.')
-
-        # Initialize feature values to all be 0, because need to dynamically update them with weighted values in next loop.
-        for magpie_feature in magpiedata_atomic[element_list[0]]:
-            magpiedata_composition_average[magpie_feature] = 0
-            magpiedata_arithmetic_average[magpie_feature] = 0
-            magpiedata_max[magpie_feature] = 0
-            magpiedata_min[magpie_feature] = 0
-            magpiedata_difference[magpie_feature] = 0
-
-            if site_dict:
-                if number_sites == 1:
-                    magpiedata_composition_average_site1[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site1[magpie_feature] = 0
-                    magpiedata_max_site1[magpie_feature] = 0
-                    magpiedata_min_site1[magpie_feature] = 0
-                    magpiedata_difference_site1[magpie_feature] = 0
-                elif number_sites == 2:
-                    magpiedata_composition_average_site1[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site1[magpie_feature] = 0
-                    magpiedata_max_site1[magpie_feature] = 0
-                    magpiedata_min_site1[magpie_feature] = 0
-                    magpiedata_difference_site1[magpie_feature] = 0
-                    magpiedata_composition_average_site2[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site2[magpie_feature] = 0
-                    magpiedata_max_site2[magpie_feature] = 0
-                    magpiedata_min_site2[magpie_feature] = 0
-                    magpiedata_difference_site2[magpie_feature] = 0
-                elif number_sites == 3:
-                    magpiedata_composition_average_site1[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site1[magpie_feature] = 0
-                    magpiedata_max_site1[magpie_feature] = 0
-                    magpiedata_min_site1[magpie_feature] = 0
-                    magpiedata_difference_site1[magpie_feature] = 0
-                    magpiedata_composition_average_site2[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site2[magpie_feature] = 0
-                    magpiedata_max_site2[magpie_feature] = 0
-                    magpiedata_min_site2[magpie_feature] = 0
-                    magpiedata_difference_site2[magpie_feature] = 0
-                    magpiedata_composition_average_site3[magpie_feature] = 0
-                    magpiedata_arithmetic_average_site3[magpie_feature] = 0
-                    magpiedata_max_site3[magpie_feature] = 0
-                    magpiedata_min_site3[magpie_feature] = 0
-                    magpiedata_difference_site3[magpie_feature] = 0
-
-        # Original magpie feature set
-        for element in magpiedata_atomic:
-            for magpie_feature, feature_value in magpiedata_atomic[element].items():
-                if feature_value is not 'NaN':
-                    # Composition average features
-                    magpiedata_composition_average[magpie_feature] += feature_value*float(composition[element])/atoms_per_formula_unit
-                    # Arithmetic average features
-                    magpiedata_arithmetic_average[magpie_feature] += feature_value/len(element_list)
-                    # Max features
-                    if magpiedata_max[magpie_feature] > 0:
-                        if feature_value > magpiedata_max[magpie_feature]:
-                            magpiedata_max[magpie_feature] = feature_value
-                    elif magpiedata_max[magpie_feature] == 0:
-                        magpiedata_max[magpie_feature] = feature_value
-                    # Min features
-                    if magpiedata_min[magpie_feature] > 0:
-                        if feature_value < magpiedata_min[magpie_feature]:
-                            magpiedata_min[magpie_feature] = feature_value
-                    elif magpiedata_min[magpie_feature] == 0:
-                        magpiedata_min[magpie_feature] = feature_value
-                    # Difference features (max - min)
-                    magpiedata_difference[magpie_feature] = magpiedata_max[magpie_feature] - magpiedata_min[magpie_feature]
-
-        # Site-specific magpie features
-        if site_dict:
-            for element in magpiedata_atomic:
-                for site, comp_dict in site_dict.items():
-                    magpie_data_by_site_collected = list()
-                    for el, amt in comp_dict.items():
-                        if el == element:
-                            magpie_data_by_site_collected.append(magpiedata_atomic[element])
-                    # Here, calc magpie values over the particular site
-                    for magpiedata in magpie_data_by_site_collected:
-                        for magpie_feature, feature_value in magpiedata.items():
-                            if feature_value is not 'NaN':
-                                if site == "Site1":
-                                    # Composition weighted average by site
-                                    magpiedata_composition_average_site1[magpie_feature] += feature_value*float(site_dict[site][element])/site1_total
-                                    # Arithmetic average by site
-                                    magpiedata_arithmetic_average_site1[magpie_feature] += feature_value / num_site1_elements
-                                    # Max features by site
-                                    if magpiedata_max_site1[magpie_feature] > 0:
-                                        if feature_value > magpiedata_max_site1[magpie_feature]:
-                                            magpiedata_max_site1[magpie_feature] = feature_value
-                                    elif magpiedata_max_site1[magpie_feature] == 0:
-                                        magpiedata_max_site1[magpie_feature] = feature_value
-                                    # Min features by site
-                                    if magpiedata_min_site1[magpie_feature] > 0:
-                                        if feature_value < magpiedata_min_site1[magpie_feature]:
-                                            magpiedata_min_site1[magpie_feature] = feature_value
-                                    elif magpiedata_min_site1[magpie_feature] == 0:
-                                        magpiedata_min_site1[magpie_feature] = feature_value
-                                    # Difference features (max - min)
-                                    magpiedata_difference_site1[magpie_feature] = magpiedata_max_site1[magpie_feature] - magpiedata_min_site1[magpie_feature]
-                                elif site == "Site2":
-                                    # Composition weighted average by site
-                                    magpiedata_composition_average_site2[magpie_feature] += feature_value*float(site_dict[site][element])/site2_total
-                                    # Arithmetic average by site
-                                    magpiedata_arithmetic_average_site2[magpie_feature] += feature_value / num_site2_elements
-                                    # Max features by site
-                                    if magpiedata_max_site2[magpie_feature] > 0:
-                                        if feature_value > magpiedata_max_site2[magpie_feature]:
-                                            magpiedata_max_site2[magpie_feature] = feature_value
-                                    elif magpiedata_max_site2[magpie_feature] == 0:
-                                        magpiedata_max_site2[magpie_feature] = feature_value
-                                    # Min features by site
-                                    if magpiedata_min_site2[magpie_feature] > 0:
-                                        if feature_value < magpiedata_min_site2[magpie_feature]:
-                                            magpiedata_min_site2[magpie_feature] = feature_value
-                                    elif magpiedata_min_site2[magpie_feature] == 0:
-                                        magpiedata_min_site2[magpie_feature] = feature_value
-                                    # Difference features (max - min)
-                                    magpiedata_difference_site2[magpie_feature] = magpiedata_max_site2[magpie_feature] - magpiedata_min_site2[magpie_feature]
-                                elif site == "Site3":
-                                    # Composition weighted average by site
-                                    magpiedata_composition_average_site3[magpie_feature] += feature_value*float(site_dict[site][element])/site3_total
-                                    # Arithmetic average by site
-                                    magpiedata_arithmetic_average_site3[magpie_feature] += feature_value / num_site3_elements
-                                    # Max features by site
-                                    if magpiedata_max_site3[magpie_feature] > 0:
-                                        if feature_value > magpiedata_max_site3[magpie_feature]:
-                                            magpiedata_max_site3[magpie_feature] = feature_value
-                                    elif magpiedata_max_site3[magpie_feature] == 0:
-                                        magpiedata_max_site3[magpie_feature] = feature_value
-                                    # Min features by site
-                                    if magpiedata_min_site3[magpie_feature] > 0:
-                                        if feature_value < magpiedata_min_site3[magpie_feature]:
-                                            magpiedata_min_site3[magpie_feature] = feature_value
-                                    elif magpiedata_min_site3[magpie_feature] == 0:
-                                        magpiedata_min_site3[magpie_feature] = feature_value
-                                    # Difference features (max - min)
-                                    magpiedata_difference_site3[magpie_feature] = magpiedata_max_site3[magpie_feature] - magpiedata_min_site3[magpie_feature]
-
-        # Change names of features to reflect each computed type of magpie feature (max, min, etc.)
-        magpiedata_composition_average_renamed = {}
-        magpiedata_arithmetic_average_renamed = {}
-        magpiedata_max_renamed = {}
-        magpiedata_min_renamed = {}
-        magpiedata_difference_renamed = {}
-
-        for key in magpiedata_composition_average:
-            magpiedata_composition_average_renamed[key+"_composition_average"] = magpiedata_composition_average[key]
-        for key in magpiedata_arithmetic_average:
-            magpiedata_arithmetic_average_renamed[key+"_arithmetic_average"] = magpiedata_arithmetic_average[key]
-        for key in magpiedata_max:
-            magpiedata_max_renamed[key+"_max_value"] = magpiedata_max[key]
-        for key in magpiedata_min:
-            magpiedata_min_renamed[key+"_min_value"] = magpiedata_min[key]
-        for key in magpiedata_difference:
-            magpiedata_difference_renamed[key+"_difference"] = magpiedata_difference[key]
-
-        # Rename feature dicts for sublattice specific cases
-        magpiedata_composition_average_site1_renamed = {}
-        magpiedata_arithmetic_average_site1_renamed = {}
-        magpiedata_max_site1_renamed = {}
-        magpiedata_min_site1_renamed = {}
-        magpiedata_difference_site1_renamed = {}
-        magpiedata_composition_average_site2_renamed = {}
-        magpiedata_arithmetic_average_site2_renamed = {}
-        magpiedata_max_site2_renamed = {}
-        magpiedata_min_site2_renamed = {}
-        magpiedata_difference_site2_renamed = {}
-        magpiedata_composition_average_site3_renamed = {}
-        magpiedata_arithmetic_average_site3_renamed = {}
-        magpiedata_max_site3_renamed = {}
-        magpiedata_min_site3_renamed = {}
-        magpiedata_difference_site3_renamed = {}
-        if site_dict:
-            if number_sites == 1:
-                for key in magpiedata_composition_average_site1:
-                    magpiedata_composition_average_site1_renamed[key + "_Site1_composition_average"] = magpiedata_composition_average_site1[key]
-                for key in magpiedata_arithmetic_average_site1:
-                    magpiedata_arithmetic_average_site1_renamed[key + "_Site1_arithmetic_average"] = magpiedata_arithmetic_average_site1[key]
-                for key in magpiedata_max_site1:
-                    magpiedata_max_site1_renamed[key + "_Site1_max_value"] = magpiedata_max_site1[key]
-                for key in magpiedata_min_site1:
-                    magpiedata_min_site1_renamed[key + "_Site1_min_value"] = magpiedata_min_site1[key]
-                for key in magpiedata_difference_site1:
-                    magpiedata_difference_site1_renamed[key + "_Site1_difference"] = magpiedata_difference_site1[key]
-            elif number_sites == 2:
-                for key in magpiedata_composition_average_site1:
-                    magpiedata_composition_average_site1_renamed[key + "_Site1_composition_average"] = magpiedata_composition_average_site1[key]
-                for key in magpiedata_arithmetic_average_site1:
-                    magpiedata_arithmetic_average_site1_renamed[key + "_Site1_arithmetic_average"] = magpiedata_arithmetic_average_site1[key]
-                for key in magpiedata_max_site1:
-                    magpiedata_max_site1_renamed[key + "_Site1_max_value"] = magpiedata_max_site1[key]
-                for key in magpiedata_min_site1:
-                    magpiedata_min_site1_renamed[key + "_Site1_min_value"] = magpiedata_min_site1[key]
-                for key in magpiedata_difference_site1:
-                    magpiedata_difference_site1_renamed[key + "_Site1_difference"] = magpiedata_difference_site1[key]
-                for key in magpiedata_composition_average_site2:
-                    magpiedata_composition_average_site2_renamed[key + "_Site2_composition_average"] = magpiedata_composition_average_site2[key]
-                for key in magpiedata_arithmetic_average_site2:
-                    magpiedata_arithmetic_average_site2_renamed[key + "_Site2_arithmetic_average"] = magpiedata_arithmetic_average_site2[key]
-                for key in magpiedata_max_site2:
-                    magpiedata_max_site2_renamed[key + "_Site2_max_value"] = magpiedata_max_site2[key]
-                for key in magpiedata_min_site2:
-                    magpiedata_min_site2_renamed[key + "_Site2_min_value"] = magpiedata_min_site2[key]
-                for key in magpiedata_difference_site2:
-                    magpiedata_difference_site2_renamed[key + "_Site2_difference"] = magpiedata_difference_site2[key]
-            elif number_sites == 3:
-                for key in magpiedata_composition_average_site1:
-                    magpiedata_composition_average_site1_renamed[key + "_Site1_composition_average"] = magpiedata_composition_average_site1[key]
-                for key in magpiedata_arithmetic_average_site1:
-                    magpiedata_arithmetic_average_site1_renamed[key + "_Site1_arithmetic_average"] = magpiedata_arithmetic_average_site1[key]
-                for key in magpiedata_max_site1:
-                    magpiedata_max_site1_renamed[key + "_Site1_max_value"] = magpiedata_max_site1[key]
-                for key in magpiedata_min_site1:
-                    magpiedata_min_site1_renamed[key + "_Site1_min_value"] = magpiedata_min_site1[key]
-                for key in magpiedata_difference_site1:
-                    magpiedata_difference_site1_renamed[key + "_Site1_difference"] = magpiedata_difference_site1[key]
-                for key in magpiedata_composition_average_site2:
-                    magpiedata_composition_average_site2_renamed[key + "_Site2_composition_average"] = magpiedata_composition_average_site2[key]
-                for key in magpiedata_arithmetic_average_site2:
-                    magpiedata_arithmetic_average_site2_renamed[key + "_Site2_arithmetic_average"] = magpiedata_arithmetic_average_site2[key]
-                for key in magpiedata_max_site2:
-                    magpiedata_max_site2_renamed[key + "_Site2_max_value"] = magpiedata_max_site2[key]
-                for key in magpiedata_min_site2:
-                    magpiedata_min_site2_renamed[key + "_Site2_min_value"] = magpiedata_min_site2[key]
-                for key in magpiedata_difference_site2:
-                    magpiedata_difference_site2_renamed[key + "_Site2_difference"] = magpiedata_difference_site2[key]
-                for key in magpiedata_composition_average_site3:
-                    magpiedata_composition_average_site3_renamed[key + "_Site3_composition_average"] = magpiedata_composition_average_site3[key]
-                for key in magpiedata_arithmetic_average_site3:
-                    magpiedata_arithmetic_average_site3_renamed[key + "_Site3_arithmetic_average"] = magpiedata_arithmetic_average_site3[key]
-                for key in magpiedata_max_site3:
-                    magpiedata_max_site3_renamed[key + "_Site3_max_value"] = magpiedata_max_site3[key]
-                for key in magpiedata_min_site1:
-                    magpiedata_min_site3_renamed[key + "_Site3_min_value"] = magpiedata_min_site3[key]
-                for key in magpiedata_difference_site3:
-                    magpiedata_difference_site3_renamed[key + "_Site3_difference"] = magpiedata_difference_site3[key]
-
-        if site_dict:
-            if number_sites == 1:
-                return (magpiedata_composition_average_renamed, magpiedata_arithmetic_average_renamed,
-                        magpiedata_max_renamed, magpiedata_min_renamed, magpiedata_difference_renamed,
-                        magpiedata_composition_average_site1_renamed, magpiedata_arithmetic_average_site1_renamed,
-                        magpiedata_max_site1_renamed, magpiedata_min_site1_renamed, magpiedata_difference_site1_renamed)
-            elif number_sites == 2:
-                return (magpiedata_composition_average_renamed, magpiedata_arithmetic_average_renamed,
-                        magpiedata_max_renamed, magpiedata_min_renamed, magpiedata_difference_renamed,
-                        magpiedata_composition_average_site1_renamed, magpiedata_arithmetic_average_site1_renamed,
-                        magpiedata_max_site1_renamed, magpiedata_min_site1_renamed, magpiedata_difference_site1_renamed,
-                        magpiedata_composition_average_site2_renamed, magpiedata_arithmetic_average_site2_renamed,
-                        magpiedata_max_site2_renamed, magpiedata_min_site2_renamed, magpiedata_difference_site2_renamed)
-            elif number_sites == 3:
-                return (magpiedata_composition_average_renamed, magpiedata_arithmetic_average_renamed,
-                        magpiedata_max_renamed, magpiedata_min_renamed, magpiedata_difference_renamed,
-                        magpiedata_composition_average_site1_renamed, magpiedata_arithmetic_average_site1_renamed,
-                        magpiedata_max_site1_renamed, magpiedata_min_site1_renamed, magpiedata_difference_site1_renamed,
-                        magpiedata_composition_average_site2_renamed, magpiedata_arithmetic_average_site2_renamed,
-                        magpiedata_max_site2_renamed, magpiedata_min_site2_renamed, magpiedata_difference_site2_renamed,
-                        magpiedata_composition_average_site3_renamed, magpiedata_arithmetic_average_site3_renamed,
-                        magpiedata_max_site3_renamed, magpiedata_min_site3_renamed, magpiedata_difference_site3_renamed)
-        else:
-            return (magpiedata_composition_average_renamed, magpiedata_arithmetic_average_renamed,
-                    magpiedata_max_renamed, magpiedata_min_renamed, magpiedata_difference_renamed)
-
-    def _get_atomic_magpie_features(self, composition, data_path):
-        # Get .table files containing feature values for each element, assign file names as feature names
-        magpie_feature_names = []
-        for f in os.listdir(data_path):
-            if '.table' in f:
-                magpie_feature_names.append(f[:-6])
-
-        composition = Composition(composition)
-        element_list, atoms_per_formula_unit = self._get_element_list(composition=composition)
-
-        element_dict = {}
-        for element in element_list:
-            element_dict[element] = Element(element).Z
-
-        magpiedata_atomic = {}
-        for k, v in element_dict.items():
-            atomic_values = {}
-            for feature_name in magpie_feature_names:
-                f = open(data_path + '/' + feature_name + '.table', 'r')
-                # Get Magpie data of relevant atomic numbers for this composition
-                for line, feature_value in enumerate(f.readlines()):
-                    if line + 1 == v:
-                        if "Missing" not in feature_value and "NA" not in feature_value:
-                            if feature_name != "OxidationStates":
-                                try:
-                                    atomic_values[feature_name] = float(feature_value.strip())
-                                except ValueError:
-                                    atomic_values[feature_name] = 'NaN'
-                        if "Missing" in feature_value:
-                            atomic_values[feature_name] = 'NaN'
-                        if "NA" in feature_value:
-                            atomic_values[feature_name] = 'NaN'
-                f.close()
-            magpiedata_atomic[k] = atomic_values
-
-        return magpiedata_atomic
-
-    def _get_element_list(self, composition):
-        element_amounts = composition.get_el_amt_dict()
-        atoms_per_formula_unit = 0
-        for v in element_amounts.values():
-            atoms_per_formula_unit += v
-
-        # Get list of unique elements present
-        element_list = []
-        for k in element_amounts:
-            if k not in element_list:
-                element_list.append(k)
-
-        return element_list, atoms_per_formula_unit
+        Returns:
+
+            element_values: (numpy array), array of shape (n_compositions, max_elements, n_features). Padding is NaN
+
+            element_weights: (numpy array), array of shape (n_compositions, max_elements) of atomic fractions
+        """
+        max_elements = max([len(el_amt_dict) for el_amt_dict in el_amt_dicts] + [1])
+        # Row 0 of the table is all NaN, so it doubles as the padding for compositions with fewer elements
+        atomic_numbers = np.zeros((len(el_amt_dicts), max_elements), dtype=int)
+        element_weights = np.zeros((len(el_amt_dicts), max_elements))
+        for i, el_amt_dict in enumerate(el_amt_dicts):
+            atoms_per_formula_unit = sum(el_amt_dict.values())
+            for j, (element, amount) in enumerate(el_amt_dict.items()):
+                Z = Element(element).Z
+                atomic_numbers[i, j] = Z if Z < table.shape[0] else 0
+                element_weights[i, j] = amount/atoms_per_formula_unit
+        return table[atomic_numbers], element_weights
+
+    def _get_computed_magpie_features(self, element_values, element_weights):
+        """
+        Computes the composition average, arithmetic average, max, min and difference features of all compositions at
+        once. Missing values are left out of every statistic, and statistics with no values at all are 0.
+
+        Returns:
+
+            (numpy array), array of shape (n_compositions, 5, n_features), in the above order of statistics
+        """
+        present = ~np.isnan(element_values)
+        values = np.where(present, element_values, 0)
+        number_elements = np.count_nonzero(element_weights, axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            composition_average = np.einsum('ce,cef->cf', element_weights, values)
+            arithmetic_average = values.sum(axis=1) / number_elements[:, np.newaxis]
+        max_value = np.where(present, element_values, -np.inf).max(axis=1)
+        min_value = np.where(present, element_values, np.inf).min(axis=1)
+        max_value[np.isinf(max_value)] = 0
+        min_value[np.isinf(min_value)] = 0
+        difference = max_value - min_value
+
+        statistics = np.stack([composition_average, arithmetic_average, max_value, min_value, difference], axis=1)
+        # Compositions without any elements get no features at all
+        statistics[number_elements == 0] = np.nan
+        return statistics
 
 class MaterialsProjectFeatureGeneration(object):
     """
@@ -1206,6 +1020,17 @@ class MaterialsProjectFeatureGeneration(object):
 
         composition_feature: (str), string denoting a chemical composition to generate elemental features from
 
+        cache: (mastml.cache.DiskCache), optional cache of previous Materials Project responses, keyed by composition
+
+        n_jobs: (int), maximum number of requests sent to Materials Project at the same time
+
+        max_retries: (int), number of times a failed request is retried, with exponential backoff, before giving up
+
+        endpoint: (str), optional URL of the Materials Project REST API, e.g. of a local stub server
+
+        client: (object), optional client to query instead of an MPRester, e.g. one returning recorded responses. It
+        must have a get_data(chemsys_formula_id) method returning a list of dicts, like MPRester
+
     Methods:
 
         generate_materialsproject_features : generates materials project feature set based on compositions in dataframe
@@ -1217,10 +1042,18 @@ class MaterialsProjectFeatureGeneration(object):
             Returns:
                 dataframe: (dataframe), dataframe containing materials project feature set
     """
-    def __init__(self, dataframe, mapi_key, composition_feature):
+    def __init__(self, dataframe, mapi_key, composition_feature, cache=None, n_jobs=8, max_retries=3, endpoint=None,
+                 client=None):
         self.dataframe = dataframe
         self.mapi_key = mapi_key
         self.composition_feature = composition_feature
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.max_retries = max_retries
+        # One client is shared by all requests, so its HTTP session and connections are reused
+        if client is None:
+            client = MPRester(mapi_key) if endpoint is None else MPRester(mapi_key, endpoint=endpoint)
+        self.client = client
 
     def generate_materialsproject_features(self):
         try:
@@ -1228,18 +1061,11 @@ class MaterialsProjectFeatureGeneration(object):
         except KeyError as e:
             raise utils.MissingColumnError(f'No column named {self.composition_feature} in csv file')
 
-        mpdata_dict_composition = {}
-
-        # before: 11 hits for a total of ~6 seconds
-        #for composition in compositions:
-        #    composition_data_mp = self._get_data_from_materials_project(composition=composition)
-        #    mpdata_dict_composition[composition] = composition_data_mp
-        # after: 2.5 seconds!!!
-        pool = multiprocessing.Pool(processes=20)
-        #comp_data_mp = pool.map(self._get_data_from_materials_project, compositions)
-        comp_data_mp = map(self._get_data_from_materials_project, compositions)
-
-        mpdata_dict_composition.update(dict(zip(compositions, comp_data_mp)))
+        # Only query each distinct composition once, the reindex below broadcasts the data back to every row
+        compositions = unique_compositions(compositions)[0]
+        responses = self._get_responses(compositions)
+        mpdata_dict_composition = {composition: self._get_data_from_materials_project(composition, responses[composition])
+                                   for composition in compositions}
 
         dataframe = self.dataframe
         dataframe_mp = pd.DataFrame.from_dict(data=mpdata_dict_composition, orient='index')
@@ -1255,10 +1081,26 @@ class MaterialsProjectFeatureGeneration(object):
 
         return dataframe
 
-    def _get_data_from_materials_project(self, composition):
-        mprester = MPRester(self.mapi_key)
-        structure_data_list = mprester.get_data(chemsys_formula_id=composition)
-
+    def _get_responses(self, compositions):
+        """
+        Returns a dict of composition to the list of structure data dicts Materials Project has for it. Cached
+        compositions are not requested again, the rest are requested concurrently by a pool of threads
+        """
+        responses = dict()
+        if self.cache is not None:
+            responses.update(self.cache.get_many(compositions))
+            log.info(f'Found {len(responses)}/{len(compositions)} compositions in the Materials Project cache')
+        missing = [composition for composition in compositions if composition not in responses]
+
+        query = lambda composition: call_with_retries(lambda: self.client.get_data(chemsys_formula_id=composition),
+                                                      max_retries=self.max_retries)
+        new_responses = dict(zip(missing, parallel.parallel_map(query, missing, n_jobs=self.n_jobs, backend='threads')))
+        if self.cache is not None and new_responses:
+            self.cache.put_many(new_responses)
+        responses.update(new_responses)
+        return responses
+
+    def _get_data_from_materials_project(self, composition, structure_data_list):
         # Sort structures by stability (i.e. E above hull), and only return most stable compound data
         if len(structure_data_list) > 0:
             structure_data_list = sorted(structure_data_list, key=lambda e_above: e_above['e_above_hull'])
@@ -1304,6 +1146,40 @@ class MaterialsProjectFeatureGeneration(object):
             log.info(f'MAterials Project Feature Generation {composition} {structure_data_dict_condensed}')
         return structure_data_dict_condensed
 
+class CitrineSearchClient(object):
+    """
+    Class that sends a single Citrination PIF query per composition
+
+    Args:
+
+        api_key: (str), your Citrination API key
+
+        site: (str), URL of the Citrination site to query
+
+    Methods:
+
+        search: get the PIF search hits of a composition
+
+            Args:
+
+                composition: (str), a chemical composition
+
+            Returns:
+
+                (list), list of hit dicts, empty if Citrination has no records of the composition
+
+    """
+    def __init__(self, api_key, site='https://citrination.com'):
+        # Imported here, as the Citrination client is only needed for Citrine feature generation
+        # trouble? try: `pip install citrination_client=="2.1.0"`
+        from citrination_client import CitrinationClient
+        self.client = CitrinationClient(api_key, site)
+
+    def search(self, composition):
+        from citrination_client import PifQuery, SystemQuery, ChemicalFieldQuery, ChemicalFilter
+        pif_query = PifQuery(system=SystemQuery(chemical_formula=ChemicalFieldQuery(filter=ChemicalFilter(equal=composition))))
+        return self.client.search(pif_query).as_dictionary().get('hits', list())
+
 class CitrineFeatureGeneration(object):
     """
     Class to generate new features using Citrine data and dataframe containing material compositions
@@ -1316,6 +1192,15 @@ class CitrineFeatureGeneration(object):
 
         composition_feature: (str), string denoting a chemical composition to generate elemental features from
 
+        cache: (mastml.cache.DiskCache), optional cache of previous Citrination search hits, keyed by composition
+
+        n_jobs: (int), maximum number of queries sent to Citrination at the same time
+
+        max_retries: (int), number of times a failed query is retried, with exponential backoff, before giving up
+
+        client: (object), optional client to query instead of a CitrineSearchClient, e.g. a mock for offline tests. It
+        must have a search(composition) method returning a list of hit dicts, like CitrineSearchClient
+
     Methods:
 
         generate_citrine_features : generates Citrine feature set based on compositions in dataframe
@@ -1328,11 +1213,14 @@ class CitrineFeatureGeneration(object):
 
                 dataframe: (dataframe), dataframe containing citrine generated feature set
     """
-    def __init__(self, dataframe, api_key, composition_feature):
+    def __init__(self, dataframe, api_key, composition_feature, cache=None, n_jobs=4, max_retries=3, client=None):
         self.dataframe = dataframe
         self.api_key = api_key
-        self.client = CitrinationClient(api_key, 'https://citrination.com')
+        self.client = client if client is not None else CitrineSearchClient(api_key)
         self.composition_feature = composition_feature
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.max_retries = max_retries
 
     def generate_citrine_features(self):
         log.warning('WARNING: You have specified generation of features from Citrine. Based on which'
@@ -1348,13 +1236,10 @@ class CitrineFeatureGeneration(object):
         citrine_dict_property_max = dict()
         citrine_dict_property_avg = dict()
 
-        # before: ~11 seconds
-        # made into a func so we can do requests in parallel
-
-        # now like 1.8 secs!
-        pool = multiprocessing.Pool(processes=20)
-        #result_tuples = pool.map(self._load_composition, compositions)
-        result_tuples = map(self._load_composition, compositions)
+        # Only query each distinct composition once, the reindex below broadcasts the data back to every row
+        compositions = unique_compositions(compositions)[0]
+        pifqueries = self._get_pifqueries(compositions)
+        result_tuples = [self._load_composition(pifqueries[composition]) for composition in compositions]
 
         for comp, (prop_min, prop_max, prop_avg) in zip(compositions, result_tuples):
             citrine_dict_property_min[comp] = prop_min
@@ -1377,21 +1262,34 @@ class CitrineFeatureGeneration(object):
 
         return dataframe
 
-    def _load_composition(self, composition):
-        pifquery = self._get_pifquery(composition=composition)
+    def _load_composition(self, pifquery):
         property_name_list, property_value_list = self._get_pifquery_property_list(pifquery=pifquery)
-        #print("Citrine Feature Generation: ", composition, property_name_list, property_value_list)
         property_names_unique, parsed_property_min, parsed_property_max, parsed_property_avg = self._parse_pifquery_property_list(property_name_list=property_name_list, property_value_list=property_value_list)
         return parsed_property_min, parsed_property_max, parsed_property_avg
 
+    def _get_pifqueries(self, compositions):
+        """
+        Returns a dict of composition to its list of Citrination search hits. Cached compositions are not queried
+        again, the rest are queried concurrently, with at most n_jobs queries in flight
+        """
+        pifqueries = dict()
+        if self.cache is not None:
+            pifqueries.update(self.cache.get_many(compositions))
+            log.info(f'Found {len(pifqueries)}/{len(compositions)} compositions in the Citrine cache')
+        missing = [composition for composition in compositions if composition not in pifqueries]
+
+        new_pifqueries = dict(zip(missing, parallel.parallel_map(self._get_pifquery, missing, n_jobs=self.n_jobs,
+                                                                 backend='threads')))
+        if self.cache is not None and new_pifqueries:
+            self.cache.put_many(new_pifqueries)
+        pifqueries.update(new_pifqueries)
+        return pifqueries
+
     def _get_pifquery(self, composition):
-        # TODO: does this stop csv generation on first invalid composition?
-        # TODO: Is there a way to send many compositions in one call to citrine?
-        pif_query = PifQuery(system=SystemQuery(chemical_formula=ChemicalFieldQuery(filter=ChemicalFilter(equal=composition))))
-        # Check if any results found
-        if 'hits' not in self.client.search(pif_query).as_dictionary():
-            raise KeyError('No results found!')
-        pifquery = self.client.search(pif_query).as_dictionary()['hits']
+        # A single query per composition, which both tells whether there are any results and returns them
+        pifquery = call_with_retries(lambda: self.client.search(composition), max_retries=self.max_retries)
+        if len(pifquery) == 0:
+            log.warning(f'No data found for composition "{composition}" using Citrine')
         return pifquery
 
     def _get_pifquery_property_list(self, pifquery):
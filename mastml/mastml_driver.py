@@ -8,6 +8,7 @@ import os
 import shutil
 import logging
 import warnings
+import threading
 from datetime import datetime
 from collections import OrderedDict
 from os.path import join # We use join tons
@@ -15,12 +16,13 @@ from functools import reduce
 
 import numpy as np
 import pandas as pd
-from sklearn.externals import joblib
 from sklearn.exceptions import UndefinedMetricWarning
 from sklearn.model_selection import LeaveOneGroupOut
 from sklearn.metrics import make_scorer
+from sklearn.base import clone
 
-from mastml import conf_parser, data_loader, html_helper, plot_helper, utils, learning_curve, data_cleaner, metrics
+from mastml import (conf_parser, data_loader, html_helper, plot_helper, utils, learning_curve, data_cleaner, metrics,
+                    parallel, result_store, background_writer, render)
 from mastml.legos import (data_splitters, feature_generators, feature_normalizers,
                     feature_selectors, model_finder, util_legos, randomizers, hyper_opt)
 from mastml.legos import clusterers as legos_clusterers
@@ -95,19 +97,35 @@ def mastml_run(conf_path, data_path, outdir):
     log.info("Copying input files to output directory...")
     shutil.copy2(conf_path, outdir)
     shutil.copy2(data_path, outdir)
+    # Every file written from here on is added to the report manifest, which the html pages are made from
+    html_helper.start_report(outdir)
+    for path in [conf_path, data_path, 'log.log', 'errors.log']:
+        if os.path.isfile(join(outdir, os.path.basename(path))):
+            html_helper.add_artifact(join(outdir, os.path.basename(path)))
 
     # Load in and parse the configuration and data files:
     conf = conf_parser.parse_conf_file(conf_path)
     PlotSettings = conf['PlotSettings']
+    # With defer_rendering, plots are only recorded here and drawn later by `python -m mastml.render outdir`
+    render.defer_plots(outdir if PlotSettings['defer_rendering'] else None, notebooks=PlotSettings['notebooks'])
+    if not PlotSettings['defer_rendering']:
+        plot_helper.set_notebook_mode(PlotSettings['notebooks'], outdir)
+        render.start_plot_pool(PlotSettings['n_jobs'])
     is_classification = conf['is_classification']
     # The df is used by feature generators, clusterers, and grouping_column to 
     # create more features for x.
     # X is model input, y is target feature for model
+    # Columns that other sections use (validation columns, grouping columns, compositions of feature generators) have
+    # to be loaded too
+    extra_columns = conf_parser.get_extra_columns(conf)
     df, X, X_noinput, X_grouped, y = data_loader.load_data(data_path,
                                      conf['GeneralSetup']['input_features'],
                                      conf['GeneralSetup']['target_feature'],
                                      conf['GeneralSetup']['grouping_feature'],
-                                     conf['GeneralSetup']['not_input_features'])
+                                     conf['GeneralSetup']['not_input_features'],
+                                     extra_features=extra_columns,
+                                     chunksize=conf['GeneralSetup']['chunksize'],
+                                     float_dtype=conf['GeneralSetup']['float_dtype'])
     if not conf['GeneralSetup']['grouping_feature']:
         X_grouped = pd.DataFrame()
 
@@ -206,11 +224,38 @@ def mastml_run(conf_path, data_path, outdir):
     if conf['PlotSettings']['target_histogram']:
         # First, save input data stats to csv
         y.describe().to_csv(join(outdir, 'input_data_statistics.csv'))
+        html_helper.add_artifact(join(outdir, 'input_data_statistics.csv'))
         plot_helper.plot_target_histogram(y, join(outdir, 'target_histogram.png'), label=y.name)
 
     # Get the appropriate collection of metrics:
     metrics_dict = conf['GeneralSetup']['metrics']
 
+    # Number of workers and worker type, and whether they run the splits of each splitter or whole combos
+    n_jobs = conf['GeneralSetup']['n_jobs']
+    backend = conf['GeneralSetup']['backend']
+    parallel_over = conf['GeneralSetup']['parallel_over']
+    memory_budget = conf['GeneralSetup']['memory_budget']
+    split_n_jobs = n_jobs if parallel_over == 'splits' else 1
+    result_format = conf['GeneralSetup']['result_format']
+    # Models, csv files and stats of the splits are written in the background while the next split is fit
+    writer = background_writer.BackgroundWriter(conf['GeneralSetup']['write_queue_size'])
+
+    # Matplotlib is not thread safe, so with the 'threads' backend the plots of the worker threads are queued and drawn
+    # by the main thread (or sent to the plot pool from it) once the workers are done
+    pending_plots = list()
+    def draw_plot(plot_func, *args, **kwargs):
+        if backend == 'threads' and threading.current_thread() is not threading.main_thread():
+            pending_plots.append((plot_func, args, kwargs))
+        else:
+            plot_func(*args, **kwargs)
+
+    def draw_pending_plots():
+        if threading.current_thread() is not threading.main_thread():
+            return
+        while pending_plots:
+            plot_func, args, kwargs = pending_plots.pop(0)
+            plot_func(*args, **kwargs)
+
     # Extract columns that some splitter need to do grouped splitting using 'grouping_column'
     # special argument
     splitter_to_group_names = _extract_grouping_column_names(conf['DataSplits'])
@@ -322,6 +367,7 @@ def mastml_run(conf_path, data_path, outdir):
             log.debug(f'generated cols: {dataframe.columns}')
             filename = join(outdir, "generated_features.csv")
             pd.concat([dataframe, X_noinput, y], 1).to_csv(filename, index=False)
+            html_helper.add_artifact(filename)
             return dataframe
         generated_df = generate_features()
 
@@ -330,6 +376,7 @@ def mastml_run(conf_path, data_path, outdir):
             log.info("Saving generated data without constant columns to csv...")
             filename = join(outdir, "generated_features_no_constant_columns.csv")
             pd.concat([dataframe, X_noinput, y], 1).to_csv(filename, index=False)
+            html_helper.add_artifact(filename)
             return dataframe
         generated_df = remove_constants()
 
@@ -400,6 +447,7 @@ def mastml_run(conf_path, data_path, outdir):
         if not clustered_df.empty:
             X = pd.concat([X, clustered_df], axis=1)
         pd.concat([X, y], 1).to_csv(join(outdir, "clusters.csv"), index=False)
+        html_helper.add_artifact(join(outdir, "clusters.csv"))
 
         def make_normalizer_selector_dataframe_triples(models):
             triples = []
@@ -411,7 +459,7 @@ def mastml_run(conf_path, data_path, outdir):
                 log.info("Saving normalized data to csv...")
                 dirname = join(outdir, normalizer_name)
                 os.mkdir(dirname)
-                pd.concat([X_normalized, X_noinput, y], 1).to_csv(join(dirname, "normalized.csv"), index=False)
+                html_helper.add_file(outdir, _save_stage(join(dirname, "normalized"), X_normalized, X_noinput, y, result_format))
 
                 # Put learning curve here??
                 if conf['LearningCurve']:
@@ -462,7 +510,7 @@ def mastml_run(conf_path, data_path, outdir):
                     log.info("    Saving selected features to csv...")
                     dirname = join(outdir, normalizer_name, selector_name)
                     os.mkdir(dirname)
-                    pd.concat([X_selected, X_noinput, y], 1).to_csv(join(dirname, "selected.csv"), index=False)
+                    html_helper.add_file(outdir, _save_stage(join(dirname, "selected"), X_selected, X_noinput, y, result_format))
                     triples.append((normalizer_name, selector_name, X_selected))
 
                     # Run Hyperparam optimization, update model list with optimized model(s)
@@ -596,7 +644,8 @@ def mastml_run(conf_path, data_path, outdir):
             models = list(models.items())
             original_models = list(original_models.items())
             original_model_names = [model[0] for model in original_models]
-            all_results = []
+            # Build every (normalizer, selector, model, splitter) leaf up front, then fit them all
+            combos = []
             for normalizer_name, selector_name, X in normalizer_selector_dataframe_triples:
                 subdir = join(outdir, normalizer_name, selector_name)
 
@@ -618,12 +667,38 @@ def mastml_run(conf_path, data_path, outdir):
                         for splitter_name, trains_tests in splittername_splitlist_pairs:
                             grouping_data = splitter_to_group_column[splitter_name]
                             subdir = join(normalizer_name, selector_name, model_name, splitter_name)
-                            log.info(f"    Running splits for {subdir}")
                             subsubdir = join(outdir, subdir)
                             os.makedirs(subsubdir)
-                            # NOTE: do_one_splitter is a big old function, does lots
-                            runs = do_one_splitter(X, y, model_instance, subsubdir, trains_tests, grouping_data)
-                            all_results.extend(runs)
+                            combos.append((subdir, X, model_instance, subsubdir, trains_tests, grouping_data))
+
+            def do_one_combo(combo_num):
+                subdir, X, model_instance, subsubdir, trains_tests, grouping_data = combos[combo_num]
+                log.info(f"    Running splits for {subdir}")
+                # Threads share the same model instance, so each combo needs its own copy to fit
+                if parallel_over == 'combos' and backend == 'threads':
+                    model_instance = clone(model_instance)
+                # NOTE: do_one_splitter is a big old function, does lots
+                runs = do_one_splitter(X, y, model_instance, subsubdir, trains_tests, grouping_data)
+                # The report lists the combo as soon as it is done, so a running job can be browsed
+                html_helper.add_combo(outdir, subsubdir, len(trains_tests))
+                return runs
+
+            if parallel_over == 'combos':
+                # Only the combo index is sent to the workers, forked workers already have the data
+                combo_n_jobs = parallel.workers_for_budget(n_jobs,
+                                                           max((_estimate_task_megabytes(combo[1]) for combo in combos),
+                                                               default=0),
+                                                           memory_budget)
+                log.info(f"    Running {len(combos)} combos with {combo_n_jobs} {backend} workers")
+                combo_results = parallel.parallel_map(do_one_combo, range(len(combos)),
+                                                      n_jobs=combo_n_jobs, backend=backend)
+                draw_pending_plots()
+            else:
+                combo_results = [do_one_combo(combo_num) for combo_num in range(len(combos))]
+
+            all_results = []
+            for runs in combo_results:
+                all_results.extend(runs)
             return all_results
 
         return do_models_splits(models, original_models)
@@ -633,6 +708,9 @@ def mastml_run(conf_path, data_path, outdir):
         def one_fit(split_num, train_indices, test_indices):
 
             log.info(f"        Doing split number {split_num}")
+            # Threads share the same model instance, and their error plots are drawn after the later splits are fit, so
+            # each split needs its own copy to fit
+            split_model = clone(model) if backend == 'threads' else model
             train_X, train_y = X.loc[train_indices], y.loc[train_indices]
             test_X,  test_y  = X.loc[test_indices],  y.loc[test_indices]
 
@@ -648,13 +726,16 @@ def mastml_run(conf_path, data_path, outdir):
             log.info("             Fitting model and making predictions...")
             # Catch the ValueError associated with not being able to convert string to float
             try:
-                model.fit(train_X, train_y)
+                split_model.fit(train_X, train_y)
             except ValueError:
                 raise utils.InvalidValue('MAST-ML has detected that one of your feature vectors contains a string, and cannot be'
                                    'used in model fitting. Please add any features that contain strings to the "not_input_features"'
                                    'field of the input file')
             # Save off the trained model as .pkl for future import
-            joblib.dump(model, join(path, str(model.__class__.__name__)+"_split_"+str(split_num)+".pkl"))
+            model_path = join(path, str(split_model.__class__.__name__)+"_split_"+str(split_num)+".pkl")
+            writer.dump_model(split_model, model_path)
+            # Each file is added to the report once the writer has written it
+            writer.submit(html_helper.add_artifact, model_path)
 
             if is_classification:
                 # For classification, need probabilty of prediction to make accurate ROC curve (and other predictions??).
@@ -666,22 +747,23 @@ def mastml_run(conf_path, data_path, outdir):
                 #params = model.get_params()
                 #if params['probability'] == True:
                 try:
-                    train_pred_proba = model.predict_proba(train_X)
-                    test_pred_proba = model.predict_proba(test_X)
+                    train_pred_proba = split_model.predict_proba(train_X)
+                    test_pred_proba = split_model.predict_proba(test_X)
                 except:
                     log.error('You need to perform classification with model param probability=True enabled for accurate'
                                 ' predictions, if your model has the probability param (e.g. RandomForestClassifier does not. '
                               'Please reset this parameter as applicable and re-run MASTML')
                     exit()
-                train_pred = model.predict(train_X)
-                test_pred = model.predict(test_X)
+                train_pred = split_model.predict(train_X)
+                test_pred = split_model.predict(test_X)
             else:
-                train_pred = model.predict(train_X)
-                test_pred  = model.predict(test_X)
+                train_pred = split_model.predict(train_X)
+                test_pred  = split_model.predict(test_X)
 
                 # Here- for Random Forest output feature importances
-                if model.__class__.__name__=='RandomForestRegressor':
-                    pd.concat([pd.DataFrame(X.columns), pd.DataFrame(model.feature_importances_)],  1).to_csv(join(path, 'randomforest_featureimportances.csv'), index=False)
+                if split_model.__class__.__name__=='RandomForestRegressor':
+                    writer.submit(pd.concat([pd.DataFrame(X.columns), pd.DataFrame(split_model.feature_importances_)],  1).to_csv, join(path, 'randomforest_featureimportances.csv'), index=False)
+                    writer.submit(html_helper.add_artifact, join(path, 'randomforest_featureimportances.csv'))
 
             # here is where we need to collect validation stats
             if is_validation:
@@ -691,29 +773,40 @@ def mastml_run(conf_path, data_path, outdir):
                     validation_X_forpred = _only_validation(X, validation_columns[validation_column_name])
                     validation_y_forpred = _only_validation(y, validation_columns[validation_column_name])
                     log.info("             Making predictions on prediction_only data...")
-                    validation_predictions = model.predict(validation_X_forpred)
+                    validation_predictions = split_model.predict(validation_X_forpred)
                     validation_predictions_list.append(validation_predictions)
                     validation_y_forpred_list.append(validation_y_forpred)
 
                     # save them as 'predicitons.csv'
                     validation_predictions_series = pd.Series(validation_predictions, name='clean_predictions', index=validation_X_forpred.index)
                     #validation_noinput_series = pd.Series(X_noinput.index, index=validation_X.index)
-                    pd.concat([validation_X_forpred,  validation_y_forpred,  validation_predictions_series],  1)\
-                            .to_csv(join(path, 'predictions_'+str(validation_column_name)+'.csv'), index=False)
+                    writer.submit(pd.concat([validation_X_forpred,  validation_y_forpred,  validation_predictions_series],  1)\
+                            .to_csv, join(path, 'predictions_'+str(validation_column_name)+'.csv'), index=False)
+                    writer.submit(html_helper.add_artifact, join(path, 'predictions_'+str(validation_column_name)+'.csv'))
             else:
                 validation_y = None
             
 
-            # Save train and test data and results to csv:
-            log.info("             Saving train/test data and predictions to csv...")
-            train_pred_series = pd.DataFrame(train_pred, columns=['train_pred'], index=train_indices)
-            train_noinput_series = pd.DataFrame(X_noinput, index=train_indices)
-            pd.concat([train_X, train_y, train_pred_series, train_noinput_series], 1)\
-                    .to_csv(join(path, 'train.csv'), index=False)
-            test_pred_series = pd.DataFrame(test_pred,   columns=['test_pred'],  index=test_indices)
-            test_noinput_series = pd.DataFrame(X_noinput, index=test_indices)
-            pd.concat([test_X,  test_y,  test_pred_series, test_noinput_series],  1)\
-                    .to_csv(join(path, 'test.csv'),  index=False)
+            if result_format == 'csv':
+                # Save train and test data and results to csv:
+                log.info("             Saving train/test data and predictions to csv...")
+                train_pred_series = pd.DataFrame(train_pred, columns=['train_pred'], index=train_indices)
+                train_noinput_series = pd.DataFrame(X_noinput, index=train_indices)
+                writer.submit(pd.concat([train_X, train_y, train_pred_series, train_noinput_series], 1)\
+                        .to_csv, join(path, 'train.csv'), index=False)
+                test_pred_series = pd.DataFrame(test_pred,   columns=['test_pred'],  index=test_indices)
+                test_noinput_series = pd.DataFrame(X_noinput, index=test_indices)
+                writer.submit(pd.concat([test_X,  test_y,  test_pred_series, test_noinput_series],  1)\
+                        .to_csv, join(path, 'test.csv'),  index=False)
+                writer.submit(html_helper.add_artifact, join(path, 'train.csv'))
+                writer.submit(html_helper.add_artifact, join(path, 'test.csv'))
+            else:
+                # The data is already stored once for the selector, so only the rows and predictions are saved
+                log.info(f"             Saving train/test predictions as {result_format}...")
+                stage_path = join(main_path, os.pardir, os.pardir, 'selected' + result_store.EXTENSIONS[result_format])
+                writer.submit(result_store.write_split, path, stage_path, train_indices, train_pred, test_indices,
+                              test_pred, result_format)
+                writer.submit(html_helper.add_artifact, join(path, 'predictions' + result_store.EXTENSIONS[result_format]))
 
 
             log.info("             Calculating score metrics...")
@@ -726,16 +819,11 @@ def mastml_run(conf_path, data_path, outdir):
                 # This warning is raised when you ask for Recall on something from y_true that never
                 # occors in y_pred. sklearn assumes 0.0, and we want it to do so (silently).
                 warnings.simplefilter('ignore', UndefinedMetricWarning)
-                train_metrics = OrderedDict((name, function(train_y, train_pred))
-                                            for name, (_, function) in metrics_dict.items())
-                test_metrics = OrderedDict((name, function(test_y, test_pred))
-                                           for name, (_, function) in metrics_dict.items())
                 # Need to pass y_train data to get rmse/sigma for test rmse and sigma of train y
-                if 'rmse_over_stdev' in metrics_dict.keys():
-                    test_metrics['rmse_over_stdev'] = metrics_dict['rmse_over_stdev'][1](test_y, test_pred, train_y)
-                if 'R2_adjusted' in metrics_dict.keys():
-                    test_metrics['R2_adjusted'] = metrics_dict['R2_adjusted'][1](test_y, test_pred, test_X.shape[1])
-                    train_metrics['R2_adjusted'] = metrics_dict['R2_adjusted'][1](train_y, train_pred, train_X.shape[1])
+                train_metrics = metrics.compute_metrics(metrics_dict, train_y, train_pred, train_y=train_y,
+                                                        n_features=train_X.shape[1])
+                test_metrics = metrics.compute_metrics(metrics_dict, test_y, test_pred, train_y=train_y,
+                                                       n_features=test_X.shape[1])
 
                 split_result = OrderedDict(
                     normalizer=split_path[-4],
@@ -758,11 +846,9 @@ def mastml_run(conf_path, data_path, outdir):
                 if is_validation:
                     prediction_metrics_list = list()
                     for validation_column_name, validation_y, validation_predictions in zip(validation_column_names, validation_y_forpred_list, validation_predictions_list):
-                        prediction_metrics = OrderedDict((name, function(validation_y, validation_predictions))
-                                           for name, (_, function) in metrics_dict.items())
-                        if 'rmse_over_stdev' in prediction_metrics.keys():
-                            # Correct series passed?
-                            prediction_metrics['rmse_over_stdev'] = metrics_dict['rmse_over_stdev'][1](validation_y, validation_predictions, train_y)
+                        # Correct series passed?
+                        prediction_metrics = metrics.compute_metrics(metrics_dict, validation_y, validation_predictions,
+                                                                     train_y=train_y)
                         prediction_metrics_list.append(prediction_metrics)
                         split_result['y_validation_true'+'_'+str(validation_column_name)] = validation_y.values
                         split_result['y_validation_pred'+'_'+str(validation_column_name)] = validation_predictions
@@ -776,64 +862,71 @@ def mastml_run(conf_path, data_path, outdir):
 
             log.info("             Making plots...")
             if PlotSettings['train_test_plots']:
-                plot_helper.make_train_test_plots(
-                        split_result, path, is_classification, 
-                        label=y.name, model=model, train_X=train_X, test_X=test_X, groups=grouping_data)
-
+                # Plots are drawn here (or sent to the plot pool), as matplotlib can't run on the writer thread. Shared
+                # notebooks refer to the arrays the result store keeps instead of copying them
+                plot_run = split_result if result_format == 'csv' else \
+                    result_store.reference_split(split_result, path, y.name)
+                draw_plot(plot_helper.make_train_test_plots,
+                          plot_run, path, is_classification,
+                          label=y.name, model=split_model, train_X=train_X, test_X=test_X, groups=grouping_data)
+
+            # The error plots predict with the model, which the next split may refit, so they are made right away
             if PlotSettings['error_plots']:
-                plot_helper.make_error_plots(split_result, path, is_classification,
-                                             label=y.name, model=model, train_X=train_X, test_X=test_X, groups=grouping_data)
+                draw_plot(plot_helper.make_error_plots, split_result, path, is_classification,
+                          label=y.name, model=split_model, train_X=train_X, test_X=test_X, groups=grouping_data)
 
             # Write stats in each split path, not main path
             if is_validation:
-                _write_stats(split_result['train_metrics'],
+                writer.submit(_write_stats, split_result['train_metrics'],
                          split_result['test_metrics'],
                          path,
                          split_result['prediction_metrics'],
                          validation_column_names)
             else:
-                _write_stats(split_result['train_metrics'],
+                writer.submit(_write_stats, split_result['train_metrics'],
                              split_result['test_metrics'],
                              path)
+            writer.submit(html_helper.add_artifact, join(path, 'stats.txt'))
 
             return split_result
 
-        split_results = []
-        for split_num, (train_indices, test_indices) in enumerate(trains_tests):
-            split_results.append(one_fit(split_num, train_indices, test_indices))
+        # Splits are independent, so they can be fit concurrently. Results come back in split order.
+        split_results = parallel.parallel_map(lambda split: one_fit(*split),
+                                              [(split_num, train_indices, test_indices)
+                                               for split_num, (train_indices, test_indices) in enumerate(trains_tests)],
+                                              n_jobs=parallel.workers_for_budget(split_n_jobs,
+                                                                                 _estimate_task_megabytes(X),
+                                                                                 memory_budget),
+                                              backend=backend)
+        draw_pending_plots()
 
         log.info("    Calculating mean and stdev of scores...")
+        # The scores of every split, as (n_splits x n_metrics) arrays
+        def split_scores(metrics_list):
+            return np.array([[metrics[name] for name in metrics_dict] for metrics in metrics_list], dtype=float)
+        train_scores = split_scores(split_result['train_metrics'] for split_result in split_results)
+        test_scores = split_scores(split_result['test_metrics'] for split_result in split_results)
+
         def make_train_test_average_and_std_stats():
-            train_stats = OrderedDict([('Average Train', None)])
-            test_stats  = OrderedDict([('Average Test', None)])
+            def average_and_std(scores):
+                return OrderedDict(zip(metrics_dict, zip(scores.mean(axis=0), scores.std(axis=0))))
+            train_stats = average_and_std(train_scores)
+            test_stats = average_and_std(test_scores)
+            if grouping_data is not None:
+                groups = np.array(split_results[0]['test_groups'].tolist()+split_results[0]['train_groups'].tolist())
+                unique_groups = np.union1d(split_results[0]['test_groups'], split_results[0]['train_groups'])
+                for column, name in enumerate(metrics_dict):
+                    test_values = test_scores[:, column]
+                    test_stats_single = {name: test_stats[name]}
+                    draw_plot(plot_helper.plot_metric_vs_group, metric=name, groups=unique_groups, stats=test_values,
+                              avg_stats = test_stats_single, savepath=join(main_path, str(name)+'_vs_group.png'))
+                    draw_plot(plot_helper.plot_metric_vs_group_size, metric=name, groups=groups, stats=test_values,
+                              avg_stats = test_stats_single, savepath=join(main_path, str(name)+'_vs_group_size.png'))
             if is_validation:
-                prediction_stats = list()
                 num_predictions = len(split_results[0]['prediction_metrics'])
-                for i in range(num_predictions):
-                    prediction_stats.append(OrderedDict([('Average Prediction', None)]))
-            for name in metrics_dict:
-                train_values = [split_result['train_metrics'][name] for split_result in split_results]
-                test_values  = [split_result['test_metrics'][name]  for split_result in split_results]
-                train_stats[name] = (np.mean(train_values), np.std(train_values))
-                test_stats[name]  = (np.mean(test_values), np.std(test_values))
-                if is_validation:
-                    for i in range(num_predictions):
-                        prediction_values = [split_result['prediction_metrics'][i][name] for split_result in split_results]
-                        prediction_stats[i][name] = (np.mean(prediction_values), np.std(prediction_values))
-                test_stats_single = dict()
-                test_stats_single[name] = (np.mean(test_values), np.std(test_values))
-                if grouping_data is not None:
-                    groups = np.array(split_results[0]['test_groups'].tolist()+split_results[0]['train_groups'].tolist())
-                    unique_groups = np.union1d(split_results[0]['test_groups'], split_results[0]['train_groups'])
-                    plot_helper.plot_metric_vs_group(metric=name, groups=unique_groups, stats=test_values,
-                                                     avg_stats = test_stats_single, savepath=join(main_path, str(name)+'_vs_group.png'))
-                    plot_helper.plot_metric_vs_group_size(metric=name, groups=groups, stats=test_values,
-                                                     avg_stats = test_stats_single, savepath=join(main_path, str(name)+'_vs_group_size.png'))
-            del train_stats['Average Train']
-            del test_stats['Average Test']
-            if is_validation:
-                for i in range(num_predictions):
-                    del prediction_stats[i]['Average Prediction']
+                prediction_stats = [average_and_std(split_scores(split_result['prediction_metrics'][i]
+                                                                 for split_result in split_results))
+                                    for i in range(num_predictions)]
                 return train_stats, test_stats, prediction_stats
             else:
                 return train_stats, test_stats
@@ -856,18 +949,23 @@ def mastml_run(conf_path, data_path, outdir):
             # sort splits by the test score of first metric:
             greater_is_better, _ = next(iter(metrics_dict.values())) # get first value pair
             scalar = 1 if greater_is_better else -1
-            s = sorted(split_results, key=lambda run: scalar*next(iter(run['test_metrics'])))
-            return s[0], s[len(split_results)//2], s[-1]
+            order = np.argsort(scalar*test_scores[:, 0], kind='mergesort')
+            return (split_results[order[0]], split_results[order[len(split_results)//2]],
+                    split_results[order[-1]])
         worst, median, best = get_best_worst_median_runs()
 
         def make_pred_vs_true_plots(model):
             if PlotSettings['predicted_vs_true']:
-                plot_helper.plot_best_worst_split(y.values, best, worst,
+                best_run, worst_run = best, worst
+                if result_format != 'csv':
+                    best_run, worst_run = [result_store.reference_split(run, join(main_path, f"split_{run['split_num']}"),
+                                                                        y.name) for run in [best, worst]]
+                plot_helper.plot_best_worst_split(y.values, best_run, worst_run,
                                                   join(main_path, 'best_worst_split'), label=y.name)
-            predictions = [[] for _ in range(X.shape[0])]
+            # The out-of-fold predictions of every split, NaN where a point was not in the test set of a split
+            predictions = np.full((len(trains_tests), X.shape[0]), np.nan)
             for split_num, (train_indices, test_indices) in enumerate(trains_tests):
-                for i, pred in zip(test_indices, split_results[split_num]['y_test_pred']):
-                    predictions[i].append(pred)
+                predictions[split_num, test_indices] = np.ravel(split_results[split_num]['y_test_pred'])
             if PlotSettings['predicted_vs_true_bars']:
                 plot_helper.plot_predicted_vs_true_bars(
                         y.values, predictions, avg_test_stats,
@@ -885,18 +983,28 @@ def mastml_run(conf_path, data_path, outdir):
                                                   avg_stats=avg_test_stats)
 
         if not is_classification:
-            make_pred_vs_true_plots(model=model)
+            draw_plot(make_pred_vs_true_plots, model=model)
 
         return split_results
 
     runs = do_all_combos(X, y, df) # calls do_one_splitter internally
 
+    # The html pages link every written file, so wait for the writer to finish
+    log.info("Waiting for the remaining files to be written...")
+    writer.close()
+    render.finish_plot_pool()
+
     log.info("Making image html file...")
     html_helper.make_html(outdir)
+    html_helper.record_artifacts(None)
 
     log.info("Making html file of all runs stats...")
     _save_all_runs(runs, outdir)
 
+    if PlotSettings['defer_rendering']:
+        render.defer_plots(None)
+        log.info(f"Plots were recorded but not drawn. Draw them with: python -m mastml.render {outdir}")
+
 def _instantiate(kwargs_dict, name_to_constructor, category, X_grouped=None, X_indices=None):
     """
     Uses name_to_constructor to instantiate every item in kwargs_dict and return
@@ -1095,6 +1203,22 @@ def _extract_grouping_column_names(splitter_to_kwargs):
             splitter_to_group_names[splitter_name] = column_name
     return splitter_to_group_names
 
+def _save_stage(path, X, X_noinput, y, result_format):
+    """
+    Saves the data of a normalizer or selector stage, as csv or in the columnar result store, and returns the file path
+    """
+    if result_format == 'csv':
+        pd.concat([X, X_noinput, y], 1).to_csv(path + '.csv', index=False)
+        return path + '.csv'
+    else:
+        return result_store.write_stage(path, X, X_noinput, y, result_format)
+
+def _estimate_task_megabytes(X):
+    """
+    Rough peak memory of fitting one split of X, which holds the train/test copies and the saved csv frames
+    """
+    return 4 * X.memory_usage(deep=True).sum() / 1e6
+
 def _remove_constant_features(df):
     log.info("Removing constant features, regardless of feature selectors.")
     before = set(df.columns)
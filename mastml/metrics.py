@@ -8,7 +8,7 @@ The full list of score functions in scikit-learn can be found at: http://scikit-
 import numpy as np
 import sklearn.feature_selection as fs
 import sklearn.metrics as sm
-from sklearn.linear_model import LinearRegression # for r2_score_noint
+from collections import OrderedDict
 
 classification_metrics = {
     'accuracy':           (True, sm.accuracy_score),
@@ -51,10 +51,7 @@ def r2_score_noint(y_true, y_pred):
         (float): score of R^2 with no y-intercept
 
     """
-    lr = LinearRegression(fit_intercept=False)
-    y_true = np.array(y_true).reshape(-1,1) # turn it from an n-vector to nx1-matrix
-    lr.fit(y_true, y_pred)
-    return lr.score(y_true, y_pred)
+    return _RegressionStats(y_true, y_pred).r2_noint()
 regression_metrics['R2_noint'] = (True, r2_score_noint)
 
 def r2_score(y_true, y_pred):
@@ -69,10 +66,7 @@ def r2_score(y_true, y_pred):
         (float): score of R^2
 
     """
-    lr = LinearRegression(fit_intercept=True)
-    y_true = np.array(y_true).reshape(-1,1) # turn it from an n-vector to nx1-matrix
-    lr.fit(y_true, y_pred)
-    return lr.score(y_true, y_pred)
+    return _RegressionStats(y_true, y_pred).r2()
 regression_metrics['R2'] = (True, r2_score)
 
 def root_mean_squared_error(y_true, y_pred):
@@ -105,12 +99,7 @@ def rmse_over_stdev(y_true, y_pred, train_y=None):
         (float): score of RMSE divided by standard deviation of training data
 
     """
-    if train_y is not None:
-        stdev = np.std(train_y)
-    else:
-        stdev = np.std(y_true)
-    rmse = root_mean_squared_error(y_true, y_pred)
-    return rmse / stdev
+    return _RegressionStats(y_true, y_pred).rmse_over_stdev(train_y)
 regression_metrics['rmse_over_stdev'] = (False, rmse_over_stdev)
 
 def adjusted_r2_score(y_true, y_pred, n_features=None):
@@ -126,19 +115,189 @@ def adjusted_r2_score(y_true, y_pred, n_features=None):
         (float): score of adjusted R^2
 
     """
-    r2 = r2_score(y_true, y_pred)
-    # n is sample size
-    n = len(y_true)
-    # p is number of features
-    p = n_features
-    try:
-        r2_score_adj = 1 - (((1-r2)*(n-1))/(n-p-1))
-    except:
-        # No n_features given, just output NaN
-        r2_score_adj = 'NaN'
-    return r2_score_adj
+    return _RegressionStats(y_true, y_pred).adjusted_r2(n_features)
 regression_metrics['R2_adjusted'] = (True, adjusted_r2_score)
 
+class _RegressionStats(object):
+    """
+    Sums shared by the regression metrics, computed once for a pair of true and predicted values. R^2 (with and without
+    intercept) is the score of a least squares line of y_pred against y_true, which has a closed form in these sums.
+    """
+
+    def __init__(self, y_true, y_pred):
+        self.y_true = np.asarray(y_true, dtype=float).ravel()
+        self.y_pred = np.asarray(y_pred, dtype=float).ravel()
+        self.n = self.y_true.shape[0]
+        self.residuals = self.y_true - self.y_pred
+        self.sq_error_sum = np.dot(self.residuals, self.residuals)
+        self.true_centered = self.y_true - self.y_true.mean()
+        self.pred_centered = self.y_pred - self.y_pred.mean()
+        self.ss_true = np.dot(self.true_centered, self.true_centered)
+        self.ss_pred = np.dot(self.pred_centered, self.pred_centered)
+        self._abs_residuals = None
+
+    @property
+    def abs_residuals(self):
+        if self._abs_residuals is None:
+            self._abs_residuals = np.abs(self.residuals)
+        return self._abs_residuals
+
+    def mse(self):
+        return self.sq_error_sum / self.n
+
+    def rmse(self):
+        return self.mse()**0.5
+
+    def mae(self):
+        return self.abs_residuals.mean()
+
+    def median_ae(self):
+        return np.median(self.abs_residuals)
+
+    def explained_variance(self):
+        residual_variance = np.var(self.residuals)
+        true_variance = self.ss_true / self.n
+        if true_variance == 0:
+            return 1.0 if residual_variance == 0 else 0.0
+        return 1 - residual_variance / true_variance
+
+    def r2(self):
+        # R^2 of the line fit of y_pred against y_true, i.e. their squared correlation
+        if self.ss_pred == 0:
+            return 1.0
+        if self.ss_true == 0:
+            return 0.0
+        return np.dot(self.true_centered, self.pred_centered)**2 / (self.ss_true * self.ss_pred)
+
+    def r2_noint(self):
+        # R^2 of the fit of y_pred = slope*y_true, scored against the mean of y_pred like LinearRegression.score
+        true_sq_sum = np.dot(self.y_true, self.y_true)
+        slope = np.dot(self.y_true, self.y_pred) / true_sq_sum if true_sq_sum != 0 else 0.0
+        fit_residuals = self.y_pred - slope*self.y_true
+        ss_residual = np.dot(fit_residuals, fit_residuals)
+        if self.ss_pred == 0:
+            return 1.0 if ss_residual == 0 else 0.0
+        return 1 - ss_residual / self.ss_pred
+
+    def rmse_over_stdev(self, train_y=None):
+        stdev = np.std(train_y) if train_y is not None else (self.ss_true / self.n)**0.5
+        return self.rmse() / stdev
+
+    def adjusted_r2(self, n_features=None):
+        r2 = self.r2()
+        try:
+            return 1 - (((1-r2)*(self.n-1))/(self.n-n_features-1))
+        except:
+            # No n_features given, just output NaN
+            return 'NaN'
+
+class _ClassificationStats(object):
+    """
+    Confusion matrix of a pair of true and predicted labels, which the accuracy, precision, recall and f1 metrics are
+    all computed from
+    """
+
+    def __init__(self, y_true, y_pred):
+        y_true = np.asarray(y_true).ravel()
+        y_pred = np.asarray(y_pred).ravel()
+        self.labels, label_indices = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+        n_labels = len(self.labels)
+        true_indices, pred_indices = label_indices[:len(y_true)], label_indices[len(y_true):]
+        self.confusion = np.bincount(true_indices*n_labels + pred_indices,
+                                     minlength=n_labels*n_labels).reshape(n_labels, n_labels)
+        self.true_positives = np.diag(self.confusion)
+        self.true_counts = self.confusion.sum(axis=1)
+        self.pred_counts = self.confusion.sum(axis=0)
+
+    def is_binary(self):
+        # Binary averages are only done here for 0/1 labels, other labels are left to scikit-learn
+        return set(self.labels.tolist()) <= {0, 1}
+
+    def accuracy(self):
+        return self.true_positives.sum() / self.confusion.sum()
+
+    def precision_recall_f1(self, average):
+        # Scores of 0/0 are 0, as in scikit-learn
+        precision = _safe_divide(self.true_positives, self.pred_counts)
+        recall = _safe_divide(self.true_positives, self.true_counts)
+        f1 = _safe_divide(2*self.true_positives, self.true_counts + self.pred_counts)
+        if average == 'micro':
+            accuracy = self.accuracy()
+            return accuracy, accuracy, accuracy
+        if average == 'binary':
+            positive = np.flatnonzero(self.labels == 1)
+            if len(positive) == 0:
+                return 0.0, 0.0, 0.0
+            return precision[positive[0]], recall[positive[0]], f1[positive[0]]
+        if average == 'macro':
+            return precision.mean(), recall.mean(), f1.mean()
+        # weighted by the number of true instances of each label
+        if self.true_counts.sum() == 0:
+            return 0.0, 0.0, 0.0
+        weights = self.true_counts / self.true_counts.sum()
+        return np.dot(precision, weights), np.dot(recall, weights), np.dot(f1, weights)
+
+def _safe_divide(numerator, denominator):
+    result = np.zeros(len(numerator))
+    nonzero = denominator != 0
+    result[nonzero] = numerator[nonzero] / denominator[nonzero]
+    return result
+
+# Metrics that compute_metrics derives from the shared statistics, by name. Any other metric calls its own function.
+_regression_from_stats = {
+    'mean_absolute_error': lambda stats, train_y, n_features: stats.mae(),
+    'mean_squared_error': lambda stats, train_y, n_features: stats.mse(),
+    'median_absolute_error': lambda stats, train_y, n_features: stats.median_ae(),
+    'explained_variance': lambda stats, train_y, n_features: stats.explained_variance(),
+    'root_mean_squared_error': lambda stats, train_y, n_features: stats.rmse(),
+    'R2': lambda stats, train_y, n_features: stats.r2(),
+    'R2_noint': lambda stats, train_y, n_features: stats.r2_noint(),
+    'rmse_over_stdev': lambda stats, train_y, n_features: stats.rmse_over_stdev(train_y),
+    'R2_adjusted': lambda stats, train_y, n_features: stats.adjusted_r2(n_features),
+}
+
+_classification_averages = ['binary', 'macro', 'micro', 'weighted']
+_classification_scores = {'precision': 0, 'recall': 1, 'f1': 2}
+
+def compute_metrics(metrics_dict, y_true, y_pred, train_y=None, n_features=None):
+    """
+    Method that calculates every metric of metrics_dict for one set of predictions. The regression metrics are derived
+    from residual sums computed once, and the accuracy, precision, recall and f1 metrics from a single confusion matrix,
+    instead of each metric validating the data and going over it again.
+
+    Args:
+        metrics_dict: (dict), dict of metric names to (greater_is_better, function) pairs, from check_and_fetch_names
+        y_true: (numpy array), array of true y data values
+        y_pred: (numpy array), array of predicted y data values
+        train_y: (numpy array), array of training y data values, used by rmse_over_stdev
+        n_features: (int), number of features used in the fit, used by R2_adjusted
+
+    Returns:
+        (OrderedDict): the score of each metric, in the order of metrics_dict
+
+    """
+    scores = OrderedDict()
+    regression_stats = None
+    classification_stats = None
+    for name, (_, function) in metrics_dict.items():
+        if name in _regression_from_stats:
+            if regression_stats is None:
+                regression_stats = _RegressionStats(y_true, y_pred)
+            scores[name] = _regression_from_stats[name](regression_stats, train_y, n_features)
+            continue
+        score, _, average = name.partition('_')
+        if name == 'accuracy' or (score in _classification_scores and average in _classification_averages):
+            if classification_stats is None:
+                classification_stats = _ClassificationStats(y_true, y_pred)
+            if name == 'accuracy':
+                scores[name] = classification_stats.accuracy()
+                continue
+            if average != 'binary' or classification_stats.is_binary():
+                scores[name] = classification_stats.precision_recall_f1(average)[_classification_scores[score]]
+                continue
+        scores[name] = function(y_true, y_pred)
+    return scores
+
 classification_score_funcs = {
     'chi2': fs.chi2, # Compute chi-squared stats between each non-negative feature and class.
     'f_classif': fs.f_classif, # Compute the ANOVA F-value for the provided sample.
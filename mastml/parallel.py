@@ -0,0 +1,158 @@
+"""
+The parallel module contains helpers for sending independent units of MAST-ML work (e.g. the splits of a data splitter)
+to a pool of workers, while returning results in the same order as a serial run would
+"""
+
+import os
+import logging
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from mastml import utils
+
+log = logging.getLogger('mastml')
+
+# Valid choices for the [GeneralSetup] backend parameter
+BACKENDS = ['serial', 'threads', 'processes']
+
+# Valid choices for the [GeneralSetup] parallel_over parameter, i.e. which level of the run the workers are spread over
+PARALLEL_LEVELS = ['splits', 'combos']
+
+# Functions registered for the duration of a process pool. Forked workers inherit this dict, so closures (which cannot
+# be pickled) can still be run in a child process by only sending the key and the item to the worker.
+_registered_functions = dict()
+
+def check_backend(n_jobs, backend, section='GeneralSetup'):
+    """
+    Method to check and cast the n_jobs and backend parameters parsed from the input configuration file
+
+    Args:
+
+        n_jobs: (int or str), number of workers to use. -1 means use all available cores
+
+        backend: (str), one of 'serial', 'threads' or 'processes'
+
+        section: (str), section of the input file the parameters come from, used in error messages
+
+    Returns:
+
+        n_jobs: (int), number of workers to use, resolved to a positive integer
+
+        backend: (str), the validated backend name
+
+    """
+    try:
+        n_jobs = int(n_jobs)
+    except ValueError:
+        raise utils.InvalidConfParameters(f"[{section}] n_jobs must be an integer, not '{n_jobs}'")
+    if n_jobs == 0 or n_jobs < -1:
+        raise utils.InvalidConfParameters(f"[{section}] n_jobs must be a positive integer or -1, not {n_jobs}")
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if backend not in BACKENDS:
+        raise utils.InvalidConfParameters(f"[{section}] backend '{backend}' is unknown. "
+                                          f"Valid backends: {BACKENDS}")
+    return n_jobs, backend
+
+def check_parallel_level(parallel_over, memory_budget):
+    """
+    Method to check and cast the parallel_over and memory_budget parameters parsed from the input configuration file
+
+    Args:
+
+        parallel_over: (str), one of 'splits' (the splits of each splitter run concurrently) or 'combos' (every
+        normalizer/selector/model/splitter combination runs concurrently)
+
+        memory_budget: (float, str or None), total memory in MB the workers may use, or None for no limit
+
+    Returns:
+
+        parallel_over: (str), the validated parallel level
+
+        memory_budget: (float or None), the memory budget in MB
+
+    """
+    if parallel_over not in PARALLEL_LEVELS:
+        raise utils.InvalidConfParameters(f"[GeneralSetup] parallel_over '{parallel_over}' is unknown. "
+                                          f"Valid choices: {PARALLEL_LEVELS}")
+    if memory_budget is not None:
+        try:
+            memory_budget = float(memory_budget)
+        except ValueError:
+            raise utils.InvalidConfParameters(f"[GeneralSetup] memory_budget must be a number of MB, "
+                                              f"not '{memory_budget}'")
+        if memory_budget <= 0:
+            raise utils.InvalidConfParameters(f"[GeneralSetup] memory_budget must be positive, not {memory_budget}")
+    return parallel_over, memory_budget
+
+def workers_for_budget(n_jobs, task_megabytes, memory_budget):
+    """
+    Method to cap the number of workers so that the estimated memory of all running tasks fits in the memory budget
+
+    Args:
+
+        n_jobs: (int), maximum number of workers
+
+        task_megabytes: (float), estimated peak memory of a single task in MB
+
+        memory_budget: (float or None), total memory in MB the workers may use, or None for no limit
+
+    Returns:
+
+        (int), number of workers to use, at least 1
+
+    """
+    if memory_budget is None or task_megabytes <= 0:
+        return n_jobs
+    n_workers = max(1, min(n_jobs, int(memory_budget // task_megabytes)))
+    if n_workers < n_jobs:
+        log.info(f"Limiting to {n_workers} workers to stay within the memory budget of {memory_budget} MB")
+    return n_workers
+
+def _call_registered(key, item):
+    return _registered_functions[key](item)
+
+def parallel_map(function, items, n_jobs=1, backend='serial'):
+    """
+    Method to apply function to every item, possibly concurrently, returning the results in the order of items
+
+    Args:
+
+        function: (callable), function taking a single item. May be a closure, even for the 'processes' backend
+
+        items: (iterable), the items to apply function to. Must be picklable for the 'processes' backend
+
+        n_jobs: (int), maximum number of workers to use
+
+        backend: (str), one of 'serial', 'threads' or 'processes'
+
+    Returns:
+
+        (list), list of function(item) for each item, in the same order as items
+
+    """
+    items = list(items)
+    n_jobs = min(n_jobs, len(items))
+    if backend == 'serial' or n_jobs <= 1:
+        return [function(item) for item in items]
+
+    if backend == 'threads':
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            return list(pool.map(function, items))
+
+    # Pool workers are daemonic and can't start pools of their own, so nested calls just run serially
+    if multiprocessing.current_process().daemon:
+        return [function(item) for item in items]
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        log.warning("The 'processes' backend needs the fork start method, which this platform does not have. "
+                    "Running with the 'threads' backend instead.")
+        return parallel_map(function, items, n_jobs=n_jobs, backend='threads')
+
+    key = id(function)
+    _registered_functions[key] = function
+    try:
+        with multiprocessing.get_context('fork').Pool(processes=n_jobs) as pool:
+            return pool.map(partial(_call_registered, key), items, chunksize=1)
+    finally:
+        del _registered_functions[key]
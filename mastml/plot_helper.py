@@ -39,7 +39,7 @@ from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes
 
 # Needed imports for ipynb_maker
 from mastml.utils import nice_range
-from mastml.metrics import nice_names
+from mastml.metrics import nice_names, compute_metrics
 
 import inspect
 import textwrap
@@ -47,7 +47,8 @@ from pandas import DataFrame, Series
 
 import nbformat
 
-from functools import wraps
+from functools import wraps, lru_cache
+import pickle
 
 matplotlib.rc('font', size=18, family='sans-serif') # set all font to bigger
 matplotlib.rc('figure', autolayout=True) # turn on autolayout
@@ -55,12 +56,115 @@ matplotlib.rc('figure', autolayout=True) # turn on autolayout
 # adding dpi as a constant global so it can be changed later
 DPI = 250
 
+# Models that prediction_intervals can make error bars for, see plot_normalized_error
+FOREST_MODELS = ['RandomForestRegressor', 'ExtraTreesRegressor']
+MODELS_WITH_ERROR_PREDICTIONS = FOREST_MODELS + ['GradientBoostingRegressor', 'GaussianProcessRegressor']
+
+# Largest number of tree predictions held at once, the rows are predicted in chunks that stay below it
+MAX_TREE_PREDICTIONS = 2**24
+
 log = logging.getLogger() # only used inside ipynb_maker I guess
 
 # HEADERENDER don't delete this line, it's used by ipynb maker
 
 log = logging.getLogger('mastml') # the real logger
 
+from mastml.render import deferrable, reported, NOTEBOOK_MODES
+from mastml import utils, result_store
+
+# How ipynb_maker writes notebooks, and the directory of the shared module of the run. See set_notebook_mode
+_notebook_mode = 'inline'
+_notebook_module_dir = None
+
+# Name of the module that holds the plotting code of a run when notebooks are 'shared'
+NOTEBOOK_MODULE = 'mastml_plots'
+
+def set_notebook_mode(mode, outdir=None):
+    """
+    Method to choose how ipynb_maker writes the notebook of each plot
+
+    Args:
+
+        mode: (str), 'inline' writes the plotting code and the data of the plot into every notebook, 'shared' writes the
+        plotting code once per run (to mastml_plots.py in outdir) and the arguments of each plot to a pickle file next
+        to its notebook, and 'off' writes no notebooks. In 'shared' mode, the arrays of a split that the result store
+        keeps (see result_store.reference_split) are pickled as references to the result files, not copied
+
+        outdir: (str), output directory of the run, needed for 'shared'
+
+    Returns:
+
+        None
+
+    """
+    if mode not in NOTEBOOK_MODES:
+        raise utils.InvalidConfParameters(f"[PlotSettings] notebooks '{mode}' is unknown. Valid choices: {NOTEBOOK_MODES}")
+    set_notebook_state(mode, outdir)
+    if mode == 'shared':
+        with open(join(outdir, NOTEBOOK_MODULE + '.py'), 'w') as f:
+            f.write(_notebook_module_source())
+
+def get_notebook_state():
+    """
+    Method to get the notebook settings of this process, so they can be given to the processes that draw plots
+
+    Args:
+
+        None
+
+    Returns:
+
+        (tuple), the notebook mode and the directory of the shared module
+
+    """
+    return _notebook_mode, _notebook_module_dir
+
+def set_notebook_state(mode, module_dir):
+    """
+    Method to restore the notebook settings returned by get_notebook_state, without writing the shared module again
+
+    Args:
+
+        mode: (str), the notebook mode
+
+        module_dir: (str), the directory of the shared module
+
+    Returns:
+
+        None
+
+    """
+    global _notebook_mode, _notebook_module_dir
+    _notebook_mode, _notebook_module_dir = mode, module_dir
+
+@lru_cache(maxsize=None)
+def _notebook_header():
+    # source of the top of plot_helper.py
+    header = ""
+    with open(__file__) as f:
+        for line in f.readlines():
+            if 'HEADERENDER' in line:
+                break
+            header += line
+    return header
+
+@lru_cache(maxsize=None)
+def _notebook_source(func):
+    func_string = inspect.getsource(inspect.unwrap(func))
+    # remove the first lines that have the decorators on them (!!!)
+    func_lines = func_string.split('\n')
+    while func_lines[0].startswith('@'):
+        func_lines = func_lines[1:]
+    return '\n'.join(func_lines)
+
+def _notebook_module_source():
+    # Every function of this module that a plot may call, except the notebook machinery itself
+    excluded = ['ipynb_maker', 'set_notebook_mode', 'get_notebook_state', 'set_notebook_state', 'load_plot_args']
+    functions = [func for name, func in globals().items()
+                 if inspect.isfunction(func) and inspect.unwrap(func).__module__ == __name__
+                 and name not in excluded and not name.startswith('_notebook')]
+    return _notebook_header() + '\n\n' + '\n\n'.join(_notebook_source(func) for func in functions)
+
 def ipynb_maker(plot_func):
     """
     This method creates Jupyter Notebooks so user can modify and regenerate the plots produced by MAST-ML.
@@ -81,12 +185,17 @@ def ipynb_maker(plot_func):
 
     @wraps(plot_func)
     def wrapper(*args, **kwargs):
+        # Arrays that know where the result store keeps them are only needed for the references of shared notebooks
+        plain_args, plain_kwargs = result_store.plain_arrays(args), result_store.plain_arrays(kwargs)
+        if _notebook_mode == 'off':
+            return plot_func(*plain_args, **plain_kwargs)
+
         # convert everything to kwargs for easier display
         # from geniuses at https://stackoverflow.com/a/831164
         #kwargs.update(dict(zip(plot_func.func_code.co_varnames, args)))
         sig = inspect.signature(plot_func)
-        binding = sig.bind(*args, **kwargs)
-        all_args = binding.arguments
+        stored_args = sig.bind(*args, **kwargs).arguments
+        all_args = sig.bind(*plain_args, **plain_kwargs).arguments
 
         # if this is an outdir style function, fill in savepath and delete outdir
         if 'savepath' in all_args:
@@ -108,20 +217,45 @@ def ipynb_maker(plot_func):
             pyplot to create the `fig` and `ax` instances.
         """)
 
-        # get source of the top of plot_helper.py
-        header = ""
-        with open(plot_helper.__file__) as f:
-            for line in f.readlines():
-                if 'HEADERENDER' in line:
-                    break
-                header += line
+        if _notebook_mode == 'shared':
+            # The code comes from the shared module of the run, and the data from a pickle next to the notebook, which
+            # only refers to the arrays the result store keeps
+            args_filename = os.path.basename(ipynb_savepath) + '.args.pkl'
+            notebook_dir = os.path.dirname(os.path.abspath(ipynb_savepath))
+            with open(ipynb_savepath + '.args.pkl', 'wb') as f:
+                pickle.dump(result_store.to_references(dict(stored_args), notebook_dir), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            module_dir = os.path.relpath(_notebook_module_dir, notebook_dir)
+            imports = textwrap.dedent(f"""\
+                import sys
+                sys.path.insert(0, {repr(module_dir)})
+                from {NOTEBOOK_MODULE} import *
+                from mastml.plot_helper import load_plot_args
+            """)
+            args_block = f"args = load_plot_args({repr(args_filename)})\n"
+            main = textwrap.dedent(f"""\
+                from IPython.display import Image, display
+
+                plot_output = {plot_func.__name__}(**args)
+            """)
+            if knows_savepath:
+                main += f"display(Image(filename={repr(basename)}))\n"
+            else:
+                main += "for plot_path in plot_output:\n    display(Image(filename=plot_path))\n"
+            readme += f"\nThe plotting code is in `{NOTEBOOK_MODULE}.py` in the output directory of the run.\n"
+
+            nb = nbformat.v4.new_notebook()
+            nb['cells'] = [nbformat.v4.new_markdown_cell(readme)] + \
+                          [nbformat.v4.new_code_cell(cell_text) for cell_text in [imports, args_block, main]]
+            nbformat.write(nb, ipynb_savepath + '.ipynb')
+            return plot_func(*plain_args, **plain_kwargs)
+
+        header = _notebook_header()
 
         core_funcs = [plot_helper.stat_to_string, plot_helper.plot_stats, plot_helper.make_fig_ax]
-        func_strings = '\n\n'.join(inspect.getsource(func) for func in core_funcs)
+        func_strings = '\n\n'.join(_notebook_source(func) for func in core_funcs)
 
-        plot_func_string = inspect.getsource(plot_func)
-        # remove first line that has this decorator on it (!!!)
-        plot_func_string = '\n'.join(plot_func_string.split('\n')[1:])
+        plot_func_string = _notebook_source(plot_func)
 
         # put the arguments and their values in the code
         arg_assignments = []
@@ -166,9 +300,42 @@ def ipynb_maker(plot_func):
         nb['cells'] = cells
         nbformat.write(nb, ipynb_savepath + '.ipynb')
 
-        return plot_func(*args, **kwargs)
+        return plot_func(*plain_args, **plain_kwargs)
     return wrapper
 
+def load_plot_args(args_path):
+    """
+    Method to load the arguments of a plot saved next to its notebook in the 'shared' notebook mode, reading the arrays
+    that were saved as references from the result files of the run
+
+    Args:
+
+        args_path: (str), path of the .args.pkl file
+
+    Returns:
+
+        (dict), the arguments of the plot function
+
+    """
+    with open(args_path, 'rb') as f:
+        args = pickle.load(f)
+    # Several arguments usually refer to the same split, which is only read once
+    views = dict()
+    def resolve(value):
+        if type(value) is dict and result_store.REFERENCE_KEY in value:
+            split_path = os.path.join(os.path.dirname(args_path), value[result_store.REFERENCE_KEY])
+            key = (os.path.normpath(split_path), value['kind'])
+            if key not in views:
+                views[key] = result_store.read_split(split_path, value['kind'])
+            view = views[key]
+            return view.index.values if value['column'] is None else view[value['column']].values
+        if type(value) in (tuple, list):
+            return type(value)(resolve(item) for item in value)
+        if type(value) in (dict, OrderedDict):
+            return type(value)((name, resolve(item)) for name, item in value.items())
+        return value
+    return {name: resolve(value) for name, value in args.items()}
+
 def make_train_test_plots(run, path, is_classification, label, model, train_X, test_X, groups=None):
     """
     General plotting method used to execute sequence of specific plots of train-test data analysis
@@ -262,6 +429,7 @@ def make_error_plots(run, path, is_classification, label, model, train_X, test_X
         plot_cumulative_normalized_error(y_test_true, y_test_pred, join(path, title+'.png'), model, test_X)
 
 
+@deferrable
 @ipynb_maker
 def plot_confusion_matrix(y_true, y_pred, savepath, stats, normalize=False, title='Confusion matrix', cmap=plt.cm.Blues):
     """
@@ -327,6 +495,7 @@ def plot_confusion_matrix(y_true, y_pred, savepath, stats, normalize=False, titl
     ax.set_xlabel('Predicted label')
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
 
+@deferrable
 @ipynb_maker
 def plot_roc_curve(y_true, y_pred, savepath):
     """
@@ -376,6 +545,7 @@ def plot_roc_curve(y_true, y_pred, savepath):
     #plot_stats(fig, stats, x_align=0.60, y_align=0.90)
     fig.savefig(savepath, dpi=DPI, bbox_to_inches='tight')
 
+@deferrable
 @ipynb_maker
 def plot_precision_recall_curve(y_true, y_pred, savepath):
     """
@@ -422,6 +592,7 @@ def plot_precision_recall_curve(y_true, y_pred, savepath):
     fig.savefig(savepath, dpi=DPI, bbox_to_inches='tight')
     return
 
+@deferrable
 @ipynb_maker
 def plot_residuals_histogram(y_true, y_pred, savepath,
                              stats, title='residuals histogram', label='residuals'):
@@ -477,6 +648,7 @@ def plot_residuals_histogram(y_true, y_pred, savepath,
 
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
 
+@deferrable
 @ipynb_maker
 def plot_target_histogram(y_df, savepath, title='target histogram', label='target values'):
     """
@@ -525,6 +697,7 @@ def plot_target_histogram(y_df, savepath, title='target histogram', label='targe
 
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
 
+@deferrable
 @ipynb_maker
 def plot_predicted_vs_true(train_quad, test_quad, outdir, label):
     """
@@ -613,6 +786,7 @@ def plot_predicted_vs_true(train_quad, test_quad, outdir, label):
 
     return filenames
 
+@deferrable
 def plot_scatter(x, y, savepath, groups=None, xlabel='x', label='target data'):
     """
     Method to create a general scatter plot
@@ -675,6 +849,7 @@ def plot_scatter(x, y, savepath, groups=None, xlabel='x', label='target data'):
     ax.set_xticklabels(rotation=45)
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
 
+@deferrable
 @ipynb_maker
 def plot_best_worst_split(y_true, best_run, worst_run, savepath,
                           title='Best Worst Overlay', label='target_value'):
@@ -743,6 +918,7 @@ def plot_best_worst_split(y_true, best_run, worst_run, savepath,
     df_best.to_csv(savepath + '_best.csv')
     df_worst.to_csv(savepath + '_worst.csv')
 
+@deferrable
 @ipynb_maker
 def plot_best_worst_per_point(y_true, y_pred_list, savepath, metrics_dict,
                               avg_stats, title='best worst per point', label='target_value'):
@@ -755,7 +931,8 @@ def plot_best_worst_per_point(y_true, y_pred_list, savepath, metrics_dict,
 
         y_true: (numpy array), array of true y data
 
-        y_pred_list: (list), list of numpy arrays containing predicted y data for each CV split
+        y_pred_list: (list or numpy array), list with the predicted y values of each point over the CV splits, or a
+        (n_splits x n_points) array of predictions with NaN where a split did not predict a point
 
         savepath: (str), path to save plots to
 
@@ -773,21 +950,20 @@ def plot_best_worst_per_point(y_true, y_pred_list, savepath, metrics_dict,
 
     """
 
-    worsts = []
-    bests = []
-    new_y_true = []
-    for yt, y_pred in zip(y_true, y_pred_list):
-        if len(y_pred) == 0 or np.nan in y_pred_list or yt == np.nan:
-            continue
-        worsts.append(max(y_pred, key=lambda yp: abs(yp-yt)))
-        bests.append( min(y_pred, key=lambda yp: abs(yp-yt)))
-        new_y_true.append(yt)
+    y_true = np.asarray(y_true)
+    y_pred_matrix = prediction_matrix(y_pred_list)
+    # the best and worst prediction of each point that was predicted at least once
+    has_preds = ~np.all(np.isnan(y_pred_matrix), axis=0)
+    abs_errors = np.abs(y_pred_matrix[:, has_preds] - y_true[has_preds])
+    point_indices = np.arange(abs_errors.shape[1])
+    worsts = y_pred_matrix[:, has_preds][np.nanargmax(abs_errors, axis=0), point_indices]
+    bests = y_pred_matrix[:, has_preds][np.nanargmin(abs_errors, axis=0), point_indices]
+    new_y_true = y_true[has_preds]
 
     worst_stats = OrderedDict([('Worst combined:', None)])
     best_stats = OrderedDict([('Best combined:', None)])
-    for name, (_, func) in metrics_dict.items():
-        worst_stats[name] = func(new_y_true, worsts)
-        best_stats[name] = func(new_y_true, bests)
+    worst_stats.update(compute_metrics(metrics_dict, new_y_true, worsts))
+    best_stats.update(compute_metrics(metrics_dict, new_y_true, bests))
 
     # make fig and ax, use x_align when placing text so things don't overlap
     x_align = 15.5/24 #mmm yum
@@ -830,6 +1006,7 @@ def plot_best_worst_per_point(y_true, y_pred_list, savepath, metrics_dict,
                        'worst per point': worsts})
     df.to_csv(savepath + '.csv')
 
+@deferrable
 @ipynb_maker
 def plot_predicted_vs_true_bars(y_true, y_pred_list, avg_stats,
                                 savepath, title='best worst with bars', label='target_value'):
@@ -842,7 +1019,8 @@ def plot_predicted_vs_true_bars(y_true, y_pred_list, avg_stats,
 
         y_true: (numpy array), array of true y data
 
-        y_pred_list: (list), list of numpy arrays containing predicted y data for each CV split
+        y_pred_list: (list or numpy array), list with the predicted y values of each point over the CV splits, or a
+        (n_splits x n_points) array of predictions with NaN where a split did not predict a point
 
         avg_stats: (dict), dict of calculated average metrics over all CV splits
 
@@ -857,10 +1035,9 @@ def plot_predicted_vs_true_bars(y_true, y_pred_list, avg_stats,
         None
 
     """
-    means = [nice_mean(y_pred) for y_pred in y_pred_list]
-    standard_error_means = [nice_std(y_pred)/np.sqrt(len(y_pred))
-                            for y_pred in y_pred_list]
-    standard_errors = [nice_std(y_pred) for y_pred in y_pred_list]
+    y_pred_matrix = prediction_matrix(y_pred_list)
+    means = nan_mean(y_pred_matrix)
+    standard_errors = nan_std(y_pred_matrix)
     # make fig and ax, use x_align when placing text so things don't overlap
     x_align = 0.64
     fig, ax = make_fig_ax(x_align=x_align)
@@ -897,6 +1074,7 @@ def plot_predicted_vs_true_bars(y_true, y_pred_list, avg_stats,
                        'error bar values': standard_errors})
     df.to_csv(savepath + '.csv')
 
+@deferrable
 def plot_metric_vs_group(metric, groups, stats, avg_stats, savepath):
     """
     Method to plot the value of a particular calculated metric (e.g. RMSE, R^2, etc) for each data group
@@ -939,6 +1117,7 @@ def plot_metric_vs_group(metric, groups, stats, avg_stats, savepath):
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
     return
 
+@deferrable
 def plot_metric_vs_group_size(metric, groups, stats, avg_stats, savepath):
     """
     Method to plot the value of a particular calculated metric (e.g. RMSE, R^2, etc) as a function of the size of each group.
@@ -991,9 +1170,13 @@ def plot_metric_vs_group_size(metric, groups, stats, avg_stats, savepath):
 
 def prediction_intervals(model, X, percentile=68):
     """
-    Method to calculate prediction intervals when using Random Forest and Gaussian Process regression models.
+    Method to calculate prediction intervals when using Random Forest, Extra Trees, Gradient Boosting and Gaussian
+    Process regression models.
 
     Prediction intervals for random forest adapted from https://blog.datadive.net/prediction-intervals-for-random-forests/
+    Every tree predicts all the rows at once, giving an (n_trees x n_rows) array whose percentiles are taken along the
+    tree axis. For gradient boosting, the staged predictions of the second half of the stages take the place of the
+    trees.
 
     Args:
 
@@ -1005,38 +1188,43 @@ def prediction_intervals(model, X, percentile=68):
 
     Returns:
 
-        err_up: (list), list of upper bounds of error bars for each data point
+        err_up: (numpy array), upper bounds of error bars for each data point
 
-        err_down: (list), list of lower bounds of error bars for each data point
+        err_down: (numpy array), lower bounds of error bars for each data point
 
     """
 
-    err_down = list()
-    err_up = list()
-    X_aslist = X.values.tolist()
-    if model.__class__.__name__=='RandomForestRegressor':
-        for x in range(len(X_aslist)):
-            preds = list()
-            for pred in model.estimators_:
-                preds.append(pred.predict(np.array(X_aslist[x]).reshape(1,-1))[0])
-
-            e_down = np.percentile(preds, (100 - percentile) / 2.)
-            e_up = np.percentile(preds, 100 - (100 - percentile) / 2.)
-
-            if e_up == 0.0:
-                e_up = 10 ** 10
-            if e_down == 0.0:
-                e_down = 10 ** 10
-            err_down.append(e_down)
-            err_up.append(e_up)
-
-    elif model.__class__.__name__=='GaussianProcessRegressor':
+    model_name = model.__class__.__name__
+    if model_name == 'GaussianProcessRegressor':
         preds = model.predict(X, return_std=True)[1] # Get the stdev model error from the predictions of GPR
-        err_up = preds
-        err_down = preds
+        return preds, preds
+    if model_name not in MODELS_WITH_ERROR_PREDICTIONS:
+        return list(), list()
+
+    X = np.asarray(X)
+    if model_name in FOREST_MODELS:
+        n_predictors = len(model.estimators_)
+    else:
+        first_stage = model.n_estimators_ // 2
+        n_predictors = model.n_estimators_ - first_stage
+    chunk_rows = max(1, MAX_TREE_PREDICTIONS // n_predictors)
+
+    err_down = np.empty(X.shape[0])
+    err_up = np.empty(X.shape[0])
+    for start in range(0, X.shape[0], chunk_rows):
+        X_chunk = X[start:start+chunk_rows]
+        if model_name in FOREST_MODELS:
+            preds = np.stack([tree.predict(X_chunk) for tree in model.estimators_])
+        else:
+            preds = np.stack(list(itertools.islice(model.staged_predict(X_chunk), first_stage, None)))
+        err_down[start:start+chunk_rows], err_up[start:start+chunk_rows] = \
+            np.percentile(preds, [(100 - percentile) / 2., 100 - (100 - percentile) / 2.], axis=0)
 
+    err_up[err_up == 0.0] = 10 ** 10
+    err_down[err_down == 0.0] = 10 ** 10
     return err_down, err_up
 
+@reported
 def plot_normalized_error(y_true, y_pred, savepath, model, X=None, avg_stats=None):
     """
     Method to plot the normalized residual errors of a model prediction
@@ -1064,16 +1252,14 @@ def plot_normalized_error(y_true, y_pred, savepath, model, X=None, avg_stats=Non
     path = os.path.dirname(savepath)
     # Here: if model is random forest or Gaussian process, get real error bars. Else, just residuals
     model_name = model.__class__.__name__
-    # TODO: also add support for Gradient Boosted Regressor
-    models_with_error_predictions = ['RandomForestRegressor', 'GaussianProcessRegressor']
     has_model_errors = False
-    if model_name in models_with_error_predictions:
+    if model_name in MODELS_WITH_ERROR_PREDICTIONS:
         has_model_errors = True
         if not avg_stats:
             err_down, err_up = prediction_intervals(model, X, percentile=68)
 
     if avg_stats:
-        y_pred_ = np.array([nice_mean(y_p) for y_p in y_pred])
+        y_pred_ = nan_mean(prediction_matrix(y_pred))
         y_true_ = y_true
     else:
         y_pred_ = y_pred
@@ -1192,6 +1378,7 @@ def plot_normalized_error(y_true, y_pred, savepath, model, X=None, avg_stats=Non
     fig.savefig(savepath, dpi=DPI, bbox_inches='tight')
     return
 
+@reported
 def plot_cumulative_normalized_error(y_true, y_pred, savepath, model, X=None, avg_stats=None):
     """
     Method to plot the cumulative normalized residual errors of a model prediction
@@ -1219,16 +1406,14 @@ def plot_cumulative_normalized_error(y_true, y_pred, savepath, model, X=None, av
     path = os.path.dirname(savepath)
     # Here: if model is random forest or Gaussian process, get real error bars. Else, just residuals
     model_name = model.__class__.__name__
-    # TODO: also add support for Gradient Boosted Regressor
-    models_with_error_predictions = ['RandomForestRegressor', 'GaussianProcessRegressor']
     has_model_errors = False
-    if model_name in models_with_error_predictions:
+    if model_name in MODELS_WITH_ERROR_PREDICTIONS:
         has_model_errors = True
         if not avg_stats:
             err_down, err_up = prediction_intervals(model, X, percentile=68)
 
     if avg_stats:
-        y_pred_ = np.array([nice_mean(y_p) for y_p in y_pred])
+        y_pred_ = nan_mean(prediction_matrix(y_pred))
         y_true_ = y_true
     else:
         y_pred_ = y_pred
@@ -1923,6 +2108,66 @@ def nice_std(ls):
         return np.std(ls)
     return np.nan
 
+def prediction_matrix(y_pred_list):
+    """
+    Method to return the predictions of each point over all CV splits as a dense (n_splits x n_points) array, with NaN
+    where a split did not predict a point
+
+    Args:
+
+        y_pred_list: (numpy array or list), a (n_splits x n_points) array, which is returned as is, or a list with the
+        list of predicted values of each point
+
+    Returns:
+
+        (numpy array), array of predictions with a column per point
+
+    """
+    if isinstance(y_pred_list, np.ndarray) and y_pred_list.ndim == 2 and y_pred_list.dtype != object:
+        return y_pred_list
+    n_preds = [len(y_pred) for y_pred in y_pred_list]
+    matrix = np.full((max(n_preds, default=0), len(n_preds)), np.nan)
+    for point, y_pred in enumerate(y_pred_list):
+        matrix[:n_preds[point], point] = y_pred
+    return matrix
+
+def nan_mean(y_pred_matrix):
+    """
+    Method to return the mean prediction of each point of a prediction_matrix, NaN for points without predictions
+
+    Args:
+
+        y_pred_matrix: (numpy array), array of predictions with a column per point
+
+    Returns:
+
+        (numpy array), array of mean predictions
+
+    """
+    with warnings.catch_warnings():
+        # Mean of empty slice
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(y_pred_matrix, axis=0)
+
+def nan_std(y_pred_matrix):
+    """
+    Method to return the standard deviation of the predictions of each point of a prediction_matrix, NaN for points
+    without predictions
+
+    Args:
+
+        y_pred_matrix: (numpy array), array of predictions with a column per point
+
+    Returns:
+
+        (numpy array), array of standard deviations
+
+    """
+    with warnings.catch_warnings():
+        # Degrees of freedom <= 0 for slice
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanstd(y_pred_matrix, axis=0)
+
 def round_down(num, divisor):
     """
     Method to return a rounded down number
@@ -0,0 +1,291 @@
+"""
+The render module controls when and where the plots of a MAST-ML run are drawn. When [PlotSettings] defer_rendering is
+on, each plot call only saves its input data and parameters to the plot manifest of the output directory, and the
+PNGs (with their notebooks) are drawn afterwards, possibly in parallel, by running
+
+    python -m mastml.render results/
+
+which also remakes the index.html page so it shows the rendered plots. Only the plot_helper methods decorated with
+@deferrable are recorded: the train/test plots of each split (predicted vs true, residual histograms, confusion
+matrices, ROC and precision-recall curves), the best/worst and per-point plots, the predicted vs true bars, the metric
+vs group plots, the target histogram and the feature vs target scatter plots. make_error_plots and the average error
+plots are not deferred and are always drawn during the run, as the normalized errors come from the prediction intervals
+of the fitted model, and the average plots read the error csv files the split plots write.
+
+Otherwise, when [PlotSettings] n_jobs is more than 1, each call of a @deferrable method is sent to a pool of processes
+that draw the plots while the run goes on. Processes are used because matplotlib is not thread safe.
+"""
+
+import os
+import json
+import glob
+import pickle
+import inspect
+import logging
+import argparse
+import itertools
+import threading
+import multiprocessing
+from functools import wraps
+
+from mastml import parallel, utils, result_store, html_helper
+
+log = logging.getLogger('mastml')
+
+# Directory of the output directory that holds one record per deferred plot call
+MANIFEST_DIRNAME = 'plot_manifest'
+
+# Valid choices for the [PlotSettings] notebooks parameter, see plot_helper.set_notebook_mode
+NOTEBOOK_MODES = ['inline', 'shared', 'off']
+
+# File of the plot manifest that keeps the notebook mode of the run, so the plots are rendered the same way
+_SETTINGS_FILENAME = 'settings.json'
+
+# Arguments of plot functions that name where the plot is saved. They are recorded relative to the output directory,
+# so a run can be moved or copied before it is rendered.
+_PATH_ARGUMENTS = ['savepath', 'outdir']
+
+# Output directory of the run whose plots are being recorded, or None when plots are drawn right away
+_record_outdir = None
+_record_counter = itertools.count()
+
+# Pool of processes drawing plots during the run, see start_plot_pool
+_plot_pool = None
+_plot_pool_pid = None
+_pending_plots = None
+_plot_errors = list()
+
+# Number of plots each pool process may have waiting, which bounds the memory held by plots not yet drawn
+_PENDING_PLOTS_PER_PROCESS = 4
+
+def defer_plots(outdir, notebooks='inline'):
+    """
+    Method to start (or stop) recording the plot calls of a run instead of drawing them
+
+    Args:
+
+        outdir: (str), output directory of the run, or None to draw plots right away again
+
+        notebooks: (str), the notebook mode the plots are rendered with, one of NOTEBOOK_MODES
+
+    Returns:
+
+        None
+
+    """
+    global _record_outdir
+    _record_outdir = outdir
+    if outdir is not None:
+        os.makedirs(os.path.join(outdir, MANIFEST_DIRNAME), exist_ok=True)
+        with open(os.path.join(outdir, MANIFEST_DIRNAME, _SETTINGS_FILENAME), 'w') as f:
+            json.dump({'notebooks': notebooks}, f)
+
+def deferrable(plot_func):
+    """
+    Decorator for plot_helper methods that only need data (not a fitted model), so their calls can be recorded while
+    plots are deferred
+
+    Args:
+
+        plot_func: (plot_helper method), a plotting method with a "savepath" or "outdir" argument
+
+    Returns:
+
+        (plot_helper method), the plotting method, which records its call instead of plotting while plots are deferred
+
+    """
+    @wraps(plot_func)
+    def wrapper(*args, **kwargs):
+        if _record_outdir is not None:
+            _record(plot_func.__name__, inspect.signature(plot_func).bind(*args, **kwargs).arguments, _record_outdir)
+        # Forked workers of the 'processes' backend can't use the pool of their parent, so they draw their own plots
+        elif _plot_pool is not None and _plot_pool_pid == os.getpid():
+            _submit(plot_func.__name__, inspect.signature(plot_func).bind(*args, **kwargs).arguments)
+        else:
+            return _draw_and_report(plot_func, args, kwargs)
+    return wrapper
+
+def reported(plot_func):
+    """
+    Decorator for plot_helper methods that are always drawn right away (not @deferrable), so the files they write are
+    added to the report manifest like those of the @deferrable methods
+
+    Args:
+
+        plot_func: (plot_helper method), a plotting method with a "savepath" argument
+
+    Returns:
+
+        (plot_helper method), the plotting method, which adds the files it wrote to the report manifest
+
+    """
+    @wraps(plot_func)
+    def wrapper(*args, **kwargs):
+        return _draw_and_report(plot_func, args, kwargs)
+    return wrapper
+
+def _draw_and_report(plot_func, args, kwargs):
+    output = plot_func(*args, **kwargs)
+    html_helper.add_plot(plot_func.__name__, inspect.signature(plot_func).bind(*args, **kwargs).arguments, output)
+    return output
+
+def start_plot_pool(n_jobs):
+    """
+    Method to start the pool of processes that draw the plots of a run
+
+    Args:
+
+        n_jobs: (int), number of processes. With 1 or less, plots are drawn right away by the caller
+
+    Returns:
+
+        None
+
+    """
+    global _plot_pool, _plot_pool_pid, _pending_plots
+    if n_jobs <= 1:
+        return
+    from mastml import plot_helper
+    # Spawned processes don't inherit the locks held by other threads of the run (e.g. the background writer), nor
+    # the notebook settings and the manifest the plots are added to, which are passed on instead
+    _plot_pool = multiprocessing.get_context('spawn').Pool(processes=n_jobs,
+                                                           initializer=_start_plot_process,
+                                                           initargs=(plot_helper.get_notebook_state(),
+                                                                     html_helper.get_report_outdir()))
+    _plot_pool_pid = os.getpid()
+    _pending_plots = threading.BoundedSemaphore(_PENDING_PLOTS_PER_PROCESS*n_jobs)
+    del _plot_errors[:]
+    log.info(f'Drawing plots with {n_jobs} processes')
+
+def finish_plot_pool():
+    """
+    Method to wait until the plot pool has drawn every plot sent to it and stop it. Raises the first error a plot hit
+
+    Args:
+
+        None
+
+    Returns:
+
+        None
+
+    """
+    global _plot_pool, _plot_pool_pid
+    if _plot_pool is None:
+        return
+    _plot_pool.close()
+    _plot_pool.join()
+    _plot_pool, _plot_pool_pid = None, None
+    if _plot_errors:
+        raise _plot_errors[0]
+
+def _start_plot_process(notebook_state, report_outdir):
+    from mastml import plot_helper
+    plot_helper.set_notebook_state(*notebook_state)
+    html_helper.record_artifacts(report_outdir)
+
+def _submit(function_name, arguments):
+    # Blocks while the pool is behind by the maximum number of plots
+    _pending_plots.acquire()
+    _plot_pool.apply_async(_draw, (function_name, dict(arguments)),
+                           callback=_plot_done, error_callback=_plot_failed)
+
+def _plot_done(result):
+    _pending_plots.release()
+
+def _plot_failed(error):
+    log.error(f'Drawing a plot failed: {str(error)}')
+    _plot_errors.append(error)
+    _pending_plots.release()
+
+def _draw(function_name, arguments):
+    from mastml import plot_helper
+    getattr(plot_helper, function_name)(**arguments)
+
+def _record(function_name, arguments, outdir):
+    arguments = dict(arguments)
+    # Paths relative to the working directory (e.g. with a relative outdir) are made relative to outdir too, as
+    # _render_one joins outdir onto every relative path
+    for name in _PATH_ARGUMENTS:
+        if name in arguments:
+            arguments[name] = os.path.relpath(os.path.abspath(arguments[name]), os.path.abspath(outdir))
+    # The same goes for the split directories of arrays that shared notebooks refer to
+    arguments = result_store.relocate(arguments, lambda split_path: os.path.relpath(split_path, os.path.abspath(outdir)))
+    # The process id keeps the names of records made by forked workers apart
+    filename = f'{os.getpid()}_{next(_record_counter):07d}_{function_name}.pkl'
+    with open(os.path.join(outdir, MANIFEST_DIRNAME, filename), 'wb') as f:
+        pickle.dump((function_name, arguments), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _render_one(record_path):
+    with open(record_path, 'rb') as f:
+        function_name, arguments = pickle.load(f)
+    outdir = os.path.dirname(os.path.dirname(record_path))
+    for name in _PATH_ARGUMENTS:
+        if name in arguments and not os.path.isabs(arguments[name]):
+            arguments[name] = os.path.join(outdir, arguments[name])
+    arguments = result_store.relocate(arguments, lambda split_path: os.path.join(outdir, split_path))
+    _draw(function_name, arguments)
+
+def render(outdir, n_jobs=1):
+    """
+    Method to draw every plot recorded in the plot manifest of a run, then remake its index.html page
+
+    Args:
+
+        outdir: (str), output directory of a run made with [PlotSettings] defer_rendering = True
+
+        n_jobs: (int), number of processes to draw plots with. -1 means use all available cores
+
+    Returns:
+
+        (int), the number of plots drawn
+
+    """
+    if not os.path.isdir(os.path.join(outdir, MANIFEST_DIRNAME)):
+        raise utils.FileNotFoundError(f'{outdir} has no {MANIFEST_DIRNAME} directory. Was it run with '
+                                      f'[PlotSettings] defer_rendering = True?')
+    record_paths = sorted(glob.glob(os.path.join(outdir, MANIFEST_DIRNAME, '*.pkl')))
+    notebooks = 'inline'
+    if os.path.exists(os.path.join(outdir, MANIFEST_DIRNAME, _SETTINGS_FILENAME)):
+        with open(os.path.join(outdir, MANIFEST_DIRNAME, _SETTINGS_FILENAME)) as f:
+            notebooks = json.load(f)['notebooks']
+    from mastml import plot_helper
+    plot_helper.set_notebook_mode(notebooks, outdir)
+    n_jobs, backend = parallel.check_backend(n_jobs, 'processes', section='render')
+    log.info(f'Rendering {len(record_paths)} plots with {n_jobs} workers...')
+    # The drawn files are added to the report manifest, and make_html remakes the pages of their combos
+    html_helper.record_artifacts(outdir)
+    try:
+        parallel.parallel_map(_render_one, record_paths, n_jobs=n_jobs, backend=backend)
+    finally:
+        html_helper.record_artifacts(None)
+
+    html_helper.make_html(outdir)
+    return len(record_paths)
+
+def get_commandline_args():
+    """
+    This method is responsible for parsing the command-line arguments of the render command
+
+    Args:
+
+        None
+
+    Returns:
+
+        (str), the output directory of the run to render
+
+        (int), the number of processes to draw plots with
+
+    """
+    parser = argparse.ArgumentParser(description='Draw the deferred plots of a MAST-ML run')
+    parser.add_argument('outdir', type=str, help='output directory of a run made with defer_rendering = True')
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help='number of processes to draw plots with, -1 for all cores. Defaults to 1')
+    args = parser.parse_args()
+    return os.path.abspath(args.outdir), args.n_jobs
+
+if __name__ == '__main__':
+    outdir, n_jobs = get_commandline_args()
+    logging.basicConfig(level=logging.INFO)
+    render(outdir, n_jobs)
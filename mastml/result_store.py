@@ -0,0 +1,325 @@
+"""
+The result_store module contains an optional columnar (Parquet or Arrow IPC) store for the data and predictions of a
+MAST-ML run. The feature matrix of each normalizer/selector stage is stored once, and each split only stores its row
+indices and predictions, instead of a train.csv and test.csv holding a full copy of the data for every split.
+"""
+
+import os
+import json
+import glob
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from mastml import utils
+
+log = logging.getLogger('mastml')
+
+# Valid choices for the [GeneralSetup] result_format parameter. csv keeps the train.csv and test.csv of every split.
+RESULT_FORMATS = ['csv', 'parquet', 'arrow']
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Key of the schema metadata that records which columns are which, so the csv views can be rebuilt
+_METADATA_KEY = b'mastml'
+
+# Key of the dicts that stand in for stored arrays in the arguments of shared notebooks, see to_references
+REFERENCE_KEY = 'mastml_result_split'
+
+def check_result_format(result_format):
+    """
+    Method to check the result_format parameter parsed from the input configuration file
+
+    Args:
+
+        result_format: (str), one of 'csv', 'parquet' or 'arrow'
+
+    Returns:
+
+        (str), the validated result format
+
+    """
+    if result_format not in RESULT_FORMATS:
+        raise utils.InvalidConfParameters(f"[GeneralSetup] result_format '{result_format}' is unknown. "
+                                          f"Valid choices: {RESULT_FORMATS}")
+    if result_format != 'csv':
+        try:
+            import pyarrow
+        except ImportError:
+            raise utils.InvalidConfParameters(f"[GeneralSetup] result_format = {result_format} needs the pyarrow "
+                                              f"package. Install it with `pip install pyarrow`, or use "
+                                              f"result_format = csv")
+    return result_format
+
+def write_stage(path, X, X_noinput, y, result_format):
+    """
+    Method to store the data of a normalizer/selector stage, i.e. the same columns as its normalized.csv or
+    selected.csv
+
+    Args:
+
+        path: (str), path of the file to write, without extension
+
+        X: (dataframe), the normalized or selected features
+
+        X_noinput: (dataframe), the columns that are not input features
+
+        y: (series), the target feature
+
+        result_format: (str), one of 'parquet' or 'arrow'
+
+    Returns:
+
+        (str), path of the written file
+
+    """
+    path = path + EXTENSIONS[result_format]
+    roles = {'X': [str(column) for column in X.columns],
+             'X_noinput': [str(column) for column in X_noinput.columns],
+             'y': str(y.name)}
+    frame = pd.concat([X, X_noinput, y], axis=1)
+    frame.columns = [str(column) for column in frame.columns]
+    _write_frame(path, frame, roles)
+    return path
+
+def write_split(split_path, stage_path, train_indices, train_pred, test_indices, test_pred, result_format):
+    """
+    Method to store the predictions of a split, which refer to the rows of the stage the split was fit on
+
+    Args:
+
+        split_path: (str), directory of the split
+
+        stage_path: (str), path of the stage file written by write_stage
+
+        train_indices: (numpy array), indices of the training rows
+
+        train_pred: (numpy array), predictions for the training rows
+
+        test_indices: (numpy array), indices of the test rows
+
+        test_pred: (numpy array), predictions for the test rows
+
+        result_format: (str), one of 'parquet' or 'arrow'
+
+    Returns:
+
+        (str), path of the written file
+
+    """
+    path = os.path.join(split_path, 'predictions' + EXTENSIONS[result_format])
+    predictions = pd.DataFrame({'index': np.concatenate([train_indices, test_indices]),
+                                'set': ['train']*len(train_indices) + ['test']*len(test_indices),
+                                'pred': np.concatenate([np.asarray(train_pred).ravel(),
+                                                        np.asarray(test_pred).ravel()])},
+                               columns=['index', 'set', 'pred'])
+    _write_frame(path, predictions, {'stage': os.path.relpath(stage_path, split_path)})
+    return path
+
+def read_frame(path):
+    """
+    Method to read a file written by write_stage or write_split
+
+    Args:
+
+        path: (str), path of a .parquet or .arrow file
+
+    Returns:
+
+        frame: (dataframe), the stored dataframe
+
+        metadata: (dict), the column roles of a stage, or the relative stage path of a split
+
+    """
+    import pyarrow as pa
+    if path.endswith(EXTENSIONS['parquet']):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        with pa.OSFile(path, 'rb') as f:
+            table = pa.ipc.open_file(f).read_all()
+    metadata = json.loads(table.schema.metadata[_METADATA_KEY].decode())
+    return table.to_pandas(), metadata
+
+def read_split(split_path, kind='test'):
+    """
+    Method to rebuild the train.csv or test.csv view of a split from the columnar store
+
+    Args:
+
+        split_path: (str), directory of the split
+
+        kind: (str), 'train' or 'test'
+
+    Returns:
+
+        (dataframe), dataframe with the features, target, predictions and non-input columns of the rows, in the same
+        layout as the csv files
+
+    """
+    prediction_paths = glob.glob(os.path.join(split_path, 'predictions.*'))
+    if not prediction_paths:
+        raise utils.FileNotFoundError(f'No stored predictions found in {split_path}')
+    predictions, metadata = read_frame(prediction_paths[0])
+    stage, roles = read_frame(os.path.normpath(os.path.join(split_path, metadata['stage'])))
+
+    rows = predictions[predictions['set'] == kind]
+    indices = rows['index'].values
+    pred = pd.DataFrame(rows['pred'].values, columns=[kind+'_pred'], index=indices)
+    return pd.concat([stage.loc[indices, roles['X']], stage.loc[indices, roles['y']], pred,
+                      stage.loc[indices, roles['X_noinput']]], axis=1)
+
+def export_csv(split_path):
+    """
+    Method to write the train.csv and test.csv of a split from the columnar store, as a csv run would have
+
+    Args:
+
+        split_path: (str), directory of the split
+
+    Returns:
+
+        None
+
+    """
+    for kind in ['train', 'test']:
+        read_split(split_path, kind).to_csv(os.path.join(split_path, kind+'.csv'), index=False)
+
+def _write_frame(path, frame, metadata):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[_METADATA_KEY] = json.dumps(metadata).encode()
+    table = table.replace_schema_metadata(schema_metadata)
+    if path.endswith(EXTENSIONS['parquet']):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as f:
+            writer = pa.RecordBatchFileWriter(f, table.schema)
+            writer.write_table(table)
+            writer.close()
+
+class StoredArray(np.ndarray):
+    """
+    Class for a numpy array that is also kept in the result store, and knows where. Plots of the split get these
+    arrays, so shared notebooks can refer to the stored column instead of copying the data (see to_references). Arrays
+    computed from a StoredArray (slices, arithmetic) are not the stored column, so they lose the location.
+
+    Attributes:
+
+        source: (tuple or None), the split directory, 'train' or 'test', and the column of the read_split view the
+        array is stored in (None for the row indices)
+
+    """
+    def __array_finalize__(self, obj):
+        self.source = None
+
+    def __reduce__(self):
+        # Keep the location when the array is pickled for the plot pool or the plot manifest
+        constructor, args, state = super().__reduce__()
+        return constructor, args, (state, self.source)
+
+    def __setstate__(self, state):
+        state, self.source = state
+        super().__setstate__(state)
+
+def reference_split(split_result, split_path, y_name):
+    """
+    Method to tag the arrays of a split result that write_split stores (the true and predicted values and the row
+    indices of the train and test sets) with where they are stored
+
+    Args:
+
+        split_result: (dict), a split result of mastml_driver
+
+        split_path: (str), directory of the split
+
+        y_name: (str), name of the target feature
+
+    Returns:
+
+        (OrderedDict), copy of split_result whose stored arrays are StoredArrays
+
+    """
+    run = OrderedDict(split_result)
+    for kind in ['train', 'test']:
+        for key, column in [(f'y_{kind}_true', y_name), (f'y_{kind}_pred', kind+'_pred'), (f'{kind}_indices', None)]:
+            array = np.asarray(run[key])
+            # Predictions with more than one column per row are stored flattened, so they are kept as they are
+            if array.ndim == 1:
+                run[key] = array.view(StoredArray)
+                run[key].source = (os.path.abspath(split_path), kind, column)
+    return run
+
+def plain_arrays(value):
+    """
+    Method to turn the StoredArrays in (nested tuples, lists and dicts of) plot arguments back into plain arrays
+
+    Args:
+
+        value: (object), a plot argument
+
+    Returns:
+
+        (object), the same argument with plain numpy arrays
+
+    """
+    return _map_stored(value, lambda array: array.view(np.ndarray))
+
+def to_references(value, relative_to):
+    """
+    Method to replace the StoredArrays in (nested tuples, lists and dicts of) plot arguments with small dicts that
+    refer to the result files they are stored in, see plot_helper.load_plot_args
+
+    Args:
+
+        value: (object), a plot argument
+
+        relative_to: (str), directory the references are relative to, i.e. the directory of the notebook
+
+    Returns:
+
+        (object), the same argument with references in place of the stored arrays
+
+    """
+    def reference(array):
+        if array.source is None:
+            return array.view(np.ndarray)
+        split_path, kind, column = array.source
+        return {REFERENCE_KEY: os.path.relpath(split_path, relative_to), 'kind': kind, 'column': column}
+    return _map_stored(value, reference)
+
+def relocate(value, function):
+    """
+    Method to change the split directories that the StoredArrays in (nested tuples, lists and dicts of) plot arguments
+    refer to, e.g. to record them relative to the output directory
+
+    Args:
+
+        value: (object), a plot argument
+
+        function: (callable), function taking and returning a split directory
+
+    Returns:
+
+        (object), the same argument with the StoredArrays referring to the new split directories
+
+    """
+    def move(array):
+        moved = array.view(StoredArray)
+        if array.source is not None:
+            moved.source = (function(array.source[0]),) + array.source[1:]
+        return moved
+    return _map_stored(value, move)
+
+def _map_stored(value, function):
+    if isinstance(value, StoredArray):
+        return function(value)
+    if type(value) in (tuple, list):
+        return type(value)(_map_stored(item, function) for item in value)
+    if type(value) in (dict, OrderedDict):
+        return type(value)((key, _map_stored(item, function)) for key, item in value.items())
+    return value
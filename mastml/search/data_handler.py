@@ -7,6 +7,19 @@ __date__ = 'October 14th, 2017'
 import numpy as np
 import copy
 
+def set_column(dataframe, name, values):
+    """Set a column of a dataframe that may share its column arrays with other dataframes (see DataHandler.view).
+    An existing column is replaced by a new array at the same position rather than overwritten in place, so the
+    dataframes it is shared with keep their values.
+    """
+    if name in dataframe.columns:
+        loc = dataframe.columns.get_loc(name)
+        del dataframe[name]
+        dataframe.insert(loc, name, values)
+    else:
+        dataframe[name] = values
+    return
+
 class DataHandler():
     """
     Constructor class to organize aspects of a pandas dataframe, such as which fields are input vs. target data,
@@ -59,10 +72,12 @@ class DataHandler():
         if data is None:
             raise ValueError("No dataframe.")
         #Set by keyword
-        self.data = copy.deepcopy(data)
-        self.data_unfiltered = copy.deepcopy(data)
-        self.input_data = copy.deepcopy(input_data)
-        self.target_data = copy.deepcopy(target_data)
+        # The column arrays of data are shared, not copied, and treated as read-only: columns are only ever added or
+        # replaced through set_column, so the handler and its views can't change each other's data
+        self.data = data.copy(deep=False)
+        self.data_unfiltered = data.copy(deep=False)
+        self.input_data = None if input_data is None else input_data.copy(deep=False)
+        self.target_data = None if target_data is None else target_data.copy(deep=False)
         self.input_features = list(input_features)
         self.target_feature = target_feature
         self.target_error_feature = target_error_feature
@@ -104,20 +119,31 @@ class DataHandler():
             self.target_prediction_sigma = self.data["Prediction Sigma"]
         return
 
+    def view(self):
+        """Return a copy-on-write copy of this DataHandler, which shares the column arrays of self.data instead of
+        copying them. The columns the copy adds or replaces only belong to the copy.
+        """
+        view = copy.copy(self)
+        view.data = self.data.copy(deep=False)
+        view.input_features = list(self.input_features)
+        if self.labeling_features is not None:
+            view.labeling_features = list(self.labeling_features)
+        return view
+
     def add_prediction(self, prediction_data):
-        self.data["Prediction"] = prediction_data
+        set_column(self.data, "Prediction", prediction_data)
         self.target_prediction = prediction_data
 
     def add_residuals(self, residual_data):
-        self.data["Residuals"] = residual_data
+        set_column(self.data, "Residuals", residual_data)
         self.target_residuals = residual_data
 
     def add_prediction_sigma(self, prediction_data_sigma):
-        self.data["Prediction Sigma"] = prediction_data_sigma
+        set_column(self.data, "Prediction Sigma", prediction_data_sigma)
         self.target_prediction_sigma = prediction_data_sigma
 
     def add_feature(self, feature_name, feature_data):
-        self.data[feature_name] = feature_data
+        set_column(self.data, feature_name, feature_data)
 
     def print_data(self, csvname="data.csv", addl_cols = list()):
         cols = list()
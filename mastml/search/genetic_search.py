@@ -50,6 +50,11 @@ class GeneticSearch(GridSearch):
         mark_outlying_points (list of int): Number of outlying points to mark in best and worst tests, e.g. [0,3]
         num_bests (int): Number of best individuals to track
         processors (int): Number of processors to use 1 - single processor (serial); 2 - use multiprocessing with this many processors, all on a SINGLE node
+        fold_processors (int): Number of processes to run the CV folds of an individual on, see GridSearch
+        early_abort_folds (int): Number of folds after which an individual that can't make the best individuals is
+            dropped, 0 to run all folds, see GridSearch
+        fitness_cache_path (str): Path of a file keeping the RMSE of every individual evaluated, so a later or
+            interrupted search doesn't refit them. Leave blank to only remember them during the search
         population_size (int): Number of individuals in each generation's population
         convergence_generations (int): Number of generations where the genome must stay constant in order to establish convergence
         max_generations (int): Maximum number of generations
@@ -69,7 +74,8 @@ class GeneticSearch(GridSearch):
                  num_folds=None, percent_leave_out=None, num_cvtests=20, mark_outlying_points='0,3',
                  num_bests=10, fix_random_for_testing=0, processors=1, pop_upper_limit=1000000,
                  num_gas=1, ga_pop_size=50, convergence_generations=30, max_generations=200,
-                 crossover_prob=0.5, mutation_prob=0.1, shift_prob=0.5, gen_tol=0.00000001):
+                 crossover_prob=0.5, mutation_prob=0.1, shift_prob=0.5, gen_tol=0.00000001,
+                 fold_processors=1, early_abort_folds=0, fitness_cache_path=None):
         """
             Additional class attributes not in parent class:
            
@@ -102,7 +108,10 @@ class GeneticSearch(GridSearch):
             percent_leave_out = percent_leave_out,
             processors = processors,
             pop_upper_limit = pop_upper_limit,
-            num_bests = num_bests)
+            num_bests = num_bests,
+            fold_processors = fold_processors,
+            early_abort_folds = early_abort_folds,
+            fitness_cache_path = fitness_cache_path)
         #Sets by keyword
         self.num_gas = int(num_gas)
         self.ga_pop_size = int(ga_pop_size)
@@ -143,7 +152,15 @@ class GeneticSearch(GridSearch):
             percent_leave_out = self.percent_leave_out,
             processors = self.processors,
             pop_upper_limit = self.pop_upper_limit,
-            num_bests = self.num_bests)
+            num_bests = self.num_bests,
+            fold_processors = self.fold_processors,
+            early_abort_folds = self.early_abort_folds,
+            fitness_cache_path = self.fitness_cache_path)
+        mygen.pool = self.pool
+        mygen.pool_abort_rmse = self.pool_abort_rmse
+        # Genomes seen in earlier generations and GAs aren't refit
+        mygen.fitness_cache = self.fitness_cache
+        mygen.dataset_fingerprint = self.get_dataset_fingerprint()
         return mygen
 
     def get_parent_params(self, prev_gen):
@@ -323,9 +340,14 @@ class GeneticSearch(GridSearch):
     def run(self):
         self.set_up()
         self.readme_list.append("===== GA info =====\n")
-        for ga in range(0, self.num_gas):
-            self.run_ga()
-            self.print_ga(ga)
+        # One worker pool evaluates the individuals of every generation
+        self.start_pool()
+        try:
+            for ga in range(0, self.num_gas):
+                self.run_ga()
+                self.print_ga(ga)
+        finally:
+            self.close_pool()
         self.select_final_best()
         self.print_final_results()
         return
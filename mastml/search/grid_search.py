@@ -11,14 +11,38 @@ import copy
 import logging
 import sys
 import time
+import json
+import hashlib
 import itertools
+import multiprocessing
 from sklearn.externals import joblib
 import sklearn.model_selection
 
-from .. import plot_helper
+from .. import plot_helper, parallel
+from ..cache import DiskCache
+from .data_handler import set_column
 
 logger = logging.getLogger('mastml')
 
+# Search that the processes of a worker pool evaluate individuals with, set once per process by _init_worker, so the
+# dataset and model are sent to each process a single time rather than with every individual
+_worker_search = None
+# Shared value holding the RMSE individuals must beat to run all their folds, see GridSearch.early_abort_folds
+_worker_abort_rmse = None
+
+def _init_worker(search, abort_rmse):
+    global _worker_search, _worker_abort_rmse
+    _worker_search = search
+    _worker_abort_rmse = abort_rmse
+
+def _read_worker_abort_rmse():
+    return _worker_abort_rmse.value
+
+def _evaluate_in_worker(task):
+    indiv_params, indiv_key, save_path = task
+    return indiv_key, _worker_search.evaluate_indiv(indiv_params, indiv_key, save_path,
+                                                    abort_rmse=_read_worker_abort_rmse)
+
 class GridSearch:
     """Class to perform parameter optimization by grid search. Only up to 4 parameters may be optimized at a time.
 
@@ -57,6 +81,13 @@ class GridSearch:
         num_bests (int): Number of best individuals to track
         processors (int): Number of processors to use 1 - single processor (serial); 2 - use multiprocessing with this many processors, all on a SINGLE node
         pop_upper_limit (int): Upper limit for population size.
+        fold_processors (int): Number of processes to run the CV folds of an individual on. Only used when
+            individuals are evaluated serially (processors = 1), otherwise the folds run serially in each processor
+        early_abort_folds (int): 0 - run every fold of every individual; n - run the first n folds of an individual
+            first, and drop it without running the rest when their average RMSE is already worse than the
+            num_bests-th best RMSE so far
+        fitness_cache_path (str): Path of a file keeping the RMSE of every individual evaluated on this dataset and
+            model, so a later or interrupted search doesn't refit them. Leave blank to only remember them in memory
 
     Returns:
         Analysis in the save_path folder
@@ -69,7 +100,8 @@ class GridSearch:
     def __init__(self, param_strings, training_dataset, testing_dataset, model,
                  save_path=None, xlabel="Measured", ylabel="Predicted", fix_random_for_testing=0,
                  num_cvtests=5, mark_outlying_points='0,3', num_folds=None, percent_leave_out=None,
-                 processors=1, pop_upper_limit=1000000, num_bests=10):
+                 processors=1, pop_upper_limit=1000000, num_bests=10, fold_processors=1, early_abort_folds=0,
+                 fitness_cache_path=None):
         """
         Additional class attributes to parent class:
             Set by keyword:
@@ -81,6 +113,9 @@ class GridSearch:
                 self.processors
                 self.pop_upper_limit
                 self.num_bests
+                self.fold_processors
+                self.early_abort_folds
+                self.fitness_cache_path
                 self.param_strings
             Set in code:
                 self.opt_dict
@@ -93,6 +128,8 @@ class GridSearch:
                 self.pop_rmses
                 self.best_indivs
                 self.best_params
+                self.fitness_cache
+                self.dataset_fingerprint
                 ?self.random_state
         """
         if not(training_dataset == testing_dataset):
@@ -117,6 +154,12 @@ class GridSearch:
         self.processors=int(processors)
         self.pop_upper_limit = int(pop_upper_limit)
         self.num_bests = int(num_bests)
+        self.fold_processors = int(fold_processors)
+        self.early_abort_folds = int(early_abort_folds)
+        # Conf files can only spell a missing path as 'None' or leave it blank
+        if fitness_cache_path in ('None', ''):
+            fitness_cache_path = None
+        self.fitness_cache_path = fitness_cache_path
 
         ### MARK Don't do this
         #self.param_strings = dict()
@@ -138,6 +181,10 @@ class GridSearch:
         self.flat_results=None
         self.best_indivs=None
         self.best_params=None
+        self.pool=None
+        self.pool_abort_rmse=None
+        self.fitness_cache=dict()
+        self.dataset_fingerprint=None
         return
 
     ### SingleFit section
@@ -165,17 +212,17 @@ class GridSearch:
         if training_dataset is None:
             raise ValueError("training_dataset is not set")
         if type(training_dataset) is list: #allow inheriting classes to get multiple datasets; MASTML will pass list of data objects
-            self.training_dataset= copy.deepcopy(training_dataset[0]) #first item
+            self.training_dataset= training_dataset[0].view() #first item
         else:
-            self.training_dataset = copy.deepcopy(training_dataset)
+            self.training_dataset = training_dataset.view()
 
         # testing csv
         if testing_dataset is None:
             raise ValueError("testing_dataset is not set")
         if type(testing_dataset) is list:
-            self.testing_dataset = copy.deepcopy(testing_dataset[0])
+            self.testing_dataset = testing_dataset[0].view()
         else:
-            self.testing_dataset=copy.deepcopy(testing_dataset)
+            self.testing_dataset=testing_dataset.view()
         self.scaler = scaler
 
         # model
@@ -270,67 +317,146 @@ class GridSearch:
 
     def evaluate_pop(self):
         """make model and new testing dataset for each pop member
-            and evaluate
+            and evaluate. Parameters that were evaluated before, in this population or in an earlier one sharing
+            self.fitness_cache (or the file at self.fitness_cache_path), are not evaluated again
         """
         self.pop_stats=dict()
         self.pop_rmses=dict()
 
+        fitness_keys = dict((ikey, self.get_fitness_key(self.pop_params[ikey])) for ikey in self.pop_params.keys())
+        results = self.get_cached_fitnesses(set(fitness_keys.values()))
+        new_ikeys = list()
+        new_fitness_keys = set()
+        for ikey, fitness_key in fitness_keys.items():
+            if fitness_key not in results and fitness_key not in new_fitness_keys:
+                new_ikeys.append(ikey)
+                new_fitness_keys.add(fitness_key)
+        logger.debug("%i/%i individuals were evaluated before" % (self.pop_size - len(new_ikeys), self.pop_size))
+        new_results = dict()
+
         if self.processors == 1:
-            for ikey in self.pop_params.keys():
+            for done, ikey in enumerate(new_ikeys):
                 #sys.stdout.write("\rIndividual %s/%i" % (ikey, self.pop_size)) # loading bar HACK
-                sys.stdout.write(f"\rMaking individuals [{'+'*int(ikey)}{'-'*(self.pop_size-int(ikey))}]") # loading bar HACK
+                sys.stdout.write(f"\rMaking individuals [{'+'*done}{'-'*(len(new_ikeys)-done)}]") # loading bar HACK
                 sys.stdout.flush()
                 indiv_params = self.pop_params[ikey]
-                [indiv_rmse, indiv_stats] = self.evaluate_indiv(indiv_params, ikey)
-                self.pop_stats[ikey] = indiv_stats
-                self.pop_rmses[ikey] = indiv_rmse
+                indiv_result = self.evaluate_indiv(indiv_params, ikey,
+                                                   abort_rmse=lambda: self.get_abort_rmse(rmse for rmse, _ in results.values()))
+                results[fitness_keys[ikey]] = new_results[fitness_keys[ikey]] = indiv_result
             print()
             logger.debug(f'finished generation of {self.pop_size} individuals.')
-        else:
-            from multiprocessing import Process, Manager
-            manager = Manager()
-            pop_stats_dict = manager.dict()
-            pop_rmses_dict = manager.dict()
-            pop_done = manager.Value('i',0)
-            #create a number of lists each with the size of number of processors
-            pop_keys = list(self.pop_params.keys())
-            num_lists = int(np.ceil(self.pop_size/self.processors)) #round up
-            flat_lists = list()
-            pkct = 0
-            for listct in range(0, num_lists):
-                flat_list = list()
-                for item_ct in range(0, self.processors):
-                    if pkct < self.pop_size: #last list may have fewer entries
-                        flat_list.append(pop_keys[pkct])
-                        pkct = pkct + 1
-                flat_lists.append(flat_list)
-            for listct in range(0, num_lists):
-                pkey_list = flat_lists[listct]
-                indiv_p_list = list()
-                for iidx in range(0, len(pkey_list)):
-                    ikey = pkey_list[iidx]
-                    logger.debug("Individual %s/%i" % (ikey, self.pop_size))
-                    indiv_params = self.pop_params[ikey]
-                    indiv_p = Process(target=self.evaluate_indiv_multiprocessing, args=(indiv_params, ikey, pop_stats_dict, pop_rmses_dict, pop_done))
-                    indiv_p_list.append(indiv_p)
-                    indiv_p.start()
-                for indiv_p in indiv_p_list:
-                    indiv_p.join()
-            self.pop_stats = pop_stats_dict
-            self.pop_rmses = pop_rmses_dict
+        elif new_ikeys:
+            # Individuals are handed out one at a time as processes free up, so a slow individual only holds up its
+            # own process
+            own_pool = self.pool is None
+            self.start_pool()
+            self.pool_abort_rmse.value = self.get_abort_rmse(rmse for rmse, _ in results.values())
+            tasks = [(self.pop_params[ikey], ikey, self.save_path) for ikey in new_ikeys]
+            try:
+                for done, (ikey, indiv_result) in enumerate(self.pool.imap_unordered(_evaluate_in_worker, tasks), 1):
+                    results[fitness_keys[ikey]] = new_results[fitness_keys[ikey]] = indiv_result
+                    self.pool_abort_rmse.value = self.get_abort_rmse(rmse for rmse, _ in results.values())
+                    logger.debug("Individual %s done (multiprocessing), %i/%i" % (ikey, done, len(new_ikeys)))
+            finally:
+                if own_pool:
+                    self.close_pool()
+        self.store_fitnesses(new_results)
+        for ikey in self.pop_params.keys():
+            [self.pop_rmses[ikey], self.pop_stats[ikey]] = results[fitness_keys[ikey]]
+            if ikey not in new_ikeys:
+                self.print_indiv_params(self.pop_params[ikey], ikey)
         return
 
-    def evaluate_indiv_multiprocessing(self, indiv_params, indiv_key, pop_stats_dict, pop_rmses_dict, pop_done):
-        [indiv_rmse, indiv_stats] = self.evaluate_indiv(indiv_params, indiv_key)
-        pop_stats_dict[indiv_key] = indiv_stats
-        pop_rmses_dict[indiv_key] = indiv_rmse
-        pop_done.value += 1
-        logger.debug("Individual %s done (multiprocessing), %i/%i" % (indiv_key, pop_done.value, self.pop_size))
+    def get_fitness_key(self, indiv_params):
+        """Key of the fitness cache for an individual's parameters, the same for equal parameters in any order
+        """
+        return hashlib.sha1(json.dumps(indiv_params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_dataset_fingerprint(self):
+        """Hash of what an individual's RMSE depends on besides its parameters: the dataset, the features, the model
+        and the CV settings. Fitnesses stored in the fitness_cache_path file under another fingerprint are not used.
+        It is computed once, as save_best_model changes the parameters of self.model
+        """
+        if self.dataset_fingerprint is not None:
+            return self.dataset_fingerprint
+        dh = self.testing_dataset
+        digest = hashlib.sha1(pd.util.hash_pandas_object(dh.data[dh.input_features + [dh.target_feature]]).values)
+        digest.update(json.dumps([dh.input_features, dh.target_feature, self.model.__class__.__name__,
+                                  sorted(self.model.get_params().items()), self.num_folds, self.percent_leave_out],
+                                 default=str).encode())
+        self.dataset_fingerprint = digest.hexdigest()
+        return self.dataset_fingerprint
+
+    def get_cached_fitnesses(self, fitness_keys):
+        """Look up the [rmse, stats] of the given fitness keys in the fitness cache, then in the fitness_cache_path
+        file
+        """
+        found = dict((key, self.fitness_cache[key]) for key in fitness_keys if key in self.fitness_cache)
+        missing = [key for key in fitness_keys if key not in found]
+        if self.fitness_cache_path is not None and missing:
+            from_disk = self.get_fitness_disk_cache().get_many(missing)
+            self.fitness_cache.update(from_disk)
+            found.update(from_disk)
+        return found
+
+    def store_fitnesses(self, results):
+        """Add the [rmse, stats] of newly evaluated individuals to the fitness cache, and to the fitness_cache_path
+        file. Individuals dropped early are left out, as their RMSE only covers their first folds
+        """
+        results = dict((key, result) for key, result in results.items() if not result[1].get('aborted', False))
+        self.fitness_cache.update(results)
+        if self.fitness_cache_path is not None and results:
+            self.get_fitness_disk_cache().put_many(results)
+        return
+
+    def get_fitness_disk_cache(self):
+        return DiskCache(self.fitness_cache_path, namespace='fitness_'+self.get_dataset_fingerprint())
+
+    def start_pool(self):
+        """Start a pool of self.processors worker processes holding this search's dataset and model, which
+        evaluate_pop sends the parameters of each individual to. Searches on the same dataset and model (e.g. the
+        generations of a GeneticSearch) can share the pool by setting their pool attribute to it.
+        """
+        if self.pool is None and self.processors > 1:
+            self.pool_abort_rmse = multiprocessing.Value('d', np.inf, lock=False)
+            self.pool = multiprocessing.Pool(processes=self.processors, initializer=_init_worker,
+                                             initargs=(self, self.pool_abort_rmse))
         return
 
-    def evaluate_indiv(self, indiv_params, indiv_key):
-        """Evaluate an individual
+    def close_pool(self):
+        """Stop the worker pool started by start_pool
         """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.pool_abort_rmse = None
+        return
+
+    def __getstate__(self):
+        # The pool can't be pickled, nor is it needed by the workers it is sent to
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['pool_abort_rmse'] = None
+        return state
+
+    def get_abort_rmse(self, rmses):
+        """The RMSE the first early_abort_folds folds of an individual must beat for its remaining folds to run: the
+        num_bests-th best of the given RMSEs of the individuals evaluated so far, or infinity while there are fewer
+        """
+        rmses = np.fromiter(rmses, dtype=float)
+        if self.early_abort_folds <= 0 or len(rmses) < self.num_bests:
+            return np.inf
+        return np.partition(rmses, self.num_bests-1)[self.num_bests-1]
+
+    def evaluate_indiv(self, indiv_params, indiv_key, save_path=None, abort_rmse=None):
+        """Evaluate an individual, saving its parameters in save_path (self.save_path by default). Its RMSE is the
+        average over the CV folds. abort_rmse is a function returning the RMSE its first early_abort_folds folds must
+        beat to run the remaining folds. The RMSE of an individual dropped after its first folds is infinity, so it
+        ranks after every fully evaluated one, and its stats keep the average over the folds it ran
+        """
+        if save_path is None:
+            save_path = self.save_path
         indiv_model = copy.deepcopy(self.model)
         try:
             indiv_model.set_params(**indiv_params['model'])
@@ -341,7 +467,6 @@ class GridSearch:
 
         indiv_dh = self.get_indiv_datahandler(indiv_params)
         #logging.debug(indiv_dh)
-        indiv_path = os.path.join(self.save_path, "indiv_%s" % indiv_key)
 
         if self.num_folds is not None: # CZECK_mARK replace with sklearn
             splitter = sklearn.model_selection.KFold(n_splits=self.num_folds)
@@ -350,16 +475,42 @@ class GridSearch:
         else:
             raise ValueError("Both self.num_folds and self.percent_leave_out are None. One or the other must be specified.")
 
-        X = indiv_dh.data[indiv_dh.input_features].values
-        y = indiv_dh.data[indiv_dh.target_feature].values
-        for train_index, test_index in splitter.split(X):
-            X_train, X_test = X[train_index], X[test_index]
-            y_train, y_test = y[train_index], y[test_index]
-            indiv_model.fit(X_train, y_train)
-            y_test_pred = indiv_model.predict(X_test)
-            mycv_rmse = sklearn.metrics.mean_squared_error(y_test, y_test_pred)**0.5
-            mycv_stats = dict()
+        X = indiv_dh.input_data.values
+        y = indiv_dh.target_data.values
+        def fold_rmse(fold):
+            train_index, test_index = fold
+            fold_model = copy.deepcopy(indiv_model)
+            fold_model.fit(X[train_index], y[train_index])
+            y_test_pred = fold_model.predict(X[test_index])
+            return sklearn.metrics.mean_squared_error(y[test_index], y_test_pred)**0.5
+
+        folds = list(splitter.split(X))
+        n_first = len(folds)
+        if 0 < self.early_abort_folds < len(folds) and abort_rmse is not None:
+            n_first = self.early_abort_folds
+        fold_rmses = parallel.parallel_map(fold_rmse, folds[:n_first], n_jobs=self.fold_processors,
+                                           backend='processes')
+        aborted = n_first < len(folds) and np.mean(fold_rmses) > abort_rmse()
+        if aborted:
+            logger.debug("Individual %s dropped after %i folds" % (indiv_key, n_first))
+        else:
+            fold_rmses += parallel.parallel_map(fold_rmse, folds[n_first:], n_jobs=self.fold_processors,
+                                                backend='processes')
+        mycv_rmse = np.mean(fold_rmses)
+        mycv_stats = {'avg_rmse': mycv_rmse, 'std_rmse': np.std(fold_rmses), 'fold_rmses': fold_rmses,
+                      'aborted': aborted}
+
+        self.print_indiv_params(indiv_params, indiv_key, save_path)
+        if aborted:
+            return [np.inf, mycv_stats]
+        return [mycv_rmse, mycv_stats]
 
+    def print_indiv_params(self, indiv_params, indiv_key, save_path=None):
+        """Write the parameters of an individual to its folder in save_path (self.save_path by default)
+        """
+        if save_path is None:
+            save_path = self.save_path
+        indiv_path = os.path.join(save_path, "indiv_%s" % indiv_key)
         indiv_param_list = self.print_params(indiv_params)
         try:
             os.makedirs(indiv_path) # TODO Why do I need to make this now? I didn't before....
@@ -373,28 +524,16 @@ class GridSearch:
             cdir = os.path.join(indiv_path, cfile)
             if os.path.isfile(cdir):
                 os.remove(cdir)
-        return [mycv_rmse, mycv_stats]
+        return
 
     def get_best_indivs(self):
         how_many = min(self.num_bests, len(self.pop_rmses.keys()))
         if how_many < self.num_bests:
             logger.info("Only %i best values will be returned because population size is limited to %i." % (how_many, how_many))
-        largeval=1e10
-        lowest = list()
-        params = copy.deepcopy(self.pop_params)
-        rmses = copy.deepcopy(self.pop_rmses)
-        lct=0
-        while lct < how_many:
-            minval = largeval
-            minikey = None
-            for ikey in rmses.keys():
-                ival = rmses[ikey]
-                if ival < minval:
-                    minval = ival
-                    minikey = ikey
-            lowest.append((minikey, rmses[minikey], params[minikey]))
-            rmses[minikey]=largeval
-            lct = lct + 1
+        # A stable sort keeps the population order between equal RMSEs. Dropped individuals have an infinite RMSE, so
+        # they come last
+        ranked = sorted(self.pop_rmses.keys(), key=lambda ikey: self.pop_rmses[ikey])
+        lowest = [(ikey, self.pop_rmses[ikey], copy.deepcopy(self.pop_params[ikey])) for ikey in ranked[:how_many]]
         self.readme_list.append("----Minimum RMSE params----\n")
         for lowitem in lowest:
             self.readme_list.append("%s: %3.3f, %s\n" % (lowitem[0],lowitem[1],lowitem[2]))
@@ -424,7 +563,7 @@ class GridSearch:
         return
 
     def print_best_dataframe(self):
-        best_dh = copy.deepcopy(self.testing_dataset)
+        best_dh = self.testing_dataset.view()
         best_df = self.get_afm_updated_dataset(best_dh.data, self.best_params)
         namestr = "best_params_updated_dataframe.csv"
         updated_name = os.path.join(self.save_path,namestr)
@@ -443,11 +582,11 @@ class GridSearch:
                         starting_dataframe = indiv_df,
                         addl_feature_method_kwargs = dict(afm_kwargs))
 
-            indiv_df[afm] = feature_data
+            set_column(indiv_df, afm, feature_data)
         return indiv_df
 
     def get_indiv_datahandler(self, indiv_params):
-        indiv_dh = copy.deepcopy(self.testing_dataset)
+        indiv_dh = self.testing_dataset.view()
         indiv_dataframe = self.get_afm_updated_dataset(indiv_dh.data, indiv_params)
         indiv_dh.data = indiv_dataframe
         for afm in indiv_params.keys():
@@ -643,6 +782,11 @@ class GridSearch:
             self.plot_3d_rmse_heatmap(self.opt_param_list)
         return
 
+    def get_plot_rmses(self):
+        """RMSEs of the flattened results to plot, where the individuals dropped after their first folds are missing
+        """
+        return self.flat_results['rmse'].astype(float).replace(np.inf, np.nan)
+
     def is_log_param(self, col):
         """Check to see if flattened column was a log parameter
         """
@@ -683,7 +827,7 @@ class GridSearch:
             strings = list(set(xdata))
             mapping = {string: i for i,string in enumerate(strings)}
             xdata = xdata.map(lambda s: mapping[s])
-        plot_helper.plot_3d_heatmap(xdata, ydata, zdata, self.flat_results['rmse'], savepath,
+        plot_helper.plot_3d_heatmap(xdata, ydata, zdata, self.get_plot_rmses(), savepath,
                                     xlabel, ylabel, zlabel, 'rmse')
         self.readme_list.append("Plot %s.png created\n" % plotlabel)
 
@@ -706,7 +850,7 @@ class GridSearch:
 
         plotlabel = "rmse_heatmap"
         savepath = os.path.join(self.save_path, f'{plotlabel}.png')
-        plot_helper.plot_2d_heatmap(xdata, ydata, self.flat_results['rmse'], savepath, xlabel, ylabel, 'rmse')
+        plot_helper.plot_2d_heatmap(xdata, ydata, self.get_plot_rmses(), savepath, xlabel, ylabel, 'rmse')
         self.readme_list.append("Plot %s.png created\n" % plotlabel)
         return
 
@@ -739,7 +883,7 @@ class GridSearch:
 
         plotlabel="rmse_vs_%s" % col
         savepath = os.path.join(self.save_path, f'{plotlabel}.png')
-        plot_helper.plot_1d_heatmap(xdata, self.flat_results['rmse'], savepath)
+        plot_helper.plot_1d_heatmap(xdata, self.get_plot_rmses(), savepath)
         self.readme_list.append("Plot %s.png created\n" % plotlabel)
         return
 
@@ -3,42 +3,86 @@ from copy import copy
 
 from sklearn.model_selection import train_test_split
 
-def climb_hill(model_constructor, X, y, param_dict, score_func, num_steps=100, num_restarts=5):
-    pairs = []
-    for _ in range(num_restarts):
+from .. import parallel
+
+def climb_hill(model_constructor, X, y, param_dict, score_func, num_steps=100, num_restarts=5, num_proposals=1,
+               processors=1):
+    """
+    Random-restart hill climbing over the values of param_dict. Each step tries num_proposals random neighbors of
+    the best parameters so far and keeps the best of them if it beats them. Neighbors already scored on the current
+    train/test split (which is redrawn every 10 steps) are not fit again.
+
+    Args:
+        model_constructor (class): sklearn model class
+        X (dataframe): X data
+        y (series): y data
+        param_dict (dict): dict of parameter name to list of values to climb over
+        score_func (function): score_func(y_true, y_pred), greater is better
+        num_steps (int): number of steps of each climb
+        num_restarts (int): number of climbs from random starting parameters
+        num_proposals (int): number of neighbors tried at each step
+        processors (int): number of processes to run the climbs on, or to fit the neighbors of a step on when
+            there is a single climb
+
+    Returns:
+        (best score, best parameters) of the best climb
+    """
+    non_singleton_params = [param for param in param_dict if len(param_dict[param]) > 1]
+
+    def score_params(params, data):
+        X_train, X_test, y_train, y_test = data
+        model = model_constructor(**params)
+        model.fit(X_train, y_train)
+        y_pred = model.predict(X_test)
+        return score_func(y_test, y_pred)
+
+    def climb(seed):
+        # Each climb has its own random generator, so climbs are independent in whichever process they run
+        rng = random.Random(seed)
         best_score = -float('inf')
-        best_params = {key: random.choice(values) for key,values in param_dict.items()}
-        non_singleton_params = [param for param in param_dict if len(param_dict[param]) > 1]
-        X_train, X_test, y_train, y_test = train_test_split(X, y)
-        for step in range(100):
-            print(f"Step {step}/100")
+        best_params = {key: rng.choice(values) for key,values in param_dict.items()}
+        for step in range(num_steps):
+            print(f"Step {step}/{num_steps}")
             if step % 10 == 0:
-                X_train, X_test, y_train, y_test = train_test_split(X, y)
-            # get random subset of parameters
-            params = copy(best_params)
-            subset = random_subset(non_singleton_params)
-            params.update((key, random.choice(param_dict[key])) for key in subset)
-            model = model_constructor(**params)
-            model.fit(X_train, y_train)
-            y_pred = model.predict(X_test)
-            score = score_func(y_test, y_pred)
-            if score > best_score:
-                best_score = score
-                best_params = params
-        pairs.append((best_score, best_params))
+                data = train_test_split(X, y, random_state=rng.randrange(2**32))
+                # scores of the parameters tried on this split
+                visited = dict()
+            # get random subsets of parameters
+            proposals = dict()
+            for _ in range(num_proposals):
+                params = copy(best_params)
+                subset = random_subset(non_singleton_params, rng)
+                params.update((key, rng.choice(param_dict[key])) for key in subset)
+                key = _params_key(params)
+                if key not in visited:
+                    proposals[key] = params
+            scores = parallel.parallel_map(lambda params: score_params(params, data), proposals.values(),
+                                           n_jobs=processors, backend='processes')
+            visited.update(zip(proposals, scores))
+            for params, score in zip(proposals.values(), scores):
+                if score > best_score:
+                    best_score = score
+                    best_params = params
+        return best_score, best_params
+
+    seeds = [random.randrange(2**32) for _ in range(num_restarts)]
+    pairs = parallel.parallel_map(climb, seeds, n_jobs=processors, backend='processes')
     return max(pairs, key=lambda pair: pair[0])
 
-def random_subset(list1):
-    return random.sample(list1, random_power(len(list1)))
+def _params_key(params):
+    return tuple(sorted((key, repr(value)) for key, value in params.items()))
+
+def random_subset(list1, rng=random):
+    return rng.sample(list1, random_power(len(list1), rng))
 
-def random_power(n):
+def random_power(n, rng=random):
     """
     Random number from 1 to n.
     1 is the most likely, 2 is half as likely, 3 is a third as likely, etc
     """
     total = sum(1/i for i in range(1,n+1))
     cumulative_probability = 0
-    r = random.random()
+    r = rng.random()
     for i in range(1,n+1):
         cumulative_probability += 1 / (i * total)
         if r <= cumulative_probability:
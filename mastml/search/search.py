@@ -23,18 +23,20 @@ log = logging.getLogger('mastml')
 grid_search_user_params = [ # parameters to GridSearch initializer which user has permission to set
     'param_strings', 'model', 'xlabel', 'ylabel', 'fix_random_for_testing',
     'num_cvtests', 'mark_outlying_points', 'num_folds', 'percent_leave_out',
-    'processors', 'pop_upper_limit', 'num_bests',
+    'processors', 'pop_upper_limit', 'num_bests', 'fold_processors', 'early_abort_folds',
+    'fitness_cache_path',
 ]
 
 genetic_search_user_params = [ # parameters to GeneticSearch initializer which user has permission to set
     'param_strings', 'model', 'num_folds', 'percent_leave_out', 'num_cvtests',
     'mark_outlying_points', 'num_bests', 'fix_random_for_testing', 'processors', 'pop_upper_limit',
     'num_gas', 'ga_pop_size', 'convergence_generations', 'max_generations', 'crossover_prob',
-    'mutation_prob', 'shift_prob', 'gen_tol',
+    'mutation_prob', 'shift_prob', 'gen_tol', 'fold_processors', 'early_abort_folds',
+    'fitness_cache_path',
 ]
 
 hill_climbing_user_params = [
-    'model', 'score_func', 'num_steps', 'num_restarts'
+    'model', 'score_func', 'num_steps', 'num_restarts', 'num_proposals', 'processors'
 ]
 
 def parse_conf_file(filepath):
@@ -80,6 +80,10 @@ setup(
         "traitlets==4.3.2",
         "urllib3==1.23",
     ],
+    extras_require={
+        # Columnar result store, see [GeneralSetup] result_format
+        "results": ["pyarrow>=0.11"],
+    },
     author="MAST Development Team, University of Wisconsin-Madison Computational Materials Group",
     author_email="ddmorgan@wisc.edu",
     url="https://github.com/uw-cmg/MAST-ML",
@@ -1,5 +1,11 @@
-from mastml.legos.data_splitters import LeaveCloseCompositionsOut
-from unittest import TestCase
+import os
+from unittest import TestCase, mock
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from mastml.legos import data_splitters
+from mastml.legos.data_splitters import LeaveCloseCompositionsOut, LeaveCloseCompositionGroupsOut
 
 
 class TestSplitters(TestCase):
@@ -20,3 +26,60 @@ class TestSplitters(TestCase):
         train_inds, test_inds = zip(*splitter.split(X))
         self.assertEqual(train_inds[0].tolist(), list(range(2, 11)))  # 1 is too close
         self.assertEqual(train_inds[1].tolist(), list(range(3, 11)))  # 0 and 2 are too close
+
+    def test_close_comp_groups(self):
+        # Make entries at a 10% spacing, with repeated measurements of Al1Cu9 and Al5Cu5
+        X = ['Al{}Cu{}'.format(i, 10-i) for i in range(11)] + ['Al1Cu9', 'Al1Cu9', 'Al5Cu5']
+
+        # Repeated compositions are tested together
+        splitter = LeaveCloseCompositionGroupsOut(dist_threshold=0.05)
+        self.assertEqual(splitter.get_n_splits(X), 11)
+        train_inds, test_inds = zip(*splitter.split(X))
+        self.assertEqual(test_inds[1], [1, 11, 12])
+        self.assertEqual(test_inds[5], [5, 13])
+        self.assertEqual(train_inds[1].tolist(), [0] + list(range(2, 11)) + [13])
+
+        # Entries close to any entry of the test group are left out of the training set
+        splitter.dist_threshold = 0.25
+        splitter.nn_kwargs = {'metric': 'l1'}
+        train_inds, test_inds = zip(*splitter.split(X))
+        self.assertEqual(train_inds[1].tolist(), list(range(3, 11)) + [13])
+
+    def test_grouping_reused(self):
+        # get_n_splits and split of the same compositions featurize and group them once
+        X = ['Al{}Cu{}'.format(i, 10-i) for i in range(11)] + ['Al1Cu9']
+        splitter = LeaveCloseCompositionGroupsOut(dist_threshold=0.05)
+        with mock.patch.object(data_splitters, 'element_fractions', wraps=data_splitters.element_fractions) as fracs, \
+             mock.patch.object(data_splitters, 'connected_components',
+                               wraps=data_splitters.connected_components) as components:
+            n_splits = splitter.get_n_splits(X)
+            self.assertEqual(len(list(splitter.split(X))), n_splits)
+            self.assertEqual((fracs.call_count, components.call_count), (1, 1))
+
+            # Other compositions or parameters are grouped again
+            splitter.get_n_splits(X[:-1])
+            splitter.group_threshold = 0.15
+            self.assertEqual(splitter.get_n_splits(X[:-1]), 1)
+            self.assertEqual((fracs.call_count, components.call_count), (3, 3))
+
+    def test_element_fractions_cache(self):
+        X = ['Al{}Cu{}'.format(i, 10-i) for i in range(11)]
+        expected = data_splitters.element_fractions(X)
+        with TemporaryDirectory() as tmpdir:
+            cache_path = os.path.join(tmpdir, 'splitter_cache.sqlite')
+            data_splitters._element_fractions_cache.clear()
+            np.testing.assert_array_equal(data_splitters.element_fractions(X, cache_path), expected)
+
+            # A new process (with nothing in memory) reads the vectors from the cache file
+            data_splitters._element_fractions_cache.clear()
+            with mock.patch.object(data_splitters.ElementFraction, 'featurize_many',
+                                   side_effect=AssertionError('featurized again')):
+                np.testing.assert_array_equal(data_splitters.element_fractions(X, cache_path), expected)
+
+    def test_element_fractions_memory_bound(self):
+        X = ['Al{}Cu{}'.format(i, 10-i) for i in range(11)]
+        data_splitters._element_fractions_cache.clear()
+        with mock.patch.object(data_splitters, '_ELEMENT_FRACTIONS_CACHE_SIZE', 4):
+            data_splitters.element_fractions(X)
+            # The compositions used last are kept
+            self.assertEqual(list(data_splitters._element_fractions_cache), X[-4:])
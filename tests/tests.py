@@ -5,18 +5,37 @@ import logging
 import textwrap
 import nbformat
 import inspect
+import os
+import sys
+import pickle
+import time
+import shutil
+import threading
+from unittest import mock
 from io import StringIO
 from pprint import pprint
-from tempfile import NamedTemporaryFile
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 import numpy as np
 import pandas as pd
-
-from mastml import plot_helper, conf_parser, metrics
+import sklearn.metrics
+from configobj import ConfigObj
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from mastml import (plot_helper, conf_parser, metrics, data_loader, parallel, result_store, background_writer,
+                    render, html_helper)
 import mastml.utils
+import mastml.cache
 from mastml.legos import feature_generators
 from mastml.legos.randomizers import Randomizer
 from mastml.legos.feature_normalizers import MeanStdevScaler
+from mastml.search.grid_search import GridSearch
+from mastml.search.data_handler import DataHandler, set_column
+from mastml.search.hill_climbing import climb_hill
 
 #mastml.utils.activate_logging()
 
@@ -86,6 +105,508 @@ class TestFeatureSelectionDefaults(unittest.TestCase):
                 string_to_filename(self.regress_conf))
         pprint(conf)
 
+class TestConfParser(unittest.TestCase):
+
+    def test_full_input_file_general_setup(self):
+        # The full input file lists classifiers and regressors alike, so only its [GeneralSetup] is parsed, with one
+        # model. Its metrics line is a placeholder
+        full_conf = ConfigObj('tests/conf/MASTML_fullinputfile.conf')
+        conf = ConfigObj()
+        conf['GeneralSetup'] = full_conf['GeneralSetup']
+        conf['GeneralSetup']['metrics'] = 'Auto'
+        conf['Models'] = {'Ridge': {}}
+        conf.filename = string_to_filename('')
+        conf.write()
+
+        GS = conf_parser.parse_conf_file(conf.filename)['GeneralSetup']
+        self.assertEqual(GS['chunksize'], 100000)
+        self.assertEqual(GS['float_dtype'], 'float64')
+        self.assertEqual(GS['write_queue_size'], 16)
+        self.assertEqual(GS['n_jobs'], 1)
+
+    def test_bad_chunksize(self):
+        for chunksize in ['lots', '0']:
+            conf = string_to_filename(f'''
+                [GeneralSetup]
+                    chunksize = {chunksize}
+                [Models]
+                    [[Ridge]]
+            ''')
+            with self.assertRaises(mastml.utils.InvalidConfParameters):
+                conf_parser.parse_conf_file(conf)
+
+class TestDataLoader(unittest.TestCase):
+    conf = '''
+        [GeneralSetup]
+            input_features = width, height
+            target_feature = strength
+            validation_columns = is_validation
+            chunksize = 2
+            float_dtype = float32
+        [FeatureGeneration]
+            [[Magpie]]
+                composition_feature = MaterialComp
+        [Models]
+            [[Ridge]]
+    '''
+
+    data = textwrap.dedent('''\
+        MaterialComp,width,height,is_validation,unused,strength
+        Al2O3,1.5,2,0,a,10.1
+        NaCl,2.5,3,0,b,11.2
+        Fe2O3,3.5,4,1,c,12.3
+        CuO,4.5,5,0,d,13.4
+        MgO,5.5,6,1,e,14.5
+    ''')
+
+    def test_columnar_loader(self):
+        conf = conf_parser.parse_conf_file(string_to_filename(self.conf))
+        extra_columns = conf_parser.get_extra_columns(conf)
+        GS = conf['GeneralSetup']
+        self.assertEqual(extra_columns, ['is_validation', 'MaterialComp'])
+        data_path = string_to_filename(self.data)
+        args = (data_path, GS['input_features'], GS['target_feature'], GS['grouping_feature'], GS['not_input_features'])
+
+        df, X, X_noinput, X_grouped, y = data_loader.load_data(*args, extra_features=extra_columns)
+        df_, X_, X_noinput_, X_grouped_, y_ = data_loader.load_data(*args, extra_features=extra_columns,
+                                                                    chunksize=GS['chunksize'],
+                                                                    float_dtype=GS['float_dtype'])
+
+        self.assertEqual(X_.dtypes.tolist(), [np.float32, np.float32])
+        self.assertTrue(np.allclose(X.values, X_.values))
+        self.assertEqual(y.tolist(), y_.tolist())
+        # Only the columns named by the conf file are kept, with the same values as the eager loader
+        self.assertEqual(sorted(df_.columns), ['MaterialComp', 'height', 'is_validation', 'width'])
+        for column in ['MaterialComp', 'is_validation']:
+            self.assertEqual(df[column].tolist(), df_[column].tolist())
+
+class TestMetrics(unittest.TestCase):
+
+    def assert_scores(self, scores, expected):
+        self.assertEqual(list(scores), list(expected))
+        for name in expected:
+            self.assertAlmostEqual(scores[name], expected[name], places=10, msg=name)
+
+    def test_regression(self):
+        from sklearn.linear_model import LinearRegression
+        rng = np.random.RandomState(0)
+        y = rng.normal(size=60)
+        pred = y + rng.normal(scale=0.3, size=60)
+        train_y = rng.normal(scale=2, size=100)
+        names = ['explained_variance', 'mean_absolute_error', 'mean_squared_error', 'median_absolute_error',
+                 'root_mean_squared_error', 'R2', 'R2_noint', 'rmse_over_stdev', 'R2_adjusted']
+        metrics_dict = metrics.check_and_fetch_names(names, is_classification=False)
+        # Each of several splits, with predictions as a column as some models give them
+        for test_indices in np.array_split(rng.permutation(60), 3):
+            y_true, y_pred = y[test_indices], pred[test_indices].reshape(-1, 1)
+            r2 = LinearRegression().fit(y_true.reshape(-1, 1), y_pred).score(y_true.reshape(-1, 1), y_pred)
+            expected = OrderedDict([
+                ('explained_variance', sklearn.metrics.explained_variance_score(y_true, y_pred)),
+                ('mean_absolute_error', sklearn.metrics.mean_absolute_error(y_true, y_pred)),
+                ('mean_squared_error', sklearn.metrics.mean_squared_error(y_true, y_pred)),
+                ('median_absolute_error', sklearn.metrics.median_absolute_error(y_true, y_pred)),
+                ('root_mean_squared_error', sklearn.metrics.mean_squared_error(y_true, y_pred)**0.5),
+                ('R2', r2),
+                ('R2_noint', LinearRegression(fit_intercept=False).fit(y_true.reshape(-1, 1), y_pred)
+                                                                  .score(y_true.reshape(-1, 1), y_pred)),
+                ('rmse_over_stdev', sklearn.metrics.mean_squared_error(y_true, y_pred)**0.5 / np.std(train_y)),
+                ('R2_adjusted', 1 - (1-r2)*(len(y_true)-1)/(len(y_true)-3-1)),
+            ])
+            self.assert_scores(metrics.compute_metrics(metrics_dict, y_true, y_pred, train_y=train_y, n_features=3),
+                               expected)
+
+    def test_classification(self):
+        rng = np.random.RandomState(0)
+        names = ['accuracy'] + [f'{score}_{average}' for score in ['precision', 'recall', 'f1']
+                                for average in ['binary', 'macro', 'micro', 'weighted']]
+        metrics_dict = metrics.check_and_fetch_names(names, is_classification=True)
+        for n_labels in [2, 4]:
+            y = rng.randint(n_labels, size=90)
+            pred = np.where(rng.rand(90) < 0.7, y, rng.randint(n_labels, size=90))
+            for test_indices in np.array_split(rng.permutation(90), 3):
+                y_true, y_pred = y[test_indices], pred[test_indices]
+                expected = OrderedDict([('accuracy', sklearn.metrics.accuracy_score(y_true, y_pred))])
+                for score, function in [('precision', sklearn.metrics.precision_score),
+                                        ('recall', sklearn.metrics.recall_score), ('f1', sklearn.metrics.f1_score)]:
+                    for average in ['binary', 'macro', 'micro', 'weighted']:
+                        if average == 'binary' and n_labels > 2:
+                            # scikit-learn refuses binary averages of more than 2 labels, and so does compute_metrics
+                            continue
+                        expected[f'{score}_{average}'] = function(y_true, y_pred, average=average)
+                scores = metrics.compute_metrics(
+                    OrderedDict((name, metrics_dict[name]) for name in expected), y_true, y_pred)
+                self.assert_scores(scores, expected)
+            if n_labels > 2:
+                with self.assertRaises(ValueError):
+                    metrics.compute_metrics({'f1_binary': metrics_dict['f1_binary']}, y_true, y_pred)
+
+    def test_classification_missing_labels(self):
+        # Labels that are never predicted (or never true) score 0, as in scikit-learn
+        y_true = np.array([0, 0, 1, 1, 2, 2])
+        y_pred = np.array([0, 0, 0, 1, 1, 3])
+        names = [f'{score}_{average}' for score in ['precision', 'recall', 'f1']
+                 for average in ['macro', 'micro', 'weighted']]
+        metrics_dict = metrics.check_and_fetch_names(names, is_classification=True)
+        expected = OrderedDict()
+        for name in names:
+            score, average = name.split('_')
+            function = {'precision': sklearn.metrics.precision_score, 'recall': sklearn.metrics.recall_score,
+                        'f1': sklearn.metrics.f1_score}[score]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                expected[name] = function(y_true, y_pred, average=average)
+        self.assert_scores(metrics.compute_metrics(metrics_dict, y_true, y_pred), expected)
+
+class TestParallel(unittest.TestCase):
+
+    def test_parallel_map_order(self):
+        # Later items finish first, but the results come back in the order of the items
+        def slow_square(i):
+            time.sleep(0.05 * (4 - i))
+            return i * i
+        for backend in parallel.BACKENDS:
+            self.assertEqual(parallel.parallel_map(slow_square, range(5), n_jobs=3, backend=backend), [0, 1, 4, 9, 16])
+
+    def test_nested_processes(self):
+        # Pool workers are daemonic, so a parallel_map inside one runs serially in the worker
+        def inner(i):
+            return parallel.parallel_map(lambda j: os.getpid(), range(3), n_jobs=3, backend='processes')
+        for pids in parallel.parallel_map(inner, range(2), n_jobs=2, backend='processes'):
+            self.assertEqual(len(set(pids)), 1)
+            self.assertNotEqual(pids[0], os.getpid())
+
+    def test_check_backend(self):
+        self.assertEqual(parallel.check_backend('4', 'threads'), (4, 'threads'))
+        self.assertEqual(parallel.check_backend(-1, 'serial'), (os.cpu_count(), 'serial'))
+        for n_jobs, backend in [('many', 'threads'), (0, 'threads'), (-2, 'threads'), (2, 'dask')]:
+            with self.assertRaises(mastml.utils.InvalidConfParameters):
+                parallel.check_backend(n_jobs, backend)
+
+    def test_threads_backend_plots_on_main_thread(self):
+        from mastml import mastml_driver
+        conf = textwrap.dedent('''
+            [GeneralSetup]
+                input_features = Auto
+                target_feature = y
+                n_jobs = 3
+                backend = threads
+            [DataSplits]
+                [[KFold]]
+                    n_splits = 3
+            [Models]
+                [[RandomForestRegressor]]
+                    n_estimators = 5
+            [PlotSettings]
+                predicted_vs_true = False
+                predicted_vs_true_bars = False
+                best_worst_per_point = False
+                feature_vs_target = False
+                average_error_plots = False
+                target_histogram = False
+                error_plots = True
+        ''')
+        rng = np.random.RandomState(0)
+        data = pd.DataFrame(rng.rand(30, 3), columns=['a', 'b', 'c'])
+        data['y'] = data.sum(axis=1)
+
+        plot_threads = list()
+        def make_plots(run, path, *args, **kwargs):
+            plot_threads.append((run['split_num'], threading.current_thread()))
+        with TemporaryDirectory() as outdir, mock.patch.object(plot_helper, 'make_error_plots', make_plots), \
+                mock.patch.object(plot_helper, 'make_train_test_plots', make_plots):
+            with open(os.path.join(outdir, 'threads.conf'), 'w') as f:
+                f.write(conf)
+            data.to_csv(os.path.join(outdir, 'data.csv'), index=False)
+            mastml_driver.main(os.path.join(outdir, 'threads.conf'), os.path.join(outdir, 'data.csv'),
+                               os.path.join(outdir, 'results'))
+        # The train/test plots and the error plots of each split, none of them on a worker or the writer thread
+        self.assertEqual(sorted(split_num for split_num, thread in plot_threads), [0, 0, 1, 1, 2, 2])
+        self.assertTrue(all(thread is threading.main_thread() for split_num, thread in plot_threads))
+
+class TestCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        with TemporaryDirectory() as tmpdir:
+            # Room for two of the ~1 kB values
+            cache = mastml.cache.DiskCache(os.path.join(tmpdir, 'cache.sqlite'), max_size_mb=0.0025)
+            for key in ['a', 'b']:
+                cache.put(key, b'x' * 1000)
+                time.sleep(0.01)
+            self.assertEqual(cache.get('a'), b'x' * 1000)
+            time.sleep(0.01)
+            # b is now the least recently used entry
+            cache.put('c', b'x' * 1000)
+            self.assertEqual(sorted(cache.get_many(['a', 'b', 'c'])), ['a', 'c'])
+
+    def test_ttl_expiry(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'cache.sqlite')
+            cache = mastml.cache.DiskCache(path, namespace='short', ttl=0.2)
+            other = mastml.cache.DiskCache(path, namespace='long')
+            cache.put('a', 1)
+            other.put('a', 2)
+            self.assertEqual(cache.get('a'), 1)
+            time.sleep(0.3)
+            self.assertIsNone(cache.get('a'))
+            # Entries of other namespaces keep their own expiry
+            self.assertEqual(other.get('a'), 2)
+
+    def test_open_cache(self):
+        for path in [None, 'None', '']:
+            self.assertIsNone(mastml.cache.open_cache(path))
+        with TemporaryDirectory() as tmpdir:
+            self.assertIsInstance(mastml.cache.open_cache(os.path.join(tmpdir, 'cache.sqlite')), mastml.cache.DiskCache)
+
+    def test_cached_magpie(self):
+        # Datasets with and without sublattices share the cache, and always give the same frame as an uncached run
+        with TemporaryDirectory() as tmpdir:
+            cache_path = os.path.join(tmpdir, 'magpie.sqlite')
+            for compositions in [['NaCl', 'MgO'], ['[Na][Cl]', 'NaCl'], ['NaCl', '[Mg][O]', 'MgO']]:
+                df = pd.DataFrame({'MaterialComp': compositions})
+                uncached = feature_generators.Magpie('MaterialComp').fit(df).transform(df)
+                cached = feature_generators.Magpie('MaterialComp', cache_path=cache_path).fit(df).transform(df)
+                pd.testing.assert_frame_equal(uncached, cached)
+
+class TestResultStore(unittest.TestCase):
+
+    def test_check_result_format(self):
+        self.assertEqual(result_store.check_result_format('csv'), 'csv')
+        with self.assertRaises(mastml.utils.InvalidConfParameters):
+            result_store.check_result_format('hdf5')
+        # Without pyarrow only csv is available
+        with mock.patch.dict(sys.modules, {'pyarrow': None}):
+            self.assertEqual(result_store.check_result_format('csv'), 'csv')
+            for result_format in ['parquet', 'arrow']:
+                with self.assertRaises(mastml.utils.InvalidConfParameters):
+                    result_store.check_result_format(result_format)
+
+    @unittest.skipIf(pyarrow is None, 'needs pyarrow')
+    def test_round_trip(self):
+        X = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0, 5.0], 'b': [0.5, 0.4, 0.3, 0.2, 0.1]})
+        X_noinput = pd.DataFrame({'name': ['p', 'q', 'r', 's', 't']})
+        y = pd.Series([10.0, 20.0, 30.0, 40.0, 50.0], name='y')
+        train_indices, test_indices = np.array([0, 2, 3]), np.array([4, 1])
+        train_pred, test_pred = np.array([11.0, 29.0, 41.0]), np.array([52.0, 18.0])
+        # The csv views a csv run writes for the split
+        expected = {'train': pd.concat([X.loc[train_indices], y.loc[train_indices],
+                                        pd.DataFrame(train_pred, columns=['train_pred'], index=train_indices),
+                                        X_noinput.loc[train_indices]], axis=1),
+                    'test': pd.concat([X.loc[test_indices], y.loc[test_indices],
+                                       pd.DataFrame(test_pred, columns=['test_pred'], index=test_indices),
+                                       X_noinput.loc[test_indices]], axis=1)}
+
+        for result_format in ['parquet', 'arrow']:
+            with TemporaryDirectory() as outdir:
+                split_path = os.path.join(outdir, 'DoNothing', 'DoNothing', 'Ridge', 'KFold', 'split_0')
+                os.makedirs(split_path)
+                stage_path = result_store.write_stage(os.path.join(outdir, 'DoNothing', 'DoNothing', 'selected'),
+                                                      X, X_noinput, y, result_format)
+                self.assertTrue(stage_path.endswith(result_store.EXTENSIONS[result_format]))
+                result_store.write_split(split_path, stage_path, train_indices, train_pred, test_indices, test_pred,
+                                         result_format)
+
+                for kind in ['train', 'test']:
+                    pd.testing.assert_frame_equal(result_store.read_split(split_path, kind), expected[kind])
+                result_store.export_csv(split_path)
+                for kind in ['train', 'test']:
+                    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(split_path, kind+'.csv')),
+                                                  expected[kind].reset_index(drop=True))
+
+    def test_read_split_without_predictions(self):
+        with TemporaryDirectory() as split_path:
+            with self.assertRaises(mastml.utils.FileNotFoundError):
+                result_store.read_split(split_path)
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_order_and_flush(self):
+        done = list()
+        def task(i):
+            # Earlier tasks are slower, but still finish first
+            time.sleep(0.01 * (5 - i))
+            done.append((i, threading.current_thread().name))
+        writer = background_writer.BackgroundWriter(max_pending=2)
+        for i in range(5):
+            writer.submit(task, i)
+        writer.flush()
+        self.assertEqual(done, [(i, 'mastml-writer') for i in range(5)])
+        writer.submit(task, 5)
+        writer.close()
+        self.assertEqual(len(done), 6)
+
+    def test_error(self):
+        def fail():
+            raise ValueError('disk full')
+        writer = background_writer.BackgroundWriter()
+        writer.submit(fail)
+        with self.assertRaises(ValueError):
+            writer.flush()
+        # The error is raised again to whoever uses the writer next
+        with self.assertRaises(ValueError):
+            writer.submit(print)
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def test_synchronous(self):
+        threads = list()
+        writer = background_writer.BackgroundWriter(max_pending=0)
+        writer.submit(lambda: threads.append(threading.current_thread()))
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertIsNone(writer._thread)
+        writer.close()
+        self.assertEqual(background_writer.check_queue_size('0'), 0)
+        with self.assertRaises(mastml.utils.InvalidConfParameters):
+            background_writer.check_queue_size('-1')
+
+    def test_after_fork(self):
+        # A forked worker has no writer thread, so it writes right away and can close the writer without hanging
+        writer = background_writer.BackgroundWriter()
+        writer.submit(time.sleep, 0)
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'thread.txt')
+            def write_thread_name():
+                with open(path, 'w') as f:
+                    f.write(threading.current_thread().name)
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    writer.submit(write_thread_name)
+                    writer.close()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            with open(path) as f:
+                self.assertEqual(f.read(), threading.current_thread().name)
+        writer.close()
+
+    def test_dump_model(self):
+        from sklearn.linear_model import Ridge
+        model = Ridge().fit([[0.0], [1.0]], [0.0, 2.0])
+        coef = model.coef_[0]
+        with TemporaryDirectory() as tmpdir:
+            with background_writer.BackgroundWriter() as writer:
+                writer.dump_model(model, os.path.join(tmpdir, 'Ridge.pkl'))
+                # Refitting right away doesn't change the saved model
+                model.fit([[0.0], [1.0]], [0.0, 4.0])
+            from sklearn.externals import joblib
+            self.assertEqual(joblib.load(os.path.join(tmpdir, 'Ridge.pkl')).coef_[0], coef)
+
+class TestRender(unittest.TestCase):
+
+    def test_record_and_render(self):
+        # A relative outdir, as given on the command line, is recorded and rendered in place
+        y_true = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        y_pred = np.array([1.1, 1.9, 3.2, 3.8, 5.3, 5.9])
+        stats = {'rmse': 0.2}
+        cwd = os.getcwd()
+        with TemporaryDirectory() as tmpdir:
+            os.chdir(tmpdir)
+            try:
+                os.makedirs(os.path.join('results', 'split_0'))
+                render.defer_plots('results', notebooks='off')
+                plot_helper.plot_residuals_histogram(y_true, y_pred, os.path.join('results', 'split_0', 'residuals.png'),
+                                                     stats)
+                plot_helper.plot_target_histogram(pd.Series(y_true, name='y'),
+                                                  os.path.join('results', 'target_histogram.png'))
+                plot_helper.plot_residuals_histogram(y_true, y_pred, os.path.abspath(os.path.join('results', 'abs.png')),
+                                                     stats)
+                render.defer_plots(None)
+                self.assertEqual(len(os.listdir(os.path.join('results', render.MANIFEST_DIRNAME))), 4)
+                self.assertFalse(os.path.exists(os.path.join('results', 'target_histogram.png')))
+
+                self.assertEqual(render.render('results', n_jobs=2), 3)
+                for path in [os.path.join('split_0', 'residuals.png'), 'target_histogram.png', 'abs.png']:
+                    self.assertTrue(os.path.exists(os.path.join('results', path)), path)
+                self.assertFalse(os.path.exists(os.path.join('results', 'results')))
+                self.assertTrue(os.path.exists(os.path.join('results', 'index.html')))
+            finally:
+                render.defer_plots(None)
+                plot_helper.set_notebook_mode('inline')
+                os.chdir(cwd)
+
+    def test_render_without_manifest(self):
+        with TemporaryDirectory() as outdir:
+            with self.assertRaises(mastml.utils.FileNotFoundError):
+                render.render(outdir)
+
+class TestNotebookModes(unittest.TestCase):
+
+    def setUp(self):
+        self.y_true = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        self.y_pred = np.array([1.1, 1.9, 3.2, 3.8, 5.3])
+        self.stats = {'rmse': 0.2}
+
+    def tearDown(self):
+        plot_helper.set_notebook_mode('inline')
+
+    def test_off(self):
+        with TemporaryDirectory() as outdir:
+            plot_helper.set_notebook_mode('off', outdir)
+            savepath = os.path.join(outdir, 'residuals.png')
+            plot_helper.plot_residuals_histogram(self.y_true, self.y_pred, savepath, self.stats)
+            self.assertTrue(os.path.exists(savepath))
+            self.assertEqual([name for name in os.listdir(outdir) if name.endswith(('.ipynb', '.pkl', '.py'))], [])
+
+    def test_inline(self):
+        with TemporaryDirectory() as outdir:
+            plot_helper.set_notebook_mode('inline', outdir)
+            savepath = os.path.join(outdir, 'residuals.png')
+            plot_helper.plot_residuals_histogram(self.y_true, self.y_pred, savepath, self.stats)
+            self.assertEqual(sorted(name for name in os.listdir(outdir) if name.endswith(('.ipynb', '.pkl', '.py'))),
+                             ['residuals.png.ipynb'])
+            source = ''.join(cell['source'] for cell in nbformat.read(savepath + '.ipynb', as_version=4)['cells'])
+            self.assertIn('def plot_residuals_histogram(', source)
+
+    def test_shared(self):
+        with TemporaryDirectory() as outdir:
+            plot_helper.set_notebook_mode('shared', outdir)
+            savepath = os.path.join(outdir, 'residuals.png')
+            plot_helper.plot_residuals_histogram(self.y_true, self.y_pred, savepath, self.stats)
+            self.assertEqual(sorted(name for name in os.listdir(outdir) if name.endswith(('.ipynb', '.pkl', '.py'))),
+                             ['mastml_plots.py', 'residuals.png.args.pkl', 'residuals.png.ipynb'])
+            source = ''.join(cell['source'] for cell in nbformat.read(savepath + '.ipynb', as_version=4)['cells'])
+            self.assertNotIn('def plot_residuals_histogram(', source)
+            args = plot_helper.load_plot_args(savepath + '.args.pkl')
+            np.testing.assert_array_equal(args['y_true'], self.y_true)
+            self.assertEqual(args['stats'], self.stats)
+
+    @unittest.skipIf(pyarrow is None, 'needs pyarrow')
+    def test_shared_references(self):
+        X = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0, 5.0]})
+        y = pd.Series(self.y_true, name='y')
+        train_indices, test_indices = np.array([0, 2, 3]), np.array([4, 1])
+        split_result = {'y_train_true': self.y_true[train_indices], 'y_train_pred': self.y_pred[train_indices],
+                        'train_indices': train_indices, 'y_test_true': self.y_true[test_indices],
+                        'y_test_pred': self.y_pred[test_indices], 'test_indices': test_indices}
+        with TemporaryDirectory() as outdir:
+            split_path = os.path.join(outdir, 'split_0')
+            os.makedirs(split_path)
+            stage_path = result_store.write_stage(os.path.join(outdir, 'selected'), X, pd.DataFrame(index=X.index), y,
+                                                  'parquet')
+            result_store.write_split(split_path, stage_path, train_indices, split_result['y_train_pred'],
+                                     test_indices, split_result['y_test_pred'], 'parquet')
+            run = result_store.reference_split(split_result, split_path, 'y')
+
+            plot_helper.set_notebook_mode('shared', outdir)
+            savepath = os.path.join(split_path, 'test_residuals.png')
+            plot_helper.plot_residuals_histogram(run['y_test_true'], run['y_test_pred'], savepath, self.stats)
+            self.assertTrue(os.path.exists(savepath))
+
+            # Only references to the result files are pickled, which load_plot_args reads back
+            with open(savepath + '.args.pkl', 'rb') as f:
+                stored = pickle.load(f)
+            self.assertEqual(stored['y_true'], {result_store.REFERENCE_KEY: '.', 'kind': 'test', 'column': 'y'})
+            self.assertEqual(stored['y_pred'], {result_store.REFERENCE_KEY: '.', 'kind': 'test', 'column': 'test_pred'})
+            args = plot_helper.load_plot_args(savepath + '.args.pkl')
+            np.testing.assert_array_equal(args['y_true'], split_result['y_test_true'])
+            np.testing.assert_array_equal(args['y_pred'], split_result['y_test_pred'])
+
+            # The references survive pickling for the plot pool and the plot manifest
+            restored = pickle.loads(pickle.dumps(run['test_indices']))
+            self.assertEqual(restored.source, (os.path.abspath(split_path), 'test', None))
+            self.assertIsInstance(result_store.plain_arrays(restored), np.ndarray)
+            self.assertNotIsInstance(result_store.plain_arrays(restored), result_store.StoredArray)
+
 class TestPlotToPython(unittest.TestCase):
     " How to convert a call to plot to a .py file that the user can modify "
     def test_test(self):
@@ -154,6 +675,55 @@ class TestGeneration(unittest.TestCase):
         df = magpie.transform(df)
         df.to_csv('magpie_test.csv')
 
+    def test_magpie_values(self):
+        # Pins the column order and a few values, so saved selectors and models notice when they change. See the
+        # release notes for the changes from earlier versions
+        df = pd.DataFrame({'MaterialComp': ['NaCl', 'Al2O3']})
+        generated = feature_generators.MagpieFeatureGeneration(df, 'MaterialComp').generate_magpie_features()
+        self.assertEqual(generated.columns[:4].tolist(), ['MaterialComp', 'AtomicNumber_composition_average',
+                                                          'AtomicRadii_composition_average',
+                                                          'AtomicVolume_composition_average'])
+        expected = {'GSbandgap_max_value': [2.493, 0.0],
+                    'GSbandgap_min_value': [0.0, 0.0],
+                    'GSbandgap_difference': [2.493, 0.0],
+                    'AtomicWeight_composition_average': [29.221385, 20.392255],
+                    'AtomicWeight_arithmetic_average': [29.221385, 21.490469],
+                    'AtomicWeight_difference': [12.463231, 10.982139]}
+        for column, values in expected.items():
+            self.assertTrue(np.allclose(generated[column].values, values), column)
+
+    def test_magpie_bundle(self):
+        # The shipped bundle must be up to date with the .table files it was compiled from
+        data_path = feature_generators.MAGPIE_DATA_PATH
+        feature_names, table = feature_generators._parse_magpie_tables(data_path)
+        bundle_feature_names, bundle_table = feature_generators._load_magpie_bundle(data_path)
+        self.assertEqual(feature_names, bundle_feature_names)
+        self.assertTrue(np.array_equal(np.isnan(table), np.isnan(bundle_table)))
+        self.assertTrue(np.array_equal(np.nan_to_num(table), np.nan_to_num(bundle_table)))
+
+    def test_magpie_bundle_stale(self):
+        # An edit that keeps the size of a table must still make the bundle stale
+        with TemporaryDirectory() as data_path:
+            for name in os.listdir(feature_generators.MAGPIE_DATA_PATH):
+                if name.endswith('.table'):
+                    shutil.copy(os.path.join(feature_generators.MAGPIE_DATA_PATH, name), data_path)
+            feature_generators.compile_magpie_bundle(data_path)
+            self.assertIsNotNone(feature_generators._load_magpie_bundle(data_path))
+            with open(os.path.join(data_path, 'AtomicNumber.table'), 'r+') as f:
+                f.write('9')
+            self.assertIsNone(feature_generators._load_magpie_bundle(data_path))
+
+    def test_contains_element(self):
+        df = pd.DataFrame({'MaterialComp': ['Al2O3', 'NaCl', 'Al2O3']}, index=[3, 1, 2])
+        has_al = feature_generators.ContainsElement('MaterialComp', 'Al', 'has_Al').transform(df)
+        self.assertEqual(has_al['has_Al'].tolist(), [1, 0, 1])
+        self.assertEqual(has_al.index.tolist(), [3, 1, 2])
+
+        fractions = feature_generators.ContainsElement('MaterialComp', None, None, all_elements=True,
+                                                       fractional=True).transform(df)
+        self.assertEqual(fractions.columns.tolist(), ['fraction_Al', 'fraction_O', 'fraction_Na', 'fraction_Cl'])
+        self.assertTrue(np.allclose(fractions.values, [[0.4, 0.6, 0, 0], [0, 0, 0.5, 0.5], [0.4, 0.6, 0, 0]]))
+
     def test_materials_project(self):
         df = pd.read_csv('tests/csv/common_materials.csv')
         materials_project = feature_generators.MaterialsProject(
@@ -163,6 +733,52 @@ class TestGeneration(unittest.TestCase):
         df = materials_project.transform(df)
         df.to_csv('materials_project.csv')
 
+    def test_materials_project_offline(self):
+        # Recorded responses stand in for the Materials Project API, so this test needs no network
+        class RecordedClient(object):
+            def __init__(self):
+                self.requests = list()
+            def get_data(self, chemsys_formula_id):
+                self.requests.append(chemsys_formula_id)
+                structure_data = {'elasticity': None, 'spacegroup': {'number': 167}, 'formation_energy_per_atom': -3.4,
+                                  'nelements': 2, 'energy_per_atom': -7.5, 'volume': 87.1, 'density': 3.9,
+                                  'total_magnetization': 0.0}
+                return [dict(structure_data, e_above_hull=0.1, band_gap=2.0),
+                        dict(structure_data, e_above_hull=0.0, band_gap=8.8)]
+
+        df = pd.DataFrame({'Material': ['Al2O3', 'NaCl', 'Al2O3']})
+        with NamedTemporaryFile(suffix='.sqlite') as f:
+            for expected_requests in [['Al2O3', 'NaCl'], []]:
+                client = RecordedClient()
+                cache = mastml.cache.DiskCache(f.name, namespace='materials_project')
+                mpg = feature_generators.MaterialsProjectFeatureGeneration(df.copy(), None, 'Material', cache=cache,
+                                                                           client=client)
+                generated = mpg.generate_materialsproject_features()
+                self.assertEqual(sorted(client.requests), expected_requests)
+                self.assertEqual(generated['band_gap'].tolist(), [8.8, 8.8, 8.8])
+
+    def test_citrine_offline(self):
+        # A mock client stands in for Citrination, so this test needs no network
+        class MockClient(object):
+            def __init__(self):
+                self.requests = list()
+            def search(self, composition):
+                self.requests.append(composition)
+                properties = [{'name': 'Band gap', 'scalars': [{'value': value}]} for value in [1.0, 3.0]]
+                return [{'system': {'properties': properties}}] if composition == 'Al2O3' else []
+
+        df = pd.DataFrame({'MaterialComp': ['Al2O3', 'NaCl', 'Al2O3']})
+        with NamedTemporaryFile(suffix='.sqlite') as f:
+            for ttl, expected_requests in [(3600, ['Al2O3', 'NaCl']), (3600, []), (0, ['Al2O3', 'NaCl'])]:
+                client = MockClient()
+                cache = mastml.cache.DiskCache(f.name, namespace='citrine', ttl=ttl)
+                cfg = feature_generators.CitrineFeatureGeneration(df.copy(), None, 'MaterialComp', cache=cache,
+                                                                  client=client)
+                generated = cfg.generate_citrine_features()
+                self.assertEqual(sorted(client.requests), expected_requests)
+                self.assertEqual(generated['Band gap_avg'].tolist()[::2], [2.0, 2.0])
+                self.assertTrue(np.isnan(generated['Band gap_max'][1]))
+
     def test_citrine(self):
         df = pd.read_csv('tests/csv/feature_generation.csv')
         citrine = feature_generators.Citrine(
@@ -334,6 +950,170 @@ class TestHtml(unittest.TestCase):
         #html_helper.make_html('results/classification')
         #html_helper.make_html('results/regression')
 
+    def write_files(self, outdir, paths):
+        for path in paths:
+            os.makedirs(os.path.dirname(os.path.join(outdir, path)), exist_ok=True)
+            with open(os.path.join(outdir, path), 'w') as f:
+                f.write('')
+            html_helper.add_artifact(os.path.join(outdir, path))
+
+    def test_report_from_manifest(self):
+        with TemporaryDirectory() as outdir:
+            html_helper.start_report(outdir)
+            try:
+                self.write_files(outdir, ['log.log', 'target_histogram.png'])
+                combos = [os.path.join('DoNothing', 'DoNothing', model, 'KFold') for model in ['Ridge', 'Lasso']]
+                for combo in combos:
+                    self.write_files(outdir, [os.path.join(combo, 'best_worst_split.png')] +
+                                     [os.path.join(combo, f'split_{split_num}', name) for split_num in range(2)
+                                      for name in ['train_residuals.png', 'test_residuals.png', 'stats.txt']])
+                    # The pages are made from the files added so far, without listing folders or reading the manifest
+                    with mock.patch('os.listdir', side_effect=AssertionError), \
+                         mock.patch.object(html_helper, 'read_manifest', side_effect=AssertionError):
+                        html_helper.add_combo(outdir, os.path.join(outdir, combo), 2)
+                with open(os.path.join(outdir, 'index.html')) as f:
+                    index = f.read()
+                self.assertIn('DoNothing - DoNothing - Ridge - KFold', index)
+                self.assertIn('DoNothing - DoNothing - Lasso - KFold', index)
+                page_path = os.path.join(outdir, html_helper.REPORT_DIRNAME, 'DoNothing__DoNothing__Ridge__KFold.html')
+                with open(page_path) as f:
+                    page = f.read()
+                for path in ['best_worst_split.png', os.path.join('split_1', 'test_residuals.png'),
+                             os.path.join('split_1', 'stats.txt')]:
+                    self.assertIn(os.path.join('..', combos[0], path), page)
+
+                # Only the pages of a combo that got files after it was added are made again
+                self.write_files(outdir, [os.path.join(combos[1], 'split_0', 'train_normalized_error.png')])
+                with mock.patch('os.listdir', side_effect=AssertionError), \
+                     mock.patch.object(html_helper, 'make_combo_pages',
+                                       wraps=html_helper.make_combo_pages) as make_combo_pages:
+                    html_helper.make_html(outdir)
+                self.assertEqual([call[0][1]['path'] for call in make_combo_pages.call_args_list], [combos[1]])
+                with open(os.path.join(outdir, html_helper.REPORT_DIRNAME, 'DoNothing__DoNothing__Lasso__KFold.html')) as f:
+                    self.assertIn('train_normalized_error.png', f.read())
+                with open(os.path.join(outdir, 'index.html')) as f:
+                    index = f.read()
+                self.assertIn('href="log.log"', index)
+                self.assertIn('src="target_histogram.png"', index)
+                self.assertTrue(index.rstrip().endswith('</html>'))
+            finally:
+                html_helper.record_artifacts(None)
+
+    def test_add_plot(self):
+        y_true = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        y_pred = np.array([1.1, 1.9, 3.2, 3.8, 5.3])
+        with TemporaryDirectory() as outdir:
+            html_helper.record_artifacts(outdir)
+            try:
+                plot_helper.plot_residuals_histogram(y_true, y_pred, os.path.join(outdir, 'residuals.png'), {'rmse': 0.2})
+            finally:
+                html_helper.record_artifacts(None)
+                plot_helper.set_notebook_mode('inline')
+            manifest = html_helper.read_manifest(outdir)
+            self.assertEqual(sorted(html_helper.manifest_files(manifest)['']),
+                             ['residual_statistics.csv', 'residuals.csv', 'residuals.png', 'residuals.png.ipynb'])
+
+    def test_walk_without_manifest(self):
+        # Runs made before there was a manifest get their pages from a walk of the output directory
+        with TemporaryDirectory() as outdir:
+            for path in ['log.log', os.path.join('Ridge', 'KFold', 'split_0', 'train_residuals.png'),
+                         os.path.join('Ridge', 'KFold', 'split_0', 'test_residuals.png')]:
+                os.makedirs(os.path.dirname(os.path.join(outdir, path)), exist_ok=True)
+                open(os.path.join(outdir, path), 'w').close()
+            html_helper.make_html(outdir)
+            with open(os.path.join(outdir, html_helper.REPORT_DIRNAME, 'Ridge__KFold.html')) as f:
+                self.assertIn('test_residuals.png', f.read())
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        data = pd.DataFrame(rng.rand(40, 3), columns=['a', 'b', 'c'])
+        data['y'] = data.sum(axis=1) + 0.1*rng.rand(40)
+        self.dh = DataHandler(data, data[['a', 'b', 'c']], data['y'], ['a', 'b', 'c'], 'y')
+        self.tmpdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def evaluate_search(self, name, **kwargs):
+        from sklearn.linear_model import Ridge
+        searcher = GridSearch(['model;alpha;float;discrete;0.001:0.01:0.1:1:10:100:1000'], self.dh, self.dh, Ridge(),
+                              os.path.join(self.tmpdir.name, name), num_folds=4, num_bests=2, **kwargs)
+        searcher.set_up()
+        searcher.evaluate_pop()
+        return searcher
+
+    def test_pool_matches_serial(self):
+        serial = self.evaluate_search('serial')
+        pooled = self.evaluate_search('pooled', processors=2)
+        self.assertIsNone(pooled.pool)
+        self.assertEqual(pooled.pop_rmses, serial.pop_rmses)
+        self.assertEqual(pooled.pop_stats, serial.pop_stats)
+
+    def test_view_set_column(self):
+        original = self.dh.data.copy(deep=True)
+        view = self.dh.view()
+        set_column(view.data, 'a', np.zeros(40))
+        view.add_prediction(np.ones(40))
+        self.assertTrue((view.data['a'] == 0).all())
+        # The parent shares its column arrays with the view, but keeps its own values and columns
+        pd.testing.assert_frame_equal(self.dh.data, original)
+
+    def test_rmse_over_all_folds(self):
+        searcher = self.evaluate_search('folds', fold_processors=2)
+        for ikey, stats in searcher.pop_stats.items():
+            self.assertEqual(len(stats['fold_rmses']), 4)
+            self.assertEqual(searcher.pop_rmses[ikey], np.mean(stats['fold_rmses']))
+
+    def test_early_abort_folds(self):
+        searcher = self.evaluate_search('abort', early_abort_folds=1)
+        aborted = [ikey for ikey, stats in searcher.pop_stats.items() if stats['aborted']]
+        self.assertTrue(aborted)
+        for ikey in aborted:
+            stats = searcher.pop_stats[ikey]
+            self.assertEqual(len(stats['fold_rmses']), 1)
+            self.assertEqual(stats['avg_rmse'], np.mean(stats['fold_rmses']))
+            self.assertEqual(searcher.pop_rmses[ikey], np.inf)
+            self.assertNotIn(searcher.get_fitness_key(searcher.pop_params[ikey]), searcher.fitness_cache)
+        # Dropped individuals rank after every fully evaluated one
+        searcher.get_best_indivs()
+        self.assertFalse(set(ikey for ikey, rmse, params in searcher.best_indivs) & set(aborted))
+        self.assertEqual([rmse for ikey, rmse, params in searcher.best_indivs],
+                         sorted(rmse for rmse in searcher.pop_rmses.values())[:2])
+
+    def test_fitness_cache(self):
+        cache_path = os.path.join(self.tmpdir.name, 'fitness.sqlite')
+        first = self.evaluate_search('first', fitness_cache_path=cache_path)
+        with mock.patch.object(GridSearch, 'evaluate_indiv', side_effect=AssertionError('evaluated again')):
+            # From the memory of the same search, then from the file for a new one
+            first.evaluate_pop()
+            second = self.evaluate_search('second', fitness_cache_path=cache_path)
+        self.assertEqual(second.pop_rmses, first.pop_rmses)
+        # Fitnesses stored for another dataset are not used
+        set_column(self.dh.data, 'y', self.dh.data['y'] * 2)
+        with mock.patch.object(GridSearch, 'evaluate_indiv', return_value=[1.0, {}]) as evaluate_indiv:
+            self.evaluate_search('other', fitness_cache_path=cache_path)
+        self.assertEqual(evaluate_indiv.call_count, 7)
+
+    def test_climb_hill_steps(self):
+        from sklearn.linear_model import ElasticNet
+        param_dict = {'alpha': list(np.linspace(0.001, 1, 1000)), 'l1_ratio': list(np.linspace(0, 1, 1000))}
+        scores = list()
+        def score_func(y_true, y_pred):
+            scores.append(-sklearn.metrics.mean_squared_error(y_true, y_pred))
+            return scores[-1]
+        random.seed(0)
+        serial = climb_hill(ElasticNet, self.dh.input_data, self.dh.target_data, param_dict, score_func,
+                            num_steps=3, num_restarts=2, num_proposals=4)
+        # Every step of every climb scores its proposals, none of which were tried before in so large a space
+        self.assertEqual(len(scores), 3*2*4)
+        self.assertEqual(serial[0], max(scores))
+        random.seed(0)
+        pooled = climb_hill(ElasticNet, self.dh.input_data, self.dh.target_data, param_dict, score_func,
+                            num_steps=3, num_restarts=2, num_proposals=4, processors=2)
+        self.assertEqual(pooled, serial)
+
 class TestRandomizer(unittest.TestCase):
 
     def test_shuffle_data(self):